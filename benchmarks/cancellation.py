@@ -0,0 +1,139 @@
+"""
+取消与截止时间检查
+使用微型模型验证取消令牌能及时释放工作线程：
+
+- cancel: 长任务执行几步后取消，测量从取消到工作线程空闲的延迟，
+  以及排在其后的短任务比“长任务跑完”提前多少完成
+- deadline: 设置短于完整生成时间的 timeout，测量超过截止时间后多久中止
+- 中止后残留的张量数量（应与正常完成后相同，中间潜变量已释放）
+
+任一检查失败时以非零状态退出。
+
+用法:
+    python benchmarks/cancellation.py
+    python benchmarks/cancellation.py --long-steps 60 --cancel-after 5
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+import torch  # noqa: E402
+
+from benchmarks.suite import PROMPT, control_image  # noqa: E402
+from benchmarks.tiny_models import TINY_LORAS, build_all  # noqa: E402
+
+
+def live_tensors() -> int:
+    """当前存活的张量数量"""
+    gc.collect()
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, torch.Tensor))
+
+
+def wait_for(predicate, timeout: float, interval: float = 0.01) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='取消与截止时间检查')
+    parser.add_argument('--models', default='data/benchmarks/tiny')
+    parser.add_argument('--long-steps', type=int, default=40, help='被取消任务的推理步数')
+    parser.add_argument('--short-steps', type=int, default=4, help='排在其后的任务的推理步数')
+    parser.add_argument('--cancel-after', type=int, default=3, help='执行多少步后取消')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    config_path = build_all(Path(args.models))
+
+    from src.core.cancellation import DeadlineExceeded
+    from src.core.image_generator import ImageGenerator
+    from src.core.job_queue import JobQueue, JobStatus
+
+    generator = ImageGenerator(str(config_path))
+    lora = next(iter(TINY_LORAS))
+    image = control_image()
+    request = {'cad_input': image, 'prompt': PROMPT, 'lora_name': lora, 'num_images': 1, 'seed': args.seed}
+    failures = []
+
+    # 预热，并测量完整长任务的耗时与正常完成后的张量数量
+    generator.generate_from_cad(**request, num_inference_steps=args.short_steps)
+    start = time.perf_counter()
+    result = generator.generate_from_cad(**request, num_inference_steps=args.long_steps)
+    full_seconds = time.perf_counter() - start
+    del result
+    baseline_tensors = live_tensors()
+    step_seconds = full_seconds / args.long_steps
+    print(f"完整长任务: {full_seconds:.2f}s（{args.long_steps} 步，约 {step_seconds * 1000:.1f}ms/步）")
+
+    # 1. 执行中取消：排在后面的短任务应立即开始
+    queue = JobQueue(generator, preview_interval=0)
+    long_job = queue.submit(**request, num_inference_steps=args.long_steps)
+    short_job = queue.submit(**request, num_inference_steps=args.short_steps)
+    wait_for(lambda: long_job.step >= args.cancel_after, timeout=full_seconds * 5)
+
+    # finished_at 使用 time.time()，计算短任务完成时间需取同一时钟
+    cancel_time = time.perf_counter()
+    cancel_wall_time = time.time()
+    queue.cancel(long_job.id)
+    wait_for(lambda: long_job.finished, timeout=full_seconds * 5)
+    release_latency = time.perf_counter() - cancel_time
+    wait_for(lambda: short_job.finished, timeout=full_seconds * 5)
+    short_done = short_job.finished_at - cancel_wall_time
+    queue.stop()
+
+    print(f"取消: 长任务停在第 {long_job.step}/{args.long_steps} 步，状态 {long_job.status}")
+    print(f"  取消到工作线程空闲: {release_latency * 1000:.1f}ms")
+    print(f"  后续短任务在取消后 {short_done:.2f}s 完成（不取消需再等待约 "
+          f"{full_seconds - args.cancel_after * step_seconds:.2f}s）")
+    if long_job.status != JobStatus.CANCELLED or long_job.step >= args.long_steps:
+        failures.append("长任务未被取消")
+    if short_job.status != JobStatus.COMPLETED:
+        failures.append(f"短任务未完成: {short_job.status} {short_job.error}")
+    if release_latency > max(step_seconds * 3, 0.5):
+        failures.append(f"取消后 {release_latency:.2f}s 才释放工作线程")
+    del long_job, short_job
+
+    # 2. 截止时间：只给完整耗时的一半
+    timeout = full_seconds / 2
+    start = time.perf_counter()
+    try:
+        generator.generate_from_cad(**request, num_inference_steps=args.long_steps, timeout=timeout)
+        failures.append("截止时间未生效")
+    except DeadlineExceeded:
+        overrun = time.perf_counter() - start - timeout
+        print(f"截止时间: timeout={timeout:.2f}s，超出 {overrun * 1000:.1f}ms 后中止")
+        if overrun > max(step_seconds * 3, 0.5):
+            failures.append(f"超过截止时间 {overrun:.2f}s 才中止")
+
+    # 3. 中止后中间张量应已释放
+    leaked = live_tensors() - baseline_tensors
+    print(f"中止后新增存活张量: {leaked}")
+    if leaked > 0:
+        failures.append(f"中止后残留 {leaked} 个张量")
+
+    generator.cleanup()
+
+    if failures:
+        print("\n检查失败:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("\n全部检查通过")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+冷启动基准测试
+对比从diffusers模型目录加载与从模型快照挂载的冷启动耗时
+
+每种方式在全新的子进程中运行，计时包含导入diffusers、构建管道、
+移动到设备以及启用attention slicing，不包含解释器本身的启动。
+
+用法:
+    python benchmarks/cold_start.py --model models/stable-diffusion-v1-5
+    python benchmarks/cold_start.py --model models/stable-diffusion-v1-5 --snapshot data/cache/snapshots/base_model.safetensors --repeat 3
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+_FROM_PRETRAINED = '''
+import time, json
+start = time.perf_counter()
+import torch
+from diffusers import StableDiffusionPipeline
+pipe = StableDiffusionPipeline.from_pretrained(
+    {model!r}, torch_dtype=torch.float32, safety_checker=None, requires_safety_checker=False
+)
+pipe = pipe.to({device!r})
+pipe.enable_attention_slicing()
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+'''
+
+_FROM_SNAPSHOT = '''
+import sys, time, json
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+from src.core.model_snapshot import load_snapshot
+pipe = load_snapshot({snapshot!r})
+pipe = pipe.to({device!r})
+pipe.enable_attention_slicing()
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+'''
+
+_CREATE_SNAPSHOT = '''
+import sys, torch
+sys.path.insert(0, {root!r})
+from diffusers import StableDiffusionPipeline
+from src.core.model_snapshot import save_snapshot
+pipe = StableDiffusionPipeline.from_pretrained(
+    {model!r}, torch_dtype=torch.float32, safety_checker=None, requires_safety_checker=False
+)
+save_snapshot(pipe, {snapshot!r}, source_model={model!r})
+'''
+
+
+def run_script(script: str) -> float:
+    """在子进程中运行脚本并返回其报告的耗时"""
+    proc = subprocess.run([sys.executable, '-c', script], cwd=PROJECT_ROOT,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return json.loads(proc.stdout.strip().splitlines()[-1])['seconds']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='冷启动基准测试')
+    parser.add_argument('--model', required=True, help='diffusers模型目录')
+    parser.add_argument('--snapshot', help='快照路径，不存在时自动生成')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='将结果写入JSON文件')
+    args = parser.parse_args()
+
+    model_dir = Path(args.model)
+    snapshot = args.snapshot or str(model_dir.parent / f"{model_dir.name}.snapshot.safetensors")
+    if not Path(snapshot).exists():
+        print(f"生成快照: {snapshot}")
+        subprocess.run([sys.executable, '-c', _CREATE_SNAPSHOT.format(
+            root=str(PROJECT_ROOT), model=args.model, snapshot=snapshot)], check=True)
+
+    results = {'from_pretrained': [], 'snapshot': []}
+    for _ in range(args.repeat):
+        results['from_pretrained'].append(run_script(
+            _FROM_PRETRAINED.format(model=args.model, device=args.device)))
+        results['snapshot'].append(run_script(
+            _FROM_SNAPSHOT.format(root=str(PROJECT_ROOT), snapshot=snapshot, device=args.device)))
+
+    summary = {name: min(times) for name, times in results.items()}
+    summary['speedup'] = summary['from_pretrained'] / summary['snapshot']
+
+    print(f"from_pretrained: {summary['from_pretrained']:.2f}s")
+    print(f"snapshot:        {summary['snapshot']:.2f}s")
+    print(f"加速比:          {summary['speedup']:.2f}x")
+
+    if args.json:
+        output_path = Path(args.json)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(json.dumps({'runs': results, 'summary': summary}, indent=2),
+                               encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+UNet编译变体缓存基准
+对比未编译、按需编译（无预热）与启动预热三种配置下每个分辨率首个请求和后续请求的耗时，
+以及引擎启动耗时，用于选择 hardware.compile 的 warmup_shapes 与 compile_after。
+重复运行时inductor编译产物从 cache_dir 复用，可对比首次运行与重启后的启动耗时。
+
+用法:
+    python benchmarks/compile_cache.py                                   # 使用微型模型
+    python benchmarks/compile_cache.py --config configs/config.yaml --sizes 512 640 --warmup-sizes 512 --steps 20
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import yaml  # noqa: E402
+
+from benchmarks.suite import PROMPT  # noqa: E402
+
+# 配置名称 -> hardware.compile 覆盖项（warmup_shapes 由 --warmup-sizes 填充）
+MODES = {
+    'eager': {'enabled': False},
+    'on_demand': {'enabled': True, 'compile_after': 1, 'warmup_shapes': []},
+    'warmed': {'enabled': True, 'compile_after': 1},
+}
+
+
+def write_compile_config(config_path: str, output_dir: Path, mode: str, warmup_shapes, cache_dir: str) -> str:
+    """写出指定编译配置的配置副本（预热不经过ControlNet管道）"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    compile_config = config['hardware'].setdefault('compile', {})
+    compile_config.update({'warmup_shapes': warmup_shapes, 'warmup_controlnet': None, 'cache_dir': cache_dir})
+    compile_config.update(MODES[mode])
+    config['hardware'].setdefault('cpu_optimization', {})['compile'] = False
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / f'config_{mode}.yaml'
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+    return str(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UNet编译变体缓存基准')
+    parser.add_argument('--config', help='配置文件，默认生成并使用微型模型')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--sizes', type=int, nargs='+', help='请求的分辨率，默认使用配置中的宽度及其1.5倍')
+    parser.add_argument('--warmup-sizes', type=int, nargs='+', help='预热的分辨率，默认为第一个请求分辨率')
+    parser.add_argument('--num-images', type=int, default=1)
+    parser.add_argument('--steps', type=int, help='推理步数，默认使用配置')
+    parser.add_argument('--repeats', type=int, default=2, help='每个分辨率的后续请求数')
+    parser.add_argument('--output', default='data/benchmarks/compile_cache')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    output_dir = Path(args.output)
+    config_path = args.config
+    if config_path is None:
+        from benchmarks.tiny_models import build_all
+        config_path = str(build_all(PROJECT_ROOT / 'data' / 'benchmarks' / 'tiny'))
+
+    from src.core.ai_engine import AIEngine
+    from src.core.config import read_config
+
+    base_config = read_config(config_path)
+    width = base_config.generation.width
+    sizes = args.sizes or [width, width * 3 // 2 // 8 * 8]
+    warmup_shapes = [[args.num_images, size, size] for size in (args.warmup_sizes or sizes[:1])]
+    steps = args.steps or base_config.generation.num_inference_steps
+
+    results = {}
+    print(f"{'配置':<12}{'启动(s)':>10}{'分辨率':>8}{'首个请求(s)':>14}{'后续请求(s)':>14}")
+    for mode in args.modes:
+        mode_config = write_compile_config(
+            config_path, output_dir, mode, warmup_shapes, str(output_dir / 'inductor_cache')
+        )
+        start = time.perf_counter()
+        engine = AIEngine(read_config(mode_config))
+        startup = time.perf_counter() - start
+        results[mode] = {'startup_seconds': startup, 'sizes': {}}
+
+        for size in sizes:
+            timings = []
+            for _ in range(1 + args.repeats):
+                start = time.perf_counter()
+                engine.generate_images(PROMPT, num_images=args.num_images, seed=args.seed, width=size,
+                                       height=size, num_inference_steps=steps)
+                timings.append(time.perf_counter() - start)
+            first, steady = timings[0], min(timings[1:] or timings)
+            results[mode]['sizes'][size] = {'first_seconds': first, 'steady_seconds': steady}
+            print(f"{mode:<12}{startup:>10.2f}{size:>8}{first:>14.3f}{steady:>14.3f}")
+
+        if engine.compiled_unet is not None:
+            results[mode]['variants'] = engine.compiled_unet.stats()
+        engine.cleanup()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / 'results.json').write_text(json.dumps(results, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
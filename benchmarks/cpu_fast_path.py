@@ -0,0 +1,140 @@
+"""
+CPU推理快速路径基准测试
+对比float32基线与bfloat16 / int8 / channels_last / torch.compile各配置的
+单图延迟，并以相同随机种子下与基线输出的PSNR衡量质量损失
+
+用法:
+    python benchmarks/cpu_fast_path.py --model models/stable-diffusion-v1-5
+    python benchmarks/cpu_fast_path.py --model models/stable-diffusion-v1-5 --variants baseline bf16 int8 --steps 20 --size 512
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.core.compiled_unet import CompiledUNet  # noqa: E402
+from src.core.config import CompileConfig  # noqa: E402
+from src.core.cpu_optimizer import CPUInferenceOptimizer  # noqa: E402
+
+# 变体名称 -> hardware.cpu_optimization 配置
+VARIANTS = {
+    'baseline': {'dtype': 'float32', 'channels_last': False},
+    'channels_last': {'dtype': 'float32', 'channels_last': True},
+    'bf16': {'dtype': 'bfloat16', 'channels_last': True},
+    'int8': {'dtype': 'float32', 'channels_last': True, 'quantize_int8': True},
+    'compile': {'dtype': 'float32', 'channels_last': True, 'compile': True, 'warmup_steps': 2},
+    'bf16_compile': {'dtype': 'bfloat16', 'channels_last': True, 'compile': True, 'warmup_steps': 2},
+}
+
+PROMPT = "morphyrichards, electric kettle, modern design, white color, studio lighting"
+
+
+def load_pipeline(model_path: str):
+    from diffusers import StableDiffusionPipeline
+
+    return StableDiffusionPipeline.from_pretrained(
+        model_path, torch_dtype=torch.float32, safety_checker=None, requires_safety_checker=False
+    )
+
+
+def psnr(reference: np.ndarray, image: np.ndarray) -> float:
+    """计算两张uint8图像的PSNR (dB)"""
+    mse = np.mean((reference.astype(np.float64) - image.astype(np.float64)) ** 2)
+    if mse == 0:
+        return float('inf')
+    return float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def run_variant(model_path: str, variant: str, args) -> dict:
+    """加载管道、应用变体配置并测量延迟"""
+    optimizer = CPUInferenceOptimizer({'num_threads': args.threads, **VARIANTS[variant]})
+    pipeline = load_pipeline(model_path)
+    optimizer.optimize_pipeline(pipeline)
+    optimizer.quantize(pipeline)
+
+    def generate(steps):
+        with torch.inference_mode(), optimizer.inference_context():
+            return pipeline(
+                PROMPT,
+                num_inference_steps=steps,
+                width=args.size,
+                height=args.size,
+                generator=torch.Generator('cpu').manual_seed(args.seed),
+                output_type='np'
+            ).images[0]
+
+    if optimizer.compile:
+        # 编译变体在预热中生成，不计入延迟
+        pipeline.unet = CompiledUNet(pipeline.unet, CompileConfig(enabled=True, mode=optimizer.compile_mode,
+                                                                  cache_dir=None))
+        with pipeline.unet.warming():
+            generate(max(optimizer.warmup_steps, 1))
+
+    latencies = []
+    image = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        image = generate(args.steps)
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        'latency_s': min(latencies),
+        'latencies_s': latencies,
+        'image': (np.clip(image, 0, 1) * 255).round().astype(np.uint8),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU推理快速路径基准测试')
+    parser.add_argument('--model', required=True, help='diffusers模型目录')
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=0, help='intra-op线程数，0表示全部可用CPU')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='将结果写入JSON文件')
+    args = parser.parse_args()
+
+    # 线程数只在进程内设置一次
+    CPUInferenceOptimizer({'num_threads': args.threads}).configure_threads()
+
+    variants = args.variants if 'baseline' in args.variants else ['baseline'] + args.variants
+    results = {}
+    reference = None
+    for variant in variants:
+        print(f"运行 {variant} ...", flush=True)
+        outcome = run_variant(args.model, variant, args)
+        if reference is None:
+            reference = outcome['image']
+        results[variant] = {
+            'latency_s': round(outcome['latency_s'], 3),
+            'latencies_s': [round(t, 3) for t in outcome['latencies_s']],
+            'psnr_db': round(psnr(reference, outcome['image']), 2),
+        }
+
+    baseline_latency = results['baseline']['latency_s']
+    print(f"\n{'变体':<16}{'延迟(s)':>10}{'加速比':>10}{'PSNR(dB)':>12}")
+    for variant, info in results.items():
+        info['speedup'] = round(baseline_latency / info['latency_s'], 2)
+        print(f"{variant:<16}{info['latency_s']:>10.2f}{info['speedup']:>10.2f}{info['psnr_db']:>12.2f}")
+
+    if args.json:
+        output_path = Path(args.json)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(json.dumps({
+            'config': {'steps': args.steps, 'size': args.size, 'threads': torch.get_num_threads()},
+            'results': results,
+        }, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+导入耗时基准测试
+基于 `python -X importtime` 测量核心模块的导入耗时，超过阈值时返回非零退出码
+
+用法:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --json results/import_time.json --repeat 5
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# 模块 -> 累计导入耗时阈值（毫秒）
+IMPORT_THRESHOLDS_MS = {
+    'src.core': 50,
+    'src.utils.cad_processor': 400,
+    'src.main': 100,
+}
+
+# `python src/main.py --help` 总耗时阈值（毫秒，包含解释器启动）
+CLI_HELP_THRESHOLD_MS = 500
+
+# 任何出现在 `import src.core` / `src.main` 中都说明延迟导入失效的模块
+FORBIDDEN_EAGER_IMPORTS = {
+    'src.core': ['torch', 'diffusers', 'transformers', 'controlnet_aux', 'safetensors'],
+    'src.main': ['torch', 'diffusers', 'transformers', 'streamlit'],
+}
+
+
+def parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    """
+    解析 -X importtime 输出
+
+    Args:
+        stderr: 子进程标准错误输出
+
+    Returns:
+        Dict[str, Tuple[int, int]]: 模块名 -> (自身耗时us, 累计耗时us)
+    """
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            _, values = line.split(':', 1)
+            self_us, cumulative_us, name = values.split('|', 2)
+            timings[name.strip()] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue
+    return timings
+
+
+def measure_import(module: str) -> Dict[str, Tuple[int, int]]:
+    """在全新解释器中导入模块并返回导入耗时"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+    return parse_importtime(proc.stderr)
+
+
+def measure_cli_help() -> float:
+    """测量 `python src/main.py --help` 的总耗时（毫秒）"""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, 'src/main.py', '--help'],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"main.py --help 失败:\n{proc.stderr[-2000:]}")
+    return elapsed_ms
+
+
+def top_imports(timings: Dict[str, Tuple[int, int]], limit: int = 10) -> List[Tuple[str, int]]:
+    """按自身耗时排序的最慢模块"""
+    ranked = sorted(timings.items(), key=lambda item: item[1][0], reverse=True)
+    return [(name, self_us) for name, (self_us, _) in ranked[:limit]]
+
+
+def run(repeat: int) -> Dict:
+    """运行全部测量，取多次运行的最小值以降低噪声"""
+    results = {'imports': {}, 'cli_help_ms': None, 'failures': []}
+
+    for module, threshold_ms in IMPORT_THRESHOLDS_MS.items():
+        best_ms = None
+        best_timings = {}
+        for _ in range(repeat):
+            timings = measure_import(module)
+            cumulative_ms = timings.get(module, (0, 0))[1] / 1000
+            if best_ms is None or cumulative_ms < best_ms:
+                best_ms = cumulative_ms
+                best_timings = timings
+
+        forbidden = [m for m in FORBIDDEN_EAGER_IMPORTS.get(module, []) if m in best_timings]
+        results['imports'][module] = {
+            'cumulative_ms': round(best_ms, 2),
+            'threshold_ms': threshold_ms,
+            'eager_heavy_imports': forbidden,
+            'slowest': top_imports(best_timings),
+        }
+        if best_ms > threshold_ms:
+            results['failures'].append(f"{module}: {best_ms:.1f}ms > {threshold_ms}ms")
+        if forbidden:
+            results['failures'].append(f"{module}: 导入时加载了重量级模块 {forbidden}")
+
+    cli_ms = min(measure_cli_help() for _ in range(repeat))
+    results['cli_help_ms'] = round(cli_ms, 2)
+    if cli_ms > CLI_HELP_THRESHOLD_MS:
+        results['failures'].append(f"main.py --help: {cli_ms:.1f}ms > {CLI_HELP_THRESHOLD_MS}ms")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导入耗时基准测试')
+    parser.add_argument('--repeat', type=int, default=3, help='每项测量的重复次数')
+    parser.add_argument('--json', help='将结果写入JSON文件')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+
+    for module, info in results['imports'].items():
+        print(f"{module:<28} {info['cumulative_ms']:>8.1f} ms  (阈值 {info['threshold_ms']} ms)")
+        for name, self_us in info['slowest'][:5]:
+            print(f"    {name:<40} {self_us / 1000:>8.1f} ms")
+    print(f"{'main.py --help':<28} {results['cli_help_ms']:>8.1f} ms  (阈值 {CLI_HELP_THRESHOLD_MS} ms)")
+
+    if args.json:
+        output_path = Path(args.json)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    if results['failures']:
+        print("\n导入耗时回归:")
+        for failure in results['failures']:
+            print(f"  - {failure}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
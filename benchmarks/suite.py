@@ -0,0 +1,400 @@
+"""
+可复现的基准测试套件
+使用本地生成的微型随机模型（见 tiny_models.py），不访问网络，测量：
+
+- generate_from_cad 端到端延迟
+- generate_batch 吞吐量随批量大小的变化（逐个生成与跨请求打包对比）
+- CFG截断的耗时与画质差异
+- 只改提示词或ControlNet强度时的重新生成耗时
+- ControlNet只作用于部分去噪步时的耗时与画质差异
+- LoRA首次加载、卸载和切换耗时
+- 控制图预处理吞吐量
+- CAD网格加载与渲染耗时
+- 冷启动耗时（全新子进程中初始化ImageGenerator）
+
+结果写入JSON，并与保存的基线比较，超出容差的指标标记为性能回退。
+
+用法:
+    python benchmarks/suite.py                          # 运行并与 benchmarks/baseline.json 比较
+    python benchmarks/suite.py --save-baseline          # 运行并保存为新基线
+    python benchmarks/suite.py --only generate lora --json data/benchmarks/result.json --check
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+# 禁止访问HuggingFace Hub，保证只使用本地模型
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+import torch  # noqa: E402
+
+from benchmarks.tiny_models import IMAGE_SIZE, TINY_LORAS, build_all  # noqa: E402
+
+DEFAULT_BASELINE = PROJECT_ROOT / 'benchmarks' / 'baseline.json'
+PROMPT = "kettle, modern design, white color"
+
+_COLD_START = '''
+import sys, time, json
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+from src.core.image_generator import ImageGenerator
+generator = ImageGenerator({config!r})
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+'''
+
+
+def metric(value: float, unit: str, higher_is_better: bool = False) -> Dict:
+    return {'value': round(float(value), 6), 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def timed(function: Callable, repeat: int) -> List[float]:
+    """重复执行并返回每次耗时"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def control_image(size: int = IMAGE_SIZE) -> np.ndarray:
+    """确定性的合成CAD线稿（矩形与圆）"""
+    import cv2
+
+    image = np.full((size, size, 3), 255, dtype=np.uint8)
+    margin = size // 6
+    cv2.rectangle(image, (margin, margin * 2), (size - margin, size - margin), (0, 0, 0), 2)
+    cv2.circle(image, (size // 2, margin * 2), margin, (0, 0, 0), 2)
+    return image
+
+
+def bench_generate(generator, args) -> Dict:
+    """generate_from_cad 端到端延迟（首次调用作为预热，另行记录）"""
+    lora = next(iter(TINY_LORAS))
+    image = control_image()
+
+    def run():
+        return generator.generate_from_cad(image, PROMPT, lora_name=lora, num_images=1, seed=args.seed)
+
+    first = timed(run, 1)[0]
+    durations = timed(run, args.repeat)
+    result = run()
+    metrics = {
+        'generate.first_call_s': metric(first, 's'),
+        'generate.latency_s': metric(min(durations), 's'),
+        'generate.latency_median_s': metric(float(np.median(durations)), 's'),
+    }
+    for stage, seconds in result['timings'].items():
+        metrics[f"generate.stage.{stage}_s"] = metric(seconds, 's')
+    return metrics
+
+
+def bench_batch(generator, args) -> Dict:
+    """generate_batch 吞吐量（图像/秒）随批量大小的变化，逐个生成与打包为一次管道调用对比"""
+    lora = next(iter(TINY_LORAS))
+    image = control_image()
+    metrics = {}
+    original_config = generator.generation_config
+    try:
+        for batch_size in args.batch_sizes:
+            prompts = [f"{PROMPT}, variant {i}" for i in range(batch_size)]
+
+            def run():
+                generator.generate_batch([image] * batch_size, prompts,
+                                         lora_name=lora, num_images=1, seed=args.seed)
+
+            for mode, pack in (('sequential', 1), ('packed', batch_size)):
+                if mode == 'packed' and batch_size == 1:
+                    continue
+                generator.generation_config = replace(original_config, pack_requests=pack)
+                seconds = min(timed(run, args.repeat))
+                name = f"batch.size_{batch_size}.images_per_s" if mode == 'sequential' \
+                    else f"batch.size_{batch_size}.packed_images_per_s"
+                metrics[name] = metric(batch_size / seconds, 'images/s', True)
+    finally:
+        generator.generation_config = original_config
+    return metrics
+
+
+def psnr(a, b) -> float:
+    """两张图像的峰值信噪比（dB）"""
+    mse = np.mean((np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def bench_cfg(generator, args) -> Dict:
+    """CFG截断的耗时与画质（与全程CFG结果比较PSNR）"""
+    lora = next(iter(TINY_LORAS))
+    image = control_image()
+
+    def run(truncation=1.0):
+        return generator.generate_from_cad(image, PROMPT, lora_name=lora, num_images=1, seed=args.seed,
+                                           cfg_truncation=truncation)
+
+    reference = run()['images'][0]
+    metrics = {'cfg.full_s': metric(min(timed(run, args.repeat)), 's')}
+    for truncation in (0.5, 0.25):
+        label = f"truncate_{int(truncation * 100)}"
+        metrics[f"cfg.{label}_s"] = metric(min(timed(lambda: run(truncation), args.repeat)), 's')
+        metrics[f"cfg.{label}_psnr_db"] = metric(
+            min(psnr(run(truncation)['images'][0], reference), 99.0), 'dB', True)
+    return metrics
+
+
+def bench_regenerate(generator, args) -> Dict:
+    """同一CAD输入和种子上只改提示词或ControlNet强度时的重新生成耗时（增量重新生成缓存）"""
+    lora = next(iter(TINY_LORAS))
+    image = control_image()
+    if generator.regeneration_cache is not None:
+        generator.regeneration_cache.clear()
+
+    def run(prompt=PROMPT, scale=1.0):
+        generator.generate_from_cad(image, prompt, lora_name=lora, num_images=1, seed=args.seed,
+                                    controlnet_conditioning_scale=scale)
+
+    cold = timed(run, 1)[0]
+    # 每次修改为不同的值，只复用不受影响的中间结果
+    edits = iter(range(1, 2 * args.repeat + 1))
+    prompt_edits = timed(lambda: run(prompt=f"{PROMPT}, variant {next(edits)}"), args.repeat)
+    scale_edits = timed(lambda: run(scale=1.0 - 0.05 * next(edits)), args.repeat)
+    return {
+        'regenerate.cold_s': metric(cold, 's'),
+        'regenerate.prompt_edit_s': metric(min(prompt_edits), 's'),
+        'regenerate.scale_edit_s': metric(min(scale_edits), 's'),
+    }
+
+
+def bench_controlnet_range(generator, args) -> Dict:
+    """只在前半程去噪步计算ControlNet时的耗时，以及与全程计算结果的差异（PSNR）"""
+    lora = next(iter(TINY_LORAS))
+    image = control_image()
+    processor = generator.ai_engine.controlnet_processor
+    if generator.regeneration_cache is not None:
+        generator.regeneration_cache.clear()
+
+    def run(end=1.0):
+        return generator.generate_from_cad(image, PROMPT, lora_name=lora, num_images=1, seed=args.seed,
+                                           control_guidance_end=end)
+
+    reference = run()['images'][0]
+    metrics = {'controlnet_range.full_s': metric(min(timed(run, args.repeat)), 's')}
+    original_config = processor.config
+    try:
+        for mode in ('drop', 'reuse'):
+            processor.config = replace(original_config, outside_range=mode)
+            seconds = min(timed(lambda: run(0.5), args.repeat))
+            metrics[f"controlnet_range.half_{mode}_s"] = metric(seconds, 's')
+            metrics[f"controlnet_range.half_{mode}_psnr_db"] = metric(
+                min(psnr(run(0.5)['images'][0], reference), 99.0), 'dB', True)
+    finally:
+        processor.config = original_config
+    return metrics
+
+
+def bench_lora(generator, args) -> Dict:
+    """LoRA首次加载（读文件+计算增量+融合）、卸载和切换（命中增量缓存）耗时"""
+    engine = generator.ai_engine
+    lora_a, lora_b = list(TINY_LORAS)
+    for name in engine.lora_manager.get_loaded_loras():
+        engine.unload_lora(name)
+    engine.lora_manager.clear_caches()
+
+    def load(name):
+        start = time.perf_counter()
+        if not engine.load_lora(name):
+            raise RuntimeError(f"LoRA {name} 加载失败")
+        return time.perf_counter() - start
+
+    def unload(name):
+        start = time.perf_counter()
+        engine.unload_lora(name)
+        return time.perf_counter() - start
+
+    first_load = load(lora_a)
+    unload_time = unload(lora_a)
+    load(lora_b)
+    unload(lora_b)
+
+    swaps = []
+    for _ in range(args.repeat):
+        # 切换：卸载当前LoRA并加载另一个（两者增量均已缓存）
+        swaps.append(load(lora_a) + unload(lora_a))
+        swaps.append(load(lora_b) + unload(lora_b))
+
+    return {
+        'lora.first_load_s': metric(first_load, 's'),
+        'lora.unload_s': metric(unload_time, 's'),
+        'lora.swap_s': metric(min(swaps), 's'),
+    }
+
+
+def bench_control_maps(generator, args) -> Dict:
+    """控制图预处理吞吐量（张/秒，512x512输入）"""
+    processor = generator.ai_engine.controlnet_processor
+    image = control_image(512)
+    metrics = {}
+    for method in ('canny', 'sketch'):
+        count = args.control_iterations
+        seconds = min(timed(lambda: [processor.process_cad_input(image, method) for _ in range(count)],
+                            args.repeat))
+        metrics[f"control_map.{method}.maps_per_s"] = metric(count / seconds, 'maps/s', True)
+    return metrics
+
+
+def bench_cad(generator, args) -> Dict:
+    """CAD网格加载与渲染耗时（渲染需要OpenGL上下文，不可用时跳过）"""
+    import trimesh
+
+    from src.utils.cad_processor import CADProcessor
+
+    mesh_path = Path(args.models) / 'cad' / 'sample.stl'
+    processor = CADProcessor(generator.ai_engine.config['input'].get('tessellation'))
+
+    load_time = min(timed(lambda: trimesh.load(str(mesh_path)), args.repeat))
+    metrics = {'cad.mesh_load_s': metric(load_time, 's')}
+
+    mesh = trimesh.load(str(mesh_path))
+    try:
+        render_time = min(timed(lambda: processor._render_mesh(mesh), args.repeat))
+        metrics['cad.render_s'] = metric(render_time, 's')
+    except Exception as e:
+        print(f"  跳过CAD渲染（{type(e).__name__}: {e}）")
+    return metrics
+
+
+def bench_cold_start(config_path: Path, args) -> Dict:
+    """全新子进程中导入并初始化ImageGenerator的耗时"""
+    durations = []
+    script = _COLD_START.format(root=str(PROJECT_ROOT), config=str(config_path))
+    for _ in range(args.repeat):
+        proc = subprocess.run([sys.executable, '-c', script], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr[-2000:])
+        durations.append(json.loads(proc.stdout.strip().splitlines()[-1])['seconds'])
+    return {'cold_start.init_s': metric(min(durations), 's')}
+
+
+BENCHMARKS = ['generate', 'batch', 'cfg', 'regenerate', 'controlnet_range', 'lora', 'control_maps', 'cad', 'cold_start']
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    与基线比较
+
+    Returns:
+        List[str]: 回退的指标名称
+    """
+    regressions = []
+    print(f"\n{'指标':<44}{'当前':>12}{'基线':>12}{'变化':>10}")
+    for name, current in results['metrics'].items():
+        reference = baseline.get('metrics', {}).get(name)
+        if reference is None or not reference['value']:
+            print(f"{name:<44}{current['value']:>12.4f}{'-':>12}{'':>10}")
+            continue
+
+        change = current['value'] / reference['value'] - 1
+        worse = -change if current['higher_is_better'] else change
+        flag = ''
+        if worse > tolerance:
+            regressions.append(name)
+            flag = '  回退'
+        print(f"{name:<44}{current['value']:>12.4f}{reference['value']:>12.4f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='微型模型基准测试套件')
+    parser.add_argument('--models', default='data/benchmarks/tiny', help='微型模型目录（不存在时自动生成）')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--control-iterations', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=4, help='torch intra-op线程数，固定以便结果可比')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='将结果写入JSON文件')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='基线JSON文件')
+    parser.add_argument('--save-baseline', action='store_true', help='将本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='允许的相对退化比例')
+    parser.add_argument('--check', action='store_true', help='存在回退时以非零状态退出')
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+
+    config_path = build_all(Path(args.models), steps=args.steps)
+    print(f"微型模型配置: {config_path}")
+
+    from src.core.image_generator import ImageGenerator
+
+    generator = ImageGenerator(str(config_path))
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'threads': args.threads,
+            'steps': args.steps,
+            'image_size': IMAGE_SIZE,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'metrics': {},
+    }
+
+    for name in args.only:
+        print(f"运行 {name} ...", flush=True)
+        if name == 'cold_start':
+            metrics = bench_cold_start(config_path, args)
+        else:
+            metrics = globals()[f"bench_{name}"](generator, args)
+        results['metrics'].update(metrics)
+
+    generator.cleanup()
+
+    if args.json:
+        output_path = Path(args.json)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"\n基线已保存: {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        for name, info in results['metrics'].items():
+            print(f"{name:<44}{info['value']:>12.4f} {info['unit']}")
+        print(f"\n未找到基线 {baseline_path}，使用 --save-baseline 保存")
+        return
+
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+    if baseline.get('meta', {}).get('threads') != args.threads:
+        print("警告: 基线使用的线程数不同，结果不可直接比较")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} 项指标回退超过 {args.tolerance:.0%}: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+    else:
+        print("\n未发现性能回退")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+基准测试用的微型模型
+在本地生成随机初始化的微型Stable Diffusion管道、ControlNet、LoRA以及示例CAD网格，
+并写出指向这些模型的配置文件。全程不访问网络，相同种子生成的权重完全一致。
+
+用法:
+    python benchmarks/tiny_models.py --output data/benchmarks/tiny
+"""
+
+import argparse
+import copy
+import json
+import sys
+from pathlib import Path
+
+import yaml
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# 微型模型的隐藏维度与文本嵌入维度
+HIDDEN_SIZE = 32
+BLOCK_OUT_CHANNELS = (32, 64)
+
+# 微型管道的输出分辨率：两级VAE下采样倍数为2，潜空间为32x32
+IMAGE_SIZE = 64
+
+# LoRA作用的注意力投影层
+ATTENTION_PROJECTIONS = ('.to_q', '.to_k', '.to_v', '.to_out.0')
+
+# LoRA名称 -> 触发词
+TINY_LORAS = {
+    'tiny_lora_a': 'tinya',
+    'tiny_lora_b': 'tinyb',
+}
+
+
+def _bytes_to_unicode():
+    """GPT-2/CLIP字节级BPE使用的字节到可见字符映射"""
+    printable = (list(range(ord('!'), ord('~') + 1)) + list(range(ord('¡'), ord('¬') + 1))
+                 + list(range(ord('®'), ord('ÿ') + 1)))
+    codes = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            codes.append(256 + extra)
+            extra += 1
+    return dict(zip(printable, [chr(code) for code in codes]))
+
+
+def _build_tokenizer(output_dir: Path):
+    """用字节级词表（不含合并规则）构建CLIP分词器，无需下载词表文件"""
+    from transformers import CLIPTokenizer
+
+    characters = list(_bytes_to_unicode().values())
+    tokens = characters + [c + '</w>' for c in characters] + ['<|startoftext|>', '<|endoftext|>']
+    vocab = {token: index for index, token in enumerate(tokens)}
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / 'vocab.json').write_text(json.dumps(vocab), encoding='utf-8')
+    (output_dir / 'merges.txt').write_text('#version: 0.2\n', encoding='utf-8')
+    return CLIPTokenizer(str(output_dir / 'vocab.json'), str(output_dir / 'merges.txt'), model_max_length=77)
+
+
+def build_tiny_pipeline(output_dir: Path, seed: int = 0):
+    """构建并保存微型StableDiffusionPipeline"""
+    import torch
+    from diffusers import AutoencoderKL, DDIMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    tokenizer = _build_tokenizer(output_dir / 'tokenizer_files')
+
+    torch.manual_seed(seed)
+    unet = UNet2DConditionModel(
+        block_out_channels=BLOCK_OUT_CHANNELS,
+        layers_per_block=2,
+        sample_size=IMAGE_SIZE // 2,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=('DownBlock2D', 'CrossAttnDownBlock2D'),
+        up_block_types=('CrossAttnUpBlock2D', 'UpBlock2D'),
+        cross_attention_dim=HIDDEN_SIZE,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=list(BLOCK_OUT_CHANNELS),
+        in_channels=3,
+        out_channels=3,
+        down_block_types=['DownEncoderBlock2D'] * 2,
+        up_block_types=['UpDecoderBlock2D'] * 2,
+        latent_channels=4,
+        sample_size=IMAGE_SIZE,
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+        hidden_size=HIDDEN_SIZE,
+        intermediate_size=37,
+        layer_norm_eps=1e-05,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        vocab_size=len(tokenizer),
+    ))
+    scheduler = DDIMScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule='scaled_linear',
+        clip_sample=False,
+        set_alpha_to_one=False,
+    )
+
+    pipeline = StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=unet,
+        scheduler=scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    pipeline.save_pretrained(str(output_dir / 'sd'))
+    return pipeline
+
+
+def build_tiny_controlnet(output_dir: Path, seed: int = 0):
+    """构建并保存与微型UNet匹配的ControlNet"""
+    import torch
+    from diffusers import ControlNetModel
+
+    torch.manual_seed(seed)
+    controlnet = ControlNetModel(
+        block_out_channels=BLOCK_OUT_CHANNELS,
+        layers_per_block=2,
+        in_channels=4,
+        down_block_types=('DownBlock2D', 'CrossAttnDownBlock2D'),
+        cross_attention_dim=HIDDEN_SIZE,
+        # 控制图下采样倍数与VAE一致（2倍）
+        conditioning_embedding_out_channels=(16, 32),
+    )
+    controlnet.save_pretrained(str(output_dir))
+    return controlnet
+
+
+def build_tiny_lora(unet, path: Path, rank: int = 4, seed: int = 0):
+    """为UNet注意力投影层生成kohya格式的随机LoRA"""
+    import torch
+    from safetensors.torch import save_file
+
+    generator = torch.Generator().manual_seed(seed)
+    state_dict = {}
+    for name, module in unet.named_modules():
+        if isinstance(module, torch.nn.Linear) and name.endswith(ATTENTION_PROJECTIONS):
+            key = 'lora_unet_' + name.replace('.', '_')
+            state_dict[f"{key}.lora_down.weight"] = torch.randn(
+                rank, module.in_features, generator=generator) * 0.01
+            state_dict[f"{key}.lora_up.weight"] = torch.randn(
+                module.out_features, rank, generator=generator) * 0.01
+            state_dict[f"{key}.alpha"] = torch.tensor(float(rank))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    save_file(state_dict, str(path))
+    return path
+
+
+def build_sample_mesh(path: Path):
+    """生成示例CAD网格（盒体，保存为STL）"""
+    import trimesh
+
+    mesh = trimesh.creation.box(extents=(1.0, 0.6, 0.4))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    mesh.export(str(path))
+    return path
+
+
+def write_config(output_dir: Path, steps: int = 4) -> Path:
+    """基于项目配置写出指向微型模型的配置文件"""
+    with open(PROJECT_ROOT / 'configs' / 'config.yaml', 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+
+    config = copy.deepcopy(config)
+    models = config['models']
+    models['base_model']['path'] = str(output_dir / 'sd')
+    models['base_model']['snapshot'] = str(output_dir / 'snapshot' / 'sd.safetensors')
+    models['lora'] = {
+        name: {
+            'path': str(output_dir / 'lora' / f"{name}.safetensors"),
+            'trigger_word': trigger,
+            'weight': 0.8,
+            'enabled': True,
+        }
+        for name, trigger in TINY_LORAS.items()
+    }
+    models['controlnet']['models'] = {
+        method: str(output_dir / 'controlnet') for method in ('canny', 'sketch', 'depth')
+    }
+
+    config['generation'].update({
+        'num_inference_steps': steps,
+        'width': IMAGE_SIZE,
+        'height': IMAGE_SIZE,
+    })
+    config['hardware'].update({'device': 'cpu', 'use_xformers': False})
+    config['hardware']['cpu_optimization']['enabled'] = False
+    config['input']['tessellation']['cache_dir'] = str(output_dir / 'cache' / 'tessellation')
+    config['input']['tessellation']['render_resolution'] = IMAGE_SIZE
+    memory = config['performance']['memory']
+    memory['offload_dir'] = str(output_dir / 'cache' / 'offload')
+    memory['background_cleanup'] = False
+    config['performance']['tracing'].update({'enabled': True, 'chrome_trace_dir': ''})
+
+    config_path = output_dir / 'config.yaml'
+    with open(config_path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+    return config_path
+
+
+def build_all(output_dir: Path, seed: int = 0, steps: int = 4) -> Path:
+    """
+    生成全部微型模型和配置文件（已存在时跳过模型生成）
+
+    Args:
+        output_dir: 输出目录
+        seed: 随机种子
+        steps: 配置中的推理步数
+
+    Returns:
+        Path: 配置文件路径
+    """
+    output_dir = Path(output_dir).resolve()
+    marker = output_dir / 'models.json'
+    if not marker.exists() or json.loads(marker.read_text(encoding='utf-8')).get('seed') != seed:
+        pipeline = build_tiny_pipeline(output_dir, seed)
+        build_tiny_controlnet(output_dir / 'controlnet', seed)
+        for index, name in enumerate(TINY_LORAS):
+            build_tiny_lora(pipeline.unet, output_dir / 'lora' / f"{name}.safetensors", seed=seed + index)
+        build_sample_mesh(output_dir / 'cad' / 'sample.stl')
+        marker.write_text(json.dumps({'seed': seed}), encoding='utf-8')
+
+    return write_config(output_dir, steps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成基准测试用的微型模型')
+    parser.add_argument('--output', default='data/benchmarks/tiny')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--steps', type=int, default=4)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(PROJECT_ROOT))
+    config_path = build_all(Path(args.output), args.seed, args.steps)
+    print(f"微型模型配置: {config_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+令牌合并基准
+对比不同合并比例下的生成耗时，以及与不合并结果的相似度（PSNR），用于选择
+performance.token_merging 的比例与分辨率项。
+
+微型模型的最高分辨率块没有注意力层，默认 --max-downsample 2；
+真实模型使用配置中的值（通常为1）。
+
+用法:
+    python benchmarks/token_merging.py                                   # 使用微型模型
+    python benchmarks/token_merging.py --config configs/config.yaml --sizes 512 768 --ratios 0.3 0.5 --steps 20
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import yaml  # noqa: E402
+
+from benchmarks.suite import PROMPT, psnr  # noqa: E402
+
+
+def write_merging_config(config_path: str, output_dir: Path, max_downsample: int) -> str:
+    """写出启用令牌合并的配置副本"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    merging = config['performance'].setdefault('token_merging', {})
+    merging['enabled'] = True
+    if max_downsample:
+        merging['max_downsample'] = max_downsample
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / 'config_token_merging.yaml'
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+    return str(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='令牌合并基准')
+    parser.add_argument('--config', help='配置文件，默认生成并使用微型模型')
+    parser.add_argument('--sizes', type=int, nargs='+', help='输出分辨率，默认使用配置中的宽度')
+    parser.add_argument('--ratios', type=float, nargs='+', default=[0.3, 0.5, 0.7])
+    parser.add_argument('--steps', type=int, help='推理步数，默认使用配置')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--max-downsample', type=int, help='默认：微型模型为2，否则使用配置')
+    parser.add_argument('--output', default='data/benchmarks/token_merging')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    output_dir = Path(args.output)
+    config_path = args.config
+    max_downsample = args.max_downsample
+    if config_path is None:
+        from benchmarks.tiny_models import build_all
+        config_path = str(build_all(PROJECT_ROOT / 'data' / 'benchmarks' / 'tiny'))
+        max_downsample = max_downsample or 2
+
+    from src.core.ai_engine import AIEngine
+
+    engine = AIEngine(write_merging_config(config_path, output_dir, max_downsample))
+    sizes = args.sizes or [engine.config['generation']['width']]
+    steps = args.steps or engine.config['generation']['num_inference_steps']
+
+    def run(size, ratio):
+        timings = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            images = engine.generate_images(PROMPT, num_images=1, seed=args.seed, width=size, height=size,
+                                            num_inference_steps=steps, token_merge_ratio=ratio)
+            timings.append(time.perf_counter() - start)
+        return images[0], min(timings)
+
+    results = {}
+    print(f"{'分辨率':<8}{'比例':>8}{'耗时(s)':>10}{'加速':>8}{'PSNR(dB)':>10}")
+    for size in sizes:
+        run(size, 0.0)  # 预热
+        reference, baseline = run(size, 0.0)
+        reference.save(output_dir / f"{size}px_ratio_0.png")
+        print(f"{size:<8}{0.0:>8.2f}{baseline:>10.3f}{1.0:>8.2f}{'-':>10}")
+        results[size] = {'baseline_seconds': baseline, 'ratios': {}}
+
+        for ratio in args.ratios:
+            image, seconds = run(size, ratio)
+            image.save(output_dir / f"{size}px_ratio_{ratio}.png")
+            similarity = psnr(reference, image)
+            speedup = baseline / seconds
+            print(f"{size:<8}{ratio:>8.2f}{seconds:>10.3f}{speedup:>8.2f}{similarity:>10.2f}")
+            results[size]['ratios'][ratio] = {'seconds': seconds, 'speedup': speedup, 'psnr': similarity}
+
+    (output_dir / 'results.json').write_text(json.dumps(results, indent=2), encoding='utf-8')
+    engine.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+UNet块级分析
+对比不同分辨率、步数和attention slicing设置下UNet各块的耗时与注意力占比，
+为调优决策提供数据。每个配置的汇总表、火焰图折叠栈和JSON写入输出目录。
+
+用法:
+    python benchmarks/unet_profile.py                                   # 使用微型模型
+    python benchmarks/unet_profile.py --config configs/config.yaml --sizes 512 768 --steps 20
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import torch  # noqa: E402
+
+from src.core.unet_profiler import UNetProfiler  # noqa: E402
+
+PROMPT = "kettle, modern design, white color, studio lighting"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UNet块级分析')
+    parser.add_argument('--config', help='配置文件，默认生成并使用微型模型')
+    parser.add_argument('--sizes', type=int, nargs='+', help='输出分辨率，默认使用配置中的宽度')
+    parser.add_argument('--steps', type=int, nargs='+', default=[4])
+    parser.add_argument('--slicing', choices=['on', 'off', 'both'], default='both',
+                        help='是否对比attention slicing')
+    parser.add_argument('--no-flops', action='store_true', help='不统计FLOPs（减少分析开销）')
+    parser.add_argument('--output', default='data/profiles/sweep')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    config_path = args.config
+    if config_path is None:
+        from benchmarks.tiny_models import build_all
+        config_path = str(build_all(PROJECT_ROOT / 'data' / 'benchmarks' / 'tiny'))
+
+    from src.core.ai_engine import AIEngine
+
+    engine = AIEngine(config_path)
+    pipeline = engine.pipeline
+    sizes = args.sizes or [engine.config['generation']['width']]
+    slicing_options = {'on': [True], 'off': [False], 'both': [False, True]}[args.slicing]
+
+    rows = []
+    for size in sizes:
+        for steps in args.steps:
+            for slicing in slicing_options:
+                if slicing:
+                    pipeline.enable_attention_slicing()
+                else:
+                    pipeline.disable_attention_slicing()
+
+                profiler = UNetProfiler(pipeline.unet, engine.device, record_flops=not args.no_flops)
+                with torch.inference_mode(), profiler.profile():
+                    pipeline(PROMPT, num_inference_steps=steps, width=size, height=size,
+                             generator=torch.Generator('cpu').manual_seed(args.seed), output_type='latent')
+
+                report = profiler.report()
+                name = f"{size}px_{steps}steps_slicing_{'on' if slicing else 'off'}"
+                report.save(args.output, name)
+                summary = report.summary()
+                rows.append((name, summary))
+                print(f"\n== {name} ==\n{report.format_table()}")
+
+    print(f"\n{'配置':<36}{'UNet ms/步':>12}{'注意力占比':>12}{'GFLOPs/步':>12}")
+    for name, summary in rows:
+        steps = max(summary['steps'], 1)
+        print(f"{name:<36}{summary['unet_ms'] / steps:>12.1f}{summary['attention_share']:>12.1%}"
+              f"{summary['gflops'] / steps:>12.2f}")
+
+    output_path = Path(args.output)
+    output_path.mkdir(parents=True, exist_ok=True)
+    (output_path / 'sweep.json').write_text(
+        json.dumps({name: summary for name, summary in rows}, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    engine.cleanup()
+
+
+if __name__ == '__main__':
+    main()
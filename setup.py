@@ -48,6 +48,10 @@ setup(
             "flake8>=6.0.0",
             "mypy>=1.4.0",
         ],
+        "onnx": [
+            "onnx>=1.14.0",
+            "onnxruntime>=1.16.0",
+        ],
         "gpu": [
             "torch>=2.0.0+cu118",
             "torchvision>=0.15.0+cu118",
@@ -0,0 +1,3 @@
+"""
+GAT - AI辅助工业设计项目
+"""
@@ -0,0 +1,5 @@
+"""
+GAT - AI辅助工业设计项目HTTP API
+
+create_app 位于 fastapi_app 子模块，使用时再导入，避免 `import src.api` 时加载fastapi与torch。
+"""
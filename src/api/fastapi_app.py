@@ -0,0 +1,191 @@
+"""
+FastAPI服务
+提供生成接口、健康检查以及Prometheus文本格式的 /metrics 指标接口
+"""
+
+import asyncio
+import base64
+import io
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from ..core.cancellation import CancellationToken, DeadlineExceeded, GenerationCancelled
+from ..core.config import ConfigError, load_config, reload_config
+from ..core.metrics import CONTENT_TYPE, get_registry
+
+logger = logging.getLogger(__name__)
+
+
+class GenerateRequest(BaseModel):
+    """生成请求"""
+
+    cad_image: str  # base64编码的PNG/JPEG图像
+    prompt: str
+    lora_name: str = "morphy_richards"
+    controlnet_method: str = "canny"
+    num_images: int = 1
+    negative_prompt: str = ""
+    num_inference_steps: Optional[int] = None
+    guidance_scale: Optional[float] = None
+    timeout: Optional[float] = None  # 最长等待时间（秒，含排队），超时返回504
+
+
+class GenerateResponse(BaseModel):
+    """生成结果"""
+
+    images: List[str]  # base64编码的PNG图像
+    prompt: str
+    lora_used: str
+    timings: Dict[str, float]
+
+
+def _decode_image(data: str):
+    from PIL import Image
+
+    return Image.open(io.BytesIO(base64.b64decode(data))).convert('RGB')
+
+
+def _encode_image(image) -> str:
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+async def _cancel_on_disconnect(request: Request, token: CancellationToken, interval: float = 0.5):
+    """客户端断开连接时取消生成，释放工作线程"""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("客户端已断开")
+            return
+        await asyncio.sleep(interval)
+
+
+def create_app(config_path: str = "configs/config.yaml") -> FastAPI:
+    """
+    创建API应用
+
+    图像生成器在首次生成请求时才初始化，/health 和 /metrics 不依赖模型加载。
+    同一时间只执行一个生成请求，等待中的请求计入队列深度指标。
+    客户端断开或超过请求的 timeout 时，排队中的请求直接放弃，执行中的请求在下一个去噪步结束时中止。
+    POST /config/reload 重新读取配置文件，可在运行中生效的配置项变化时无需重启服务。
+
+    Args:
+        config_path: 配置文件路径
+
+    Returns:
+        FastAPI: 应用实例
+    """
+    app = FastAPI(title="GAT - AI辅助工业设计 API")
+    metrics = get_registry()
+    state = {'generator': None}
+    init_lock = threading.Lock()
+    generation_lock = threading.Lock()
+
+    def get_generator():
+        with init_lock:
+            if state['generator'] is None:
+                from ..core.image_generator import ImageGenerator
+                state['generator'] = ImageGenerator(config_path)
+            return state['generator']
+
+    @app.get("/health")
+    def health():
+        return {'status': 'ok', 'model_loaded': state['generator'] is not None}
+
+    @app.get("/metrics")
+    def export_metrics():
+        return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+    @app.post("/config/reload")
+    def reload():
+        """重新读取配置文件，应用可在运行中生效的变化（生成默认值、缓存大小等），不重启服务"""
+        try:
+            with init_lock:
+                generator = state['generator']
+                if generator is None:
+                    # 生成器尚未创建时只替换已加载的配置，创建时即使用新配置
+                    config, changes = reload_config(load_config(config_path), config_path)
+                else:
+                    changes = generator.reload_config()
+                    config = generator.config
+        except ConfigError as e:
+            # 配置无效或变化需要重启：保持原配置
+            raise HTTPException(status_code=409, detail=str(e))
+        return {'changes': changes, 'config_hash': config.hash}
+
+    def run_generation(request: GenerateRequest, cad_input, params: Dict, token: CancellationToken):
+        metrics.queue_depth.inc()
+        queued = True
+        try:
+            generator = get_generator()
+            # 排队等待期间同样响应取消和超时
+            while not generation_lock.acquire(timeout=0.5):
+                token.raise_if_cancelled()
+            try:
+                metrics.queue_depth.dec()
+                queued = False
+                return generator.generate_from_cad(
+                    cad_input=cad_input,
+                    prompt=request.prompt,
+                    lora_name=request.lora_name,
+                    controlnet_method=request.controlnet_method,
+                    num_images=request.num_images,
+                    cancel_token=token,
+                    **params
+                )
+            finally:
+                generation_lock.release()
+        finally:
+            if queued:
+                metrics.queue_depth.dec()
+
+    # 生成在线程池中执行，事件循环同时监测客户端是否断开
+    @app.post("/generate", response_model=GenerateResponse)
+    async def generate(request: GenerateRequest, http_request: Request):
+        try:
+            cad_input = _decode_image(request.cad_image)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"无法解析输入图像: {e}")
+
+        params = {'negative_prompt': request.negative_prompt}
+        if request.num_inference_steps is not None:
+            params['num_inference_steps'] = request.num_inference_steps
+        if request.guidance_scale is not None:
+            params['guidance_scale'] = request.guidance_scale
+
+        token = CancellationToken(request.timeout)
+        watcher = asyncio.create_task(_cancel_on_disconnect(http_request, token))
+        try:
+            result = await run_in_threadpool(run_generation, request, cad_input, params, token)
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except GenerationCancelled as e:
+            # 499: 客户端已关闭连接（nginx约定），响应不会被读取
+            raise HTTPException(status_code=499, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"API生成失败: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            watcher.cancel()
+
+        return GenerateResponse(
+            images=[_encode_image(image) for image in result['images']],
+            prompt=result['prompt'],
+            lora_used=result['lora_used'],
+            timings=result['timings']
+        )
+
+    @app.on_event("shutdown")
+    def shutdown():
+        if state['generator'] is not None:
+            state['generator'].cleanup()
+
+    return app
@@ -6,16 +6,57 @@ GAT - AI辅助工业设计项目核心模块
 - LoRA模型集成
 - ControlNet处理
 - 图像生成和优化
+
+各组件在首次访问时才导入，避免 `import src.core` 时加载torch/diffusers等重量级依赖。
 """
 
-from .ai_engine import AIEngine
-from .lora_manager import LoRAManager
-from .controlnet_processor import ControlNetProcessor
-from .image_generator import ImageGenerator
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .ai_engine import AIEngine
+    from .lora_manager import LoRAManager
+    from .controlnet_processor import ControlNetProcessor
+    from .image_generator import ImageGenerator
+    from .metrics import MetricsRegistry
+    from .job_queue import JobQueue
+    from .batch_runner import BatchRunner
+    from .config import AppConfig
+
+# 导出名称 -> 所在子模块
+_LAZY_ATTRIBUTES = {
+    'AIEngine': '.ai_engine',
+    'LoRAManager': '.lora_manager',
+    'ControlNetProcessor': '.controlnet_processor',
+    'ImageGenerator': '.image_generator',
+    'MetricsRegistry': '.metrics',
+    'JobQueue': '.job_queue',
+    'BatchRunner': '.batch_runner',
+    'AppConfig': '.config',
+}
 
 __all__ = [
     'AIEngine',
-    'LoRAManager', 
+    'LoRAManager',
     'ControlNetProcessor',
-    'ImageGenerator'
+    'ImageGenerator',
+    'MetricsRegistry',
+    'JobQueue',
+    'BatchRunner',
+    'AppConfig'
 ]
+
+
+def __getattr__(name: str):
+    """按需导入导出的组件"""
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+        value = getattr(module, name)
+        # 缓存到模块命名空间，后续访问不再经过__getattr__
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
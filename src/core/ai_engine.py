@@ -3,18 +3,22 @@ AI引擎核心模块
 负责管理Stable Diffusion模型、LoRA和ControlNet的集成
 """
 
+import dataclasses
+import json
+import time
 import torch
-import yaml
-from typing import Dict, List, Optional, Tuple, Union
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from pathlib import Path
 import logging
 
-from diffusers import StableDiffusionPipeline, ControlNetModel
-from transformers import CLIPTextModel, CLIPTokenizer
-from safetensors import safe_open
-
 from .lora_manager import LoRAManager
 from .controlnet_processor import ControlNetProcessor
+from .cancellation import CancellationToken, GenerationCancelled
+from .config import AppConfig, ProfilerConfig, load_config
+from .regeneration import RegenerationCache, initial_noise
+from .metrics import get_registry
+from ..utils.tracing import get_tracer, span
 
 logger = logging.getLogger(__name__)
 
@@ -22,34 +26,40 @@ logger = logging.getLogger(__name__)
 class AIEngine:
     """AI引擎核心类，管理所有AI模型和推理"""
     
-    def __init__(self, config_path: str = "configs/config.yaml"):
+    def __init__(self, config_path: Union[str, AppConfig] = "configs/config.yaml"):
         """
         初始化AI引擎
         
         Args:
-            config_path: 配置文件路径
+            config_path: 配置文件路径，或已加载的配置
         """
         self.config = self._load_config(config_path)
         self.device = self._setup_device()
+        self.tracer = get_tracer()
+        self.tracer.configure(self.config.performance.tracing)
         self.pipeline = None
         self.lora_manager = None
         self.controlnet_processor = None
+        self.memory_governor = None
+        self.residency = None
+        self.token_merging = None
+        self.compiled_unet = None
+        self.onnx_backend = None
+        self.last_profile = None
+        self.cpu_optimizer = self._setup_cpu_optimizer()
         
         # 初始化组件
         self._initialize_components()
         
-    def _load_config(self, config_path: str) -> Dict:
-        """加载配置文件"""
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return yaml.safe_load(f)
-        except Exception as e:
-            logger.error(f"加载配置文件失败: {e}")
-            raise
+    def _load_config(self, config_path: Union[str, AppConfig]) -> AppConfig:
+        """加载配置（同一配置文件在进程内只解析一次）"""
+        if isinstance(config_path, AppConfig):
+            return config_path
+        return load_config(config_path)
     
     def _setup_device(self) -> torch.device:
         """设置计算设备"""
-        device_config = self.config['hardware']['device']
+        device_config = self.config.hardware.device
         
         if device_config == 'auto':
             if torch.cuda.is_available():
@@ -66,64 +76,387 @@ class AIEngine:
             
         return device
     
+    def _setup_cpu_optimizer(self):
+        """在CPU设备上创建CPU推理优化器并配置线程数"""
+        cpu_config = self.config.hardware.cpu_optimization
+        if self.device.type != 'cpu' or not cpu_config.enabled:
+            return None
+        
+        from .cpu_optimizer import CPUInferenceOptimizer
+        
+        optimizer = CPUInferenceOptimizer(cpu_config)
+        optimizer.configure_threads()
+        return optimizer
+    
     def _initialize_components(self):
         """初始化所有组件"""
         try:
             # 初始化LoRA管理器
-            self.lora_manager = LoRAManager(self.config['models']['lora'])
+            self.lora_manager = LoRAManager(self.config.models.lora)
             
             # 初始化ControlNet处理器
-            self.controlnet_processor = ControlNetProcessor(
-                self.config['models']['controlnet']
-            )
+            self.controlnet_processor = ControlNetProcessor(self.config.models.controlnet)
             
             # 加载基础模型
             self._load_base_model()
             
+            # 初始化内存管理器
+            self._setup_memory_governor()
+            
+            # 预热常用形状的UNet编译变体
+            self._warmup_compiled_unet()
+            
+            # 导出或加载当前模型（含快照中已融合的LoRA）的ONNX会话
+            if self.onnx_backend is not None:
+                self.onnx_backend.prepare(self.pipeline, self._fused_loras())
+            
             logger.info("AI引擎初始化完成")
             
         except Exception as e:
             logger.error(f"AI引擎初始化失败: {e}")
             raise
     
+    def _setup_memory_governor(self):
+        """按 performance.memory 配置创建内存管理器并登记各组件"""
+        memory_config = self.config.performance.memory
+        if not memory_config.enabled:
+            return
+        
+        from .memory_governor import MemoryGovernor
+        
+        governor = MemoryGovernor(memory_config, self.device)
+        
+        # UNet贯穿整个去噪过程，只计入用量；文本编码器和VAE只在首尾使用，空闲时可卸载
+        # （分页驻留策略已自行管理组件的换入换出）
+        idle_offload = self.residency.keeps_weights_resident
+        governor.register_module('pipeline:unet', self.pipeline.unet, kind='pipeline', offloadable=False)
+        governor.register_module('pipeline:text_encoder', self.pipeline.text_encoder, kind='pipeline',
+                                 offloadable=idle_offload)
+        governor.register_module('pipeline:vae', self.pipeline.vae, kind='pipeline',
+                                 offloadable=idle_offload)
+        governor.register(
+            'lora_cache',
+            self.lora_manager.cache_nbytes,
+            kind='lora_cache',
+            evict_fn=self.lora_manager.clear_caches
+        )
+        self.controlnet_processor.attach_memory_governor(governor)
+        if self.onnx_backend is not None:
+            governor.register(
+                'onnx_sessions',
+                self.onnx_backend.nbytes,
+                kind='onnx_session',
+                evict_fn=self.onnx_backend.clear
+            )
+        
+        # 导出指标前刷新内存用量
+        self._metrics_collector = lambda: get_registry().update_memory(governor.usage())
+        get_registry().add_collector(self._metrics_collector)
+        
+        if memory_config.background_cleanup:
+            governor.start()
+        
+        self.memory_governor = governor
+        logger.info(f"内存管理器已启用，预算: {memory_config.max_memory_usage}")
+    
     def _load_base_model(self):
         """加载基础Stable Diffusion模型"""
         try:
-            model_config = self.config['models']['base_model']
-            model_path = model_config['path']
+            # diffusers导入较慢，仅在加载模型时导入
+            from diffusers import StableDiffusionPipeline
             
-            logger.info(f"加载基础模型: {model_path}")
+            model_config = self.config.models.base_model
+            model_path = model_config.path
+            torch_dtype = torch.float16 if self.device.type == 'cuda' else torch.float32
             
-            # 加载Stable Diffusion管道
-            self.pipeline = StableDiffusionPipeline.from_pretrained(
-                model_path,
-                torch_dtype=torch.float16 if self.device.type == 'cuda' else torch.float32,
-                safety_checker=None,  # 移除安全检查器
-                requires_safety_checker=False
-            )
+            # 优先从快照挂载，跳过逐组件加载
+            snapshot_path = model_config.snapshot
+            if snapshot_path and Path(snapshot_path).exists():
+                self.pipeline = self._load_from_snapshot(snapshot_path, model_path, torch_dtype)
             
-            # 移动到指定设备
-            self.pipeline = self.pipeline.to(self.device)
+            if self.pipeline is None:
+                logger.info(f"加载基础模型: {model_path}")
+                
+                # 加载Stable Diffusion管道
+                self.pipeline = StableDiffusionPipeline.from_pretrained(
+                    model_path,
+                    torch_dtype=torch_dtype,
+                    safety_checker=None,  # 移除安全检查器
+                    requires_safety_checker=False
+                )
+            
+            # CPU推理优化（int8量化推迟到首次推理前，以便先融合LoRA）
+            self.residency = self._setup_residency()
+            if self.cpu_optimizer is not None:
+                if not self.residency.keeps_weights_resident:
+                    self._disable_cpu_weight_optimizations()
+                self.cpu_optimizer.optimize_pipeline(self.pipeline)
+            
+            # 按驻留策略放置各组件（all策略即整体移动到指定设备）
+            self.pipeline = self.residency.apply(self.pipeline)
             
             # 启用内存优化
-            if self.config['hardware']['memory_efficient']:
+            if self.config.hardware.memory_efficient:
                 self.pipeline.enable_attention_slicing()
                 self.pipeline.enable_vae_slicing()
                 
             # 启用xformers优化
-            if self.config['hardware']['use_xformers'] and hasattr(self.pipeline, 'enable_xformers_memory_efficient_attention'):
+            if self.config.hardware.use_xformers and hasattr(self.pipeline, 'enable_xformers_memory_efficient_attention'):
                 try:
                     self.pipeline.enable_xformers_memory_efficient_attention()
                     logger.info("已启用xformers优化")
                 except Exception as e:
                     logger.warning(f"xformers优化启用失败: {e}")
             
+            # ONNX Runtime后端（导出时临时使用默认注意力处理器）
+            if self.config.hardware.backend == 'onnxruntime':
+                self._setup_onnx_backend()
+            
+            # 令牌合并需在attention slicing/xformers之后安装，回退时使用它们的处理器
+            self._setup_token_merging()
+            
+            # 编译包装在UNet的处理器都安装完成后进行，追踪钩子登记在包装模块上
+            self._setup_compiled_unet()
+            
+            # 记录文本编码、逐步去噪和VAE解码的耗时
+            if self.tracer.enabled and self.config.performance.tracing.model_hooks:
+                self._instrument_pipeline()
+            
             logger.info("基础模型加载完成")
             
         except Exception as e:
             logger.error(f"基础模型加载失败: {e}")
             raise
     
+    def _setup_token_merging(self):
+        """按 performance.token_merging 配置在UNet自注意力上安装令牌合并处理器"""
+        merging_config = self.config.performance.token_merging
+        if not merging_config.enabled:
+            return
+        if self.onnx_backend is not None:
+            logger.warning("ONNX Runtime后端不支持令牌合并，已禁用")
+            return
+        
+        from .token_merging import TokenMerging
+        
+        self.token_merging = TokenMerging(merging_config)
+        self.token_merging.install(self.pipeline.unet)
+    
+    def _setup_compiled_unet(self):
+        """按 hardware.compile 配置用编译变体缓存包装UNet（兼容 hardware.cpu_optimization.compile）"""
+        compile_config = self.config.hardware.compile
+        if not compile_config.enabled and self.cpu_optimizer is not None and self.cpu_optimizer.compile:
+            compile_config = dataclasses.replace(
+                compile_config, enabled=True, mode=self.cpu_optimizer.compile_mode,
+                warmup_steps=max(self.cpu_optimizer.warmup_steps, 1)
+            )
+        if not compile_config.enabled:
+            return
+        if self.onnx_backend is not None:
+            logger.warning("ONNX Runtime后端下UNet由ONNX Runtime执行，UNet编译已禁用")
+            return
+        if not self.residency.keeps_weights_resident:
+            logger.warning(f"驻留策略 {self.residency.policy} 下不支持torch.compile，UNet编译已禁用")
+            return
+        if not hasattr(torch, 'compile'):
+            logger.warning("当前torch版本不支持torch.compile，UNet编译已禁用")
+            return
+        
+        from .compiled_unet import CompiledUNet
+        
+        self.compiled_unet = CompiledUNet(self.pipeline.unet, compile_config)
+        self.pipeline.unet = self.compiled_unet
+    
+    def _setup_onnx_backend(self):
+        """按 hardware.onnx 配置创建ONNX Runtime后端（仅CPU设备、权重常驻时可用）"""
+        if self.device.type != 'cpu':
+            logger.warning(f"ONNX Runtime后端仅支持CPU设备，当前设备 {self.device}，使用PyTorch后端")
+            return
+        if not self.residency.keeps_weights_resident:
+            logger.warning(f"驻留策略 {self.residency.policy} 下无法导出ONNX模型，使用PyTorch后端")
+            return
+        
+        from .cpu_optimizer import available_cpu_count
+        from .onnx_backend import OnnxBackend, path_fingerprint
+        
+        if self.cpu_optimizer is not None and self.cpu_optimizer.quantize_int8:
+            logger.warning("ONNX Runtime后端从float32权重导出，int8量化已禁用")
+            self.cpu_optimizer.quantize_int8 = False
+        
+        model_config = self.config.models.base_model
+        model_fingerprint = {
+            'path': path_fingerprint(model_config.path),
+            'snapshot': path_fingerprint(model_config.snapshot) if model_config.snapshot else None,
+            'dtype': str(self.pipeline.unet.dtype),
+        }
+        onnx_config = self.config.hardware.onnx
+        cpu_config = self.config.hardware.cpu_optimization
+        num_threads = onnx_config.num_threads or cpu_config.num_threads or available_cpu_count()
+        self.onnx_backend = OnnxBackend(onnx_config, model_fingerprint, num_threads)
+        self.onnx_backend.wrap(self.pipeline)
+    
+    def _fused_loras(self) -> List[Tuple[str, float, str]]:
+        """已融合进权重的LoRA (名称, 权重, 文件路径)，用作ONNX导出缓存的键"""
+        return [
+            (name, info['weight'], self.lora_manager.available_loras.get(name, {}).get('path', ''))
+            for name, info in self.lora_manager.loaded_loras.items()
+        ]
+    
+    def _backend_context(self, controlnet_input):
+        """推理后端上下文：ONNX Runtime后端下先确保当前LoRA组合的会话可用，再替换管道组件"""
+        if self.onnx_backend is None:
+            return nullcontext()
+        self.onnx_backend.prepare(self.pipeline, self._fused_loras())
+        pipeline = self.controlnet_processor.pipeline if controlnet_input is not None else self.pipeline
+        return self.onnx_backend.activate(pipeline)
+    
+    def _warmup_compiled_unet(self):
+        """按 hardware.compile.warmup_shapes 预热UNet编译变体（只执行一次）"""
+        if self.compiled_unet is None or self.compiled_unet.warmed_up:
+            return
+        if self.cpu_optimizer is not None and self.cpu_optimizer.quantize_int8 and not self.cpu_optimizer.quantized:
+            # 量化会替换线性层，使编译图失效，预热推迟到首次推理前量化之后
+            return
+        
+        compile_config = self.compiled_unet.compile_config
+        method = compile_config.warmup_controlnet
+        if method and not self.prepare_controlnet(method):
+            logger.warning(f"ControlNet {method} 管道准备失败，使用基础管道预热")
+            method = None
+        
+        start = time.perf_counter()
+        # 预热推理不计入请求耗时
+        with self.compiled_unet.warming(), get_tracer().suspend():
+            for num_images, width, height in compile_config.warmup_shapes:
+                logger.info(f"UNet编译预热: {num_images} 张 {width}x{height}")
+                self.generate_images(
+                    "warmup",
+                    controlnet_input=torch.zeros(1, 3, height, width) if method else None,
+                    num_images=num_images,
+                    profile=False,
+                    width=width,
+                    height=height,
+                    num_inference_steps=compile_config.warmup_steps,
+                    output_type='latent'
+                )
+        if compile_config.warmup_shapes:
+            logger.info(f"UNet编译预热完成，共 {len(self.compiled_unet.variants)} 个变体，"
+                        f"耗时 {time.perf_counter() - start:.1f}s")
+    
+    def _instrument_pipeline(self):
+        """在管道子模块上注册追踪钩子（UNet每次前向即一个去噪步）"""
+        self.tracer.instrument_module(self.pipeline.text_encoder, 'text_encode')
+        self.tracer.instrument_module(self.pipeline.unet, 'denoise_step')
+        self.tracer.instrument_module(self.pipeline.vae.decoder, 'vae_decode')
+        if self.onnx_backend is not None:
+            modules = self.onnx_backend.modules
+            self.tracer.instrument_module(modules['text_encoder'], 'text_encode')
+            self.tracer.instrument_module(modules['unet'], 'denoise_step')
+            self.tracer.instrument_module(modules['vae_decoder'], 'vae_decode')
+    
+    def _setup_residency(self):
+        """按 hardware.residency 配置创建驻留管理器"""
+        from .residency import ResidencyManager
+        
+        return ResidencyManager(
+            self.config.hardware.residency, self.device, self.config.performance.memory.offload_dir
+        )
+    
+    def _disable_cpu_weight_optimizations(self):
+        """分页驻留策略下权重会被换出，编译和int8量化无法使用"""
+        if self.cpu_optimizer.compile or self.cpu_optimizer.quantize_int8:
+            logger.warning(f"驻留策略 {self.residency.policy} 下不支持torch.compile和int8量化，已禁用")
+        self.cpu_optimizer.compile = False
+        self.cpu_optimizer.quantize_int8 = False
+    
+    def _weight_offloaders(self) -> List:
+        """驻留策略和内存管理器中所有管理权重的卸载器"""
+        offloaders = list(self.residency.all_offloaders()) if self.residency is not None else []
+        if self.memory_governor is not None:
+            offloaders.extend(self.memory_governor.offloaders())
+        return offloaders
+    
+    def _restore_offloaded_weights(self):
+        """恢复所有被卸载的权重（融合LoRA、保存快照前调用）"""
+        for offloader in self._weight_offloaders():
+            offloader.restore()
+    
+    def _mark_weights_dirty(self):
+        """权重被修改后使磁盘副本失效"""
+        for offloader in self._weight_offloaders():
+            offloader.mark_dirty()
+    
+    def _load_from_snapshot(self, snapshot_path: str, model_path: str, torch_dtype: torch.dtype):
+        """
+        从快照挂载管道
+        
+        Args:
+            snapshot_path: 快照文件路径
+            model_path: 配置中的基础模型路径
+            torch_dtype: 当前设备期望的精度
+            
+        Returns:
+            管道实例；快照与当前配置不匹配或读取失败时返回None
+        """
+        from .model_snapshot import load_snapshot, read_snapshot_metadata
+        
+        try:
+            metadata = read_snapshot_metadata(snapshot_path)
+            expected_dtype = str(torch_dtype).replace('torch.', '')
+            if metadata['source_model'] != model_path or metadata['dtype'] != expected_dtype:
+                logger.warning(
+                    f"模型快照与当前配置不匹配（模型: {metadata['source_model']}, 精度: {metadata['dtype']}），"
+                    f"改为从 {model_path} 加载"
+                )
+                return None
+            
+            logger.info(f"从快照加载基础模型: {snapshot_path}")
+            pipeline = load_snapshot(snapshot_path)
+            
+            # 快照中的LoRA已融合进权重，登记为已加载避免重复融合
+            for lora_name in json.loads(metadata['fused_loras']):
+                self.lora_manager.register_fused_lora(lora_name)
+            
+            return pipeline
+            
+        except Exception as e:
+            logger.warning(f"模型快照加载失败，改为常规加载: {e}")
+            return None
+    
+    def save_snapshot(self, snapshot_path: Optional[str] = None) -> Path:
+        """
+        将当前管道（含已融合的LoRA）保存为快照，供新的工作进程快速挂载
+        
+        Args:
+            snapshot_path: 快照文件路径，默认使用配置 models.base_model.snapshot
+            
+        Returns:
+            Path: 快照文件路径
+        """
+        from .model_snapshot import save_snapshot
+        
+        try:
+            model_config = self.config.models.base_model
+            snapshot_path = snapshot_path or model_config.snapshot
+            if not snapshot_path:
+                raise ValueError("未指定快照路径（models.base_model.snapshot）")
+            if self.cpu_optimizer is not None and self.cpu_optimizer.quantized:
+                raise ValueError("int8量化后的模型无法保存快照，请在首次推理前保存")
+            if self.residency.policy == 'sequential':
+                raise ValueError("sequential驻留策略下权重不在内存中，请使用all策略保存快照")
+            
+            self._restore_offloaded_weights()
+            return save_snapshot(
+                self.pipeline,
+                snapshot_path,
+                fused_loras=self.lora_manager.get_loaded_loras(),
+                source_model=model_config.path
+            )
+            
+        except Exception as e:
+            logger.error(f"模型快照保存失败: {e}")
+            raise
+    
     def load_lora(self, lora_name: str) -> bool:
         """
         加载指定的LoRA模型
@@ -135,66 +468,203 @@ class AIEngine:
             bool: 加载是否成功
         """
         try:
+            if self.lora_manager.is_lora_loaded(lora_name):
+                return True
+            
+            if self.cpu_optimizer is not None and self.cpu_optimizer.quantized:
+                logger.error(f"模型已int8量化，无法再融合LoRA模型 {lora_name}，请使用已融合该LoRA的快照")
+                return False
+            if self.residency.policy == 'sequential':
+                logger.error(f"sequential驻留策略下无法融合LoRA模型 {lora_name}，请使用已融合该LoRA的快照")
+                return False
+            
+            # 融合前恢复被卸载的权重，融合后磁盘副本失效
+            self._restore_offloaded_weights()
             success = self.lora_manager.load_lora(lora_name, self.pipeline)
             if success:
+                self._mark_weights_dirty()
                 logger.info(f"LoRA模型 {lora_name} 加载成功")
             return success
         except Exception as e:
             logger.error(f"LoRA模型 {lora_name} 加载失败: {e}")
             return False
     
+    def unload_lora(self, lora_name: str) -> bool:
+        """
+        卸载指定的LoRA模型，并从管道权重中移除其增量
+        
+        Args:
+            lora_name: LoRA模型名称
+            
+        Returns:
+            bool: 卸载是否成功
+        """
+        if self.cpu_optimizer is not None and self.cpu_optimizer.quantized:
+            logger.error(f"模型已int8量化，无法移除LoRA模型 {lora_name}")
+            return False
+        if self.residency.policy == 'sequential':
+            logger.error(f"sequential驻留策略下无法移除LoRA模型 {lora_name}")
+            return False
+        
+        self._restore_offloaded_weights()
+        success = self.lora_manager.unload_lora(lora_name, self.pipeline)
+        if success:
+            self._mark_weights_dirty()
+        return success
+    
+    def prepare_controlnet(self, controlnet_type: str) -> bool:
+        """
+        准备指定类型的ControlNet管道：按需加载ControlNet模型，并基于当前基础管道创建管道
+        
+        Args:
+            controlnet_type: ControlNet类型 (sketch, canny, depth)
+            
+        Returns:
+            bool: 是否准备成功
+        """
+        processor = self.controlnet_processor
+        if processor.pipeline is not None and processor.pipeline_type == controlnet_type:
+            return True
+        
+        if controlnet_type not in processor.controlnet_models:
+            if not processor.load_controlnet_model(controlnet_type, self.device):
+                return False
+        
+        if not processor.create_controlnet_pipeline(self.pipeline, controlnet_type):
+            return False
+        
+        # 创建管道时启用的attention slicing会替换共享UNet上的处理器，需重新安装
+        if self.token_merging is not None:
+            self.token_merging.install(self.pipeline.unet)
+        return True
+    
     def generate_images(
         self,
-        prompt: str,
-        controlnet_input: Optional[torch.Tensor] = None,
+        prompt: Union[str, List[str]],
+        controlnet_input: Optional[Union[torch.Tensor, List[torch.Tensor]]] = None,
         negative_prompt: str = "",
         num_images: int = 4,
+        profile: Optional[bool] = None,
+        step_callback: Optional[Callable[[int, int, torch.Tensor], None]] = None,
+        cancel_token: Optional[CancellationToken] = None,
+        state_cache: Optional[RegenerationCache] = None,
         **kwargs
     ) -> List[torch.Tensor]:
         """
         生成图像
         
         Args:
-            prompt: 正面提示词
-            controlnet_input: ControlNet输入图像
+            prompt: 正面提示词；多个请求合批时为列表，输出图像按提示词顺序分组
+            controlnet_input: ControlNet输入图像（合批时为与提示词一一对应的列表）
             negative_prompt: 负面提示词
-            num_images: 生成图像数量
-            **kwargs: 其他生成参数
+            num_images: 每个提示词生成的图像数量
+            profile: 是否分析UNet各块逐步耗时，默认使用配置 performance.profiler.enabled；
+                结果保存在 last_profile 并写入 performance.profiler.output_dir
+            step_callback: 每个去噪步结束时调用 step_callback(已完成步数, 总步数, 当前潜变量)，
+                用于进度与预览；回调中抛出的异常会中止生成
+            cancel_token: 取消令牌，开始前和每个去噪步结束时检查，
+                取消或超时后抛出 GenerationCancelled 并释放中间潜变量
+            state_cache: 增量重新生成缓存，提供时复用文本嵌入、初始潜变量和ControlNet首步残差
+            **kwargs: 其他生成参数；cfg_truncation 为执行CFG的步数比例（默认 generation.cfg_truncation），
+                之后的步只计算条件分支；token_merge_ratio 为自注意力令牌合并比例
+                （默认按分辨率选择，0表示不合并，仅在启用 performance.token_merging 时有效）
             
         Returns:
             List[torch.Tensor]: 生成的图像列表
         """
         try:
+            # int8量化只在首次推理前执行一次（此时LoRA已融合），量化后再预热编译变体
+            if self.cpu_optimizer is not None:
+                self.cpu_optimizer.quantize(self.pipeline)
+            self._warmup_compiled_unet()
+            
             # 获取生成参数
-            gen_config = self.config['generation']
+            gen_config = self.config.generation
             
             # 设置默认参数
             params = {
-                'num_inference_steps': gen_config['num_inference_steps'],
-                'guidance_scale': gen_config['guidance_scale'],
-                'width': gen_config['width'],
-                'height': gen_config['height'],
+                'num_inference_steps': gen_config.num_inference_steps,
+                'guidance_scale': gen_config.guidance_scale,
+                'width': gen_config.width,
+                'height': gen_config.height,
                 'num_images_per_prompt': num_images,
                 **kwargs
             }
             
-            # 处理ControlNet输入
-            if controlnet_input is not None:
-                # 使用ControlNet进行生成
-                result = self.controlnet_processor.generate_with_controlnet(
-                    self.pipeline,
-                    prompt=prompt,
-                    controlnet_input=controlnet_input,
-                    negative_prompt=negative_prompt,
-                    **params
+            # 固定随机种子时使用独立的随机数生成器，结果可复现
+            seed = params.pop('seed', None)
+            if seed is not None and 'generator' not in params:
+                params['generator'] = torch.Generator(device='cpu').manual_seed(int(seed))
+            
+            # CFG截断：前一部分步数执行无条件分支，之后只计算条件分支
+            cfg_cutoff = self._cfg_cutoff(
+                params.pop('cfg_truncation', gen_config.cfg_truncation),
+                params['num_inference_steps'], params['guidance_scale']
+            )
+            
+            if step_callback is not None or cancel_token is not None or cfg_cutoff is not None:
+                params['callback_on_step_end'] = self._step_end_callback(
+                    step_callback, cancel_token, params['num_inference_steps'], cfg_cutoff
                 )
-            else:
-                # 标准生成
-                result = self.pipeline(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    **params
+                params['callback_on_step_end_tensor_inputs'] = (
+                    ['latents', 'prompt_embeds'] if cfg_cutoff is not None else ['latents']
                 )
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            
+            # 按输出分辨率和内存上限配置VAE分块解码
+            self._configure_vae_tiling(params['width'], params['height'])
+            
+            # 按输出分辨率选择令牌合并比例
+            token_merge_ratio = params.pop('token_merge_ratio', None)
+            if self.token_merging is not None:
+                self.token_merging.configure(params['width'], params['height'], token_merge_ratio)
+            
+            # 按cleanup_interval整理内存，推理期间不会卸载模块
+            if self.memory_governor is not None:
+                self.memory_governor.maybe_enforce()
+                memory_context = self.memory_governor.active()
+            else:
+                memory_context = nullcontext()
+            
+            # CPU推理的自动混合精度
+            if self.cpu_optimizer is not None:
+                inference_context = self.cpu_optimizer.inference_context()
+            else:
+                inference_context = nullcontext()
+            
+            # UNet块级分析（可选）
+            profiler_config = self.config.performance.profiler
+            if profile is None:
+                profile = profiler_config.enabled
+            profiler = None
+            self.last_profile = None
+            if profile:
+                from .unet_profiler import UNetProfiler
+                profiler = UNetProfiler(self.pipeline.unet, self.device,
+                                        record_flops=profiler_config.record_flops)
+            profile_context = profiler.profile() if profiler is not None else nullcontext()
+            
+            with memory_context, torch.inference_mode(), inference_context, profile_context, \
+                    span('diffusion', steps=params['num_inference_steps'], images=num_images):
+                reuse_context = nullcontext()
+                if state_cache is not None:
+                    prompt, negative_prompt, reuse_context = self._reuse_state(
+                        state_cache, prompt, negative_prompt, controlnet_input, seed, params
+                    )
+                elif seed is not None and not isinstance(prompt, str) and 'latents' not in params:
+                    # 合批时每个请求使用与单独生成相同的初始噪声
+                    pipeline = self.controlnet_processor.pipeline if controlnet_input is not None else self.pipeline
+                    params['latents'] = initial_noise(
+                        pipeline, seed, num_images, params['width'], params['height'],
+                        self.device, pipeline.text_encoder.dtype
+                    ).repeat(len(prompt), 1, 1, 1)
+                
+                with reuse_context, self._backend_context(controlnet_input):
+                    result = self._run_pipeline(prompt, negative_prompt, controlnet_input, params)
+            
+            if profiler is not None:
+                self._save_profile(profiler, profiler_config)
             
             # 提取图像
             images = result.images
@@ -202,9 +672,161 @@ class AIEngine:
             logger.info(f"成功生成 {len(images)} 张图像")
             return images
             
+        except GenerationCancelled as e:
+            logger.info(f"图像生成已中止: {e}")
+            # 异常回溯引用着管道内部栈帧（潜变量、文本嵌入等），丢弃后这些张量即可回收
+            raise e.with_traceback(None)
         except Exception as e:
             logger.error(f"图像生成失败: {e}")
             raise
+        finally:
+            # 组件级分页策略下请求结束即释放所有组件
+            if self.residency is not None:
+                self.residency.end_request()
+    
+    def _run_pipeline(self, prompt: Optional[str], negative_prompt: Optional[str],
+                      controlnet_input: Optional[torch.Tensor], params: Dict):
+        """执行扩散管道"""
+        # 处理ControlNet输入
+        if controlnet_input is not None:
+            # 使用ControlNet进行生成
+            return self.controlnet_processor.generate_with_controlnet(
+                self.pipeline,
+                prompt=prompt,
+                controlnet_input=controlnet_input,
+                negative_prompt=negative_prompt,
+                **params
+            )
+        # 标准生成
+        return self.pipeline(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            **params
+        )
+    
+    def _reuse_state(self, state_cache: RegenerationCache, prompt: Union[str, List[str]], negative_prompt: str,
+                     controlnet_input: Optional[Union[torch.Tensor, List[torch.Tensor]]], seed: Optional[int],
+                     params: Dict):
+        """
+        用缓存的中间结果填充管道参数
+        
+        Returns:
+            (prompt, negative_prompt, 上下文)：使用缓存的文本嵌入时提示词置为None，
+            上下文在管道执行期间复用ControlNet首步残差
+        """
+        if 'prompt_embeds' in params or 'latents' in params:
+            return prompt, negative_prompt, nullcontext()
+        
+        pipeline = self.controlnet_processor.pipeline if controlnet_input is not None else self.pipeline
+        do_cfg = params['guidance_scale'] > 1.0
+        lora_key = tuple(sorted(
+            (name, info.get('weight')) for name, info in self.lora_manager.loaded_loras.items()
+        ))
+        embeds_key, prompt_embeds, negative_embeds = state_cache.prompt_embeds(
+            pipeline, prompt, negative_prompt, do_cfg, lora_key, self.device
+        )
+        params['prompt_embeds'] = prompt_embeds
+        if negative_embeds is not None:
+            params['negative_prompt_embeds'] = negative_embeds
+        
+        if seed is None:
+            return None, None, nullcontext()
+        
+        # 合批时各请求使用相同种子，初始噪声按请求重复
+        params['latents'] = state_cache.initial_latents(
+            pipeline, seed, params['num_images_per_prompt'], params['width'], params['height'],
+            self.device, prompt_embeds.dtype
+        ).repeat(1 if isinstance(prompt, str) else len(prompt), 1, 1, 1)
+        
+        control_key = state_cache.control_key(controlnet_input) if isinstance(controlnet_input, torch.Tensor) else None
+        if control_key is None or params.get('guess_mode'):
+            return None, None, nullcontext()
+        
+        # 首次执行ControlNet的那一步（control_guidance_start之前不执行ControlNet）的输入
+        # 由控制图、文本嵌入、初始潜变量和时间步决定，与强度无关
+        guidance_start = params.get(
+            'control_guidance_start', self.controlnet_processor.guidance_range()['control_guidance_start']
+        )
+        residual_key = (
+            control_key, embeds_key, int(seed), params['num_images_per_prompt'],
+            params['width'], params['height'], params['num_inference_steps'],
+            type(pipeline.scheduler).__name__, id(pipeline.controlnet), guidance_start
+        )
+        return None, None, state_cache.controlnet_residuals(pipeline.controlnet, residual_key)
+    
+    @staticmethod
+    def _cfg_cutoff(truncation: Optional[float], total_steps: int, guidance_scale: float) -> Optional[int]:
+        """执行CFG的步数，None表示全程执行（或不使用CFG）"""
+        if truncation is None or truncation >= 1.0 or guidance_scale <= 1.0:
+            return None
+        return min(max(int(total_steps * truncation), 1), total_steps)
+    
+    @staticmethod
+    def _step_end_callback(step_callback: Optional[Callable[[int, int, torch.Tensor], None]],
+                           cancel_token: Optional[CancellationToken], total_steps: int,
+                           cfg_cutoff: Optional[int] = None):
+        """将 step_callback、取消检查和CFG截断适配为diffusers的 callback_on_step_end 接口"""
+        def callback(pipeline, step, timestep, callback_kwargs):
+            if step_callback is not None:
+                step_callback(step + 1, total_steps, callback_kwargs['latents'])
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            if cfg_cutoff is not None and step + 1 == cfg_cutoff and pipeline.do_classifier_free_guidance:
+                # 之后的步只保留条件分支：UNet批量减半，引导强度置零以关闭CFG
+                callback_kwargs['prompt_embeds'] = callback_kwargs['prompt_embeds'].chunk(2)[-1]
+                pipeline._guidance_scale = 0.0
+            return callback_kwargs
+        return callback
+    
+    def _save_profile(self, profiler, profiler_config: ProfilerConfig):
+        """保存UNet分析报告（汇总表、火焰图折叠栈、JSON以及算子级Chrome trace）"""
+        try:
+            self.last_profile = profiler.report()
+            logger.info("UNet分析结果:\n" + self.last_profile.format_table())
+            
+            output_dir = profiler_config.output_dir
+            prefix = f"unet_{time.strftime('%Y%m%d_%H%M%S')}"
+            files = self.last_profile.save(output_dir, prefix)
+            profiler.export_chrome_trace(str(Path(output_dir) / f"{prefix}.trace.json"))
+            logger.info(f"UNet分析报告已保存: {files['table']}")
+        except Exception as e:
+            logger.warning(f"UNet分析报告保存失败: {e}")
+    
+    def _configure_vae_tiling(self, width: int, height: int):
+        """
+        根据输出分辨率和 performance.memory.max_memory_usage 选择VAE分块大小
+        
+        Args:
+            width: 输出图像宽度
+            height: 输出图像高度
+        """
+        tiling_config = self.config.hardware.vae_tiling
+        if not tiling_config.enabled:
+            return
+        
+        from .vae_tiling import configure_vae_tiling, select_vae_tile_size
+        from ..utils.memory_utils import format_memory_size, parse_memory_size
+        
+        max_memory = parse_memory_size(self.config.performance.memory.max_memory_usage)
+        memory_budget = int(max_memory * tiling_config.memory_fraction)
+        dtype_bytes = torch.finfo(self.pipeline.vae.dtype).bits // 8
+        
+        overlap = tiling_config.overlap
+        
+        tile_size = select_vae_tile_size(
+            width,
+            height,
+            memory_budget,
+            dtype_bytes=dtype_bytes,
+            overlap=overlap,
+            min_tile_size=tiling_config.min_tile_size,
+            max_tile_size=tiling_config.max_tile_size
+        )
+        configure_vae_tiling(self.pipeline.vae, tile_size, overlap)
+        
+        if tile_size is not None:
+            logger.info(f"VAE分块解码: {width}x{height}, 分块 {tile_size}px "
+                        f"(预算 {format_memory_size(memory_budget)})")
     
     def get_available_loras(self) -> List[str]:
         """获取可用的LoRA模型列表"""
@@ -214,9 +836,45 @@ class AIEngine:
         """获取LoRA模型信息"""
         return self.lora_manager.get_lora_info(lora_name)
     
+    def apply_config(self, config: AppConfig):
+        """
+        应用重新加载的配置（调用方已确认变化的配置项都可以在运行中重新加载）
+        
+        生成默认值、CFG截断、VAE分块和分析配置在每次生成时读取，替换配置对象即生效；
+        已创建组件持有的配置在此更新，下一次生成起生效，无需重建管道或重启工作线程。
+        
+        Args:
+            config: 新配置
+        """
+        self.config = config
+        self.tracer.configure(config.performance.tracing)
+        if self.controlnet_processor is not None:
+            self.controlnet_processor.config = config.models.controlnet
+        if self.memory_governor is not None:
+            self.memory_governor.update_limits(config.performance.memory)
+        if self.token_merging is not None:
+            self.token_merging.set_ratios(config.performance.token_merging)
+        logger.info(f"AI引擎已应用新配置（{config.hash}）")
+
+    def get_memory_usage(self) -> Dict:
+        """
+        获取当前内存使用情况
+        
+        Returns:
+            Dict: 内存预算、已登记组件总用量、进程RSS及各组件明细；未启用内存管理时为空字典
+        """
+        if self.memory_governor is None:
+            return {}
+        return self.memory_governor.usage()
+    
     def cleanup(self):
         """清理资源"""
         try:
+            if getattr(self, 'memory_governor', None) is not None:
+                self.memory_governor.stop()
+                get_registry().remove_collector(self._metrics_collector)
+            if getattr(self, 'onnx_backend', None) is not None:
+                self.onnx_backend.clear()
             if self.pipeline is not None:
                 del self.pipeline
             if torch.cuda.is_available():
@@ -0,0 +1,217 @@
+"""
+清单批量运行
+读取CSV或JSONL清单（每行一个CAD输入、提示词、LoRA、处理方法和种子列表），
+在同一个常驻的图像生成器上依次生成，输出图像与元数据由生成器的后台写出服务保存，
+写盘与下一个条目的生成重叠执行。
+每个条目的状态记录在 JobStore 中，中断后重新运行同一清单时只执行未完成的条目。
+
+清单字段：
+    input            CAD文件路径（相对路径相对于清单所在目录），必填
+    prompt           提示词，必填
+    lora             LoRA名称，默认 --lora
+    method           ControlNet处理方法，默认 canny
+    seeds            种子列表（JSON数组或以 ; , 空格分隔），每个种子为一个条目；为空时不固定种子
+    num_images       每个条目的图像数量，默认 --num-images
+    negative_prompt, num_inference_steps, guidance_scale, width, height  可选生成参数
+"""
+
+import csv
+import json
+import logging
+import re
+from concurrent.futures import Future, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .job_store import JobStore
+from .output_store import new_run_id
+
+logger = logging.getLogger(__name__)
+
+# 直接透传给 ImageGenerator.generate_from_cad 的可选生成参数及其类型
+GENERATION_FIELDS = {
+    'negative_prompt': str,
+    'num_inference_steps': int,
+    'guidance_scale': float,
+    'width': int,
+    'height': int,
+}
+
+
+def _parse_seeds(value: Any) -> List[Optional[int]]:
+    if value is None or value == '':
+        return [None]
+    if isinstance(value, (int, float)):
+        return [int(value)]
+    if isinstance(value, list):
+        return [int(seed) for seed in value]
+    text = str(value).strip()
+    if text.startswith('['):
+        return [int(seed) for seed in json.loads(text)]
+    return [int(seed) for seed in re.split(r'[;,\s]+', text) if seed]
+
+
+def load_manifest(manifest_path: str, default_lora: str, default_num_images: int) -> List[Dict[str, Any]]:
+    """
+    读取清单并按种子展开为条目
+
+    Args:
+        manifest_path: 清单路径（.csv 或 .jsonl）
+        default_lora: 未指定LoRA时使用的名称
+        default_num_images: 未指定图像数量时的默认值
+
+    Returns:
+        List[Dict]: 条目参数（line为清单中的数据行号，从1开始）
+    """
+    path = Path(manifest_path)
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.suffix.lower() == '.csv':
+            rows = list(csv.DictReader(f))
+        elif path.suffix.lower() in ('.jsonl', '.ndjson'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            raise ValueError(f"不支持的清单格式: {path.suffix}")
+
+    entries = []
+    for line, row in enumerate(rows, start=1):
+        if not row.get('input') or not row.get('prompt'):
+            raise ValueError(f"清单第 {line} 行缺少 input 或 prompt")
+
+        input_path = Path(row['input'])
+        if not input_path.is_absolute():
+            input_path = path.parent / input_path
+
+        params = {
+            name: cast(row[name]) for name, cast in GENERATION_FIELDS.items()
+            if row.get(name) not in (None, '')
+        }
+        for seed in _parse_seeds(row.get('seeds', row.get('seed'))):
+            entries.append({
+                'line': line,
+                'input': str(input_path.resolve()),
+                'prompt': row['prompt'],
+                'lora': row.get('lora') or default_lora,
+                'method': row.get('method') or 'canny',
+                'num_images': int(row.get('num_images') or default_num_images),
+                'seed': seed,
+                **params,
+            })
+    return entries
+
+
+class BatchRunner:
+    """在常驻的图像生成器上执行清单，支持中断后续跑"""
+
+    def __init__(self, generator, store: JobStore, output_dir: str, config: Optional[Dict] = None):
+        """
+        初始化批量运行器
+
+        Args:
+            generator: ImageGenerator实例（整个批次共用，模型只加载一次）
+            store: 任务状态存储
+            output_dir: 输出目录（每次运行的输出位于以清单名开头的运行目录）
+            config: output 配置（读取 batch 项）
+        """
+        config = config or {}
+        batch_config = config.get('batch', {})
+        self.generator = generator
+        self.store = store
+        self.output_dir = Path(output_dir)
+        self.max_attempts = max(int(batch_config.get('max_attempts', 2)), 1)
+        self._cad_processor = None
+        self._cached_input = (None, None)
+
+    def run(self, manifest_path: str, default_lora: str = "morphy_richards",
+            default_num_images: int = 4) -> Dict[str, int]:
+        """
+        执行清单中所有未完成的条目
+
+        Args:
+            manifest_path: 清单路径
+            default_lora: 清单未指定LoRA时使用的名称
+            default_num_images: 清单未指定图像数量时的默认值
+
+        Returns:
+            Dict[str, int]: 运行结束后各状态的条目数
+        """
+        manifest = str(Path(manifest_path).resolve())
+        entries = load_manifest(manifest_path, default_lora, default_num_images)
+        added = self.store.add_entries(manifest, entries)
+        recovered = self.store.recover(manifest)
+        pending = self.store.pending(manifest, self.max_attempts)
+        logger.info(f"清单 {manifest}: 共 {len(entries)} 个条目，新增 {added} 个，"
+                    f"中断恢复 {recovered} 个，待执行 {len(pending)} 个")
+
+        # 每次运行（含续跑）的输出位于同一运行目录
+        run_id = f"{Path(manifest).stem}_{new_run_id()}"
+        in_flight = []
+        try:
+            for index, entry in enumerate(pending, start=1):
+                key = entry['key']
+                logger.info(f"[{index}/{len(pending)}] 清单第 {entry['line']} 行，种子 {entry['seed']}")
+                self.store.mark_running(key)
+                try:
+                    result = self._generate(entry)
+                except Exception as e:
+                    logger.error(f"清单第 {entry['line']} 行生成失败: {e}")
+                    self.store.mark_failed(key, str(e))
+                    continue
+
+                # 写出队列已满时在此阻塞，避免生成快于写出时图像在内存中堆积
+                self.store.mark_writing(key)
+                future = self._write_outputs(run_id, entry, result)
+                future.add_done_callback(lambda done, key=key: self._on_written(key, done))
+                in_flight.append(future)
+                in_flight = [future for future in in_flight if not future.done()]
+        finally:
+            # 中断时也等待已提交的写出完成，不丢失已生成的结果
+            wait(in_flight)
+
+        summary = self.store.summary(manifest)
+        logger.info(f"清单 {manifest} 运行结束: {summary}")
+        return summary
+
+    def _load_input(self, input_path: str):
+        """加载CAD输入（同一输入的多个种子只加载一次）"""
+        cached_path, cached_input = self._cached_input
+        if cached_path == input_path:
+            return cached_input
+
+        if self._cad_processor is None:
+            from ..utils.cad_processor import CADProcessor
+            self._cad_processor = CADProcessor(self.generator.config.input.tessellation)
+        cad_input = self._cad_processor.load_cad_file(input_path)
+        self._cached_input = (input_path, cad_input)
+        return cad_input
+
+    def _generate(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        params = {name: entry[name] for name in GENERATION_FIELDS if name in entry}
+        if entry['seed'] is not None:
+            params['seed'] = entry['seed']
+        return self.generator.generate_from_cad(
+            cad_input=self._load_input(entry['input']),
+            prompt=entry['prompt'],
+            lora_name=entry['lora'],
+            controlnet_method=entry['method'],
+            num_images=entry['num_images'],
+            **params
+        )
+
+    def _write_outputs(self, run_id: str, entry: Dict[str, Any], result: Dict[str, Any]) -> Future:
+        """提交条目图像的写出（生成参数写入图像、旁注文件和结果索引），完成时为写出的图像路径"""
+        seed = 'random' if entry['seed'] is None else entry['seed']
+        return self.generator.save_images_async(
+            result['images'],
+            str(self.output_dir),
+            prefix=f"{entry['line']:05d}_{entry['lora']}_{seed}",
+            result=result,
+            run_id=run_id,
+            metadata={'manifest_line': entry['line'], 'input': entry['input']}
+        )
+
+    def _on_written(self, key: str, future: Future):
+        try:
+            self.store.mark_completed(key, future.result())
+        except Exception as e:
+            logger.error(f"条目 {key} 输出写出失败: {e}")
+            self.store.mark_failed(key, f"写出失败: {e}")
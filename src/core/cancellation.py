@@ -0,0 +1,69 @@
+"""
+协作式取消
+生成请求携带取消令牌，在各阶段之间以及每个去噪步结束时检查；
+令牌被取消或超过截止时间后抛出异常，调用方据此中止生成并释放中间结果。
+"""
+
+import threading
+import time
+from typing import Optional
+
+
+class GenerationCancelled(Exception):
+    """生成请求被取消"""
+
+
+class DeadlineExceeded(GenerationCancelled):
+    """生成请求超过截止时间"""
+
+
+class CancellationToken:
+    """取消令牌（线程安全，可设置截止时间，父令牌取消时随之取消）"""
+
+    def __init__(self, timeout: Optional[float] = None, parent: Optional['CancellationToken'] = None):
+        """
+        初始化取消令牌
+
+        Args:
+            timeout: 从现在起的最长执行时间（秒），None表示不限
+            parent: 父令牌（如整个批次的令牌）
+        """
+        self._event = threading.Event()
+        self._reason = ""
+        self._parent = parent
+        self.deadline: Optional[float] = time.monotonic() + timeout if timeout else None
+
+    def child(self, timeout: Optional[float] = None) -> 'CancellationToken':
+        """创建子令牌：本令牌取消或超时时子令牌同样失效，子令牌的截止时间不影响本令牌"""
+        return CancellationToken(timeout, parent=self)
+
+    def cancel(self, reason: str = "请求已取消"):
+        """取消（重复调用只保留第一次的原因）"""
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+    def remaining(self) -> Optional[float]:
+        """距截止时间的剩余秒数，未设置时为None"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @property
+    def cancelled(self) -> bool:
+        if self._parent is not None and self._parent.cancelled:
+            return True
+        return self._event.is_set() or self.expired
+
+    def raise_if_cancelled(self):
+        """已取消或已超时时抛出异常"""
+        if self._parent is not None:
+            self._parent.raise_if_cancelled()
+        if self._event.is_set():
+            raise GenerationCancelled(self._reason)
+        if self.expired:
+            raise DeadlineExceeded("超过截止时间")
@@ -0,0 +1,171 @@
+"""
+UNet编译变体缓存
+torch.compile(dynamic=False) 按输入形状特化编译图，每遇到新的批大小或分辨率都要重新编译，
+首次请求往往要等待数十秒。本模块包装UNet，按 (UNet批大小, 潜变量高, 潜变量宽, 精度, 是否带
+ControlNet残差) 管理编译变体：
+
+- 启动时按 hardware.compile.warmup_shapes 预热常用形状，预热期间遇到的形状都会编译
+- 未预热的形状出现 compile_after 次后才编译，之前及变体数达到 max_variants 后使用未编译的UNet，
+  罕见形状不会触发编译，也不会挤占常用形状的编译图
+- inductor的FX图缓存写入 cache_dir，重启后编译同一形状直接复用磁盘上的编译产物
+
+包装模块通过 _orig_mod 暴露原UNet（与 torch.compile 返回的模块一致），
+令牌合并、量化、分析器和快照照常作用于原UNet。
+"""
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+
+from .metrics import get_registry
+from ..utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# (UNet批大小, 潜变量高, 潜变量宽, 精度, 是否带ControlNet残差)
+VariantKey = Tuple[int, int, int, str, bool]
+
+
+def configure_artifact_cache(cache_dir: str):
+    """
+    将inductor的编译产物缓存到指定目录（需在首次编译前调用，环境变量已指定时不覆盖）
+
+    Args:
+        cache_dir: 缓存目录
+    """
+    path = Path(cache_dir).resolve()
+    path.mkdir(parents=True, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', str(path))
+
+    from torch._inductor import config as inductor_config
+    if hasattr(inductor_config, 'fx_graph_cache'):
+        inductor_config.fx_graph_cache = True
+    logger.info(f"UNet编译产物缓存目录: {os.environ['TORCHINDUCTOR_CACHE_DIR']}")
+
+
+def _autocast_dtype(device_type: str) -> Optional[torch.dtype]:
+    """当前启用的自动混合精度类型，未启用时为None"""
+    try:
+        if torch.is_autocast_enabled(device_type):
+            return torch.get_autocast_dtype(device_type)
+    except (TypeError, AttributeError):
+        # torch<2.4 只有按设备区分的接口
+        if device_type == 'cpu' and torch.is_autocast_cpu_enabled():
+            return torch.get_autocast_cpu_dtype()
+        if device_type == 'cuda' and torch.is_autocast_enabled():
+            return torch.get_autocast_gpu_dtype()
+    return None
+
+
+class CompiledUNet(torch.nn.Module):
+    """按形状管理编译变体的UNet包装模块"""
+
+    def __init__(self, unet: torch.nn.Module, compile_config: Any):
+        """
+        Args:
+            unet: 原UNet
+            compile_config: hardware.compile 配置
+        """
+        super().__init__()
+        self._orig_mod = unet
+        self.compile_config = compile_config
+        self.compile_after = max(int(compile_config.get('compile_after', 2)), 1)
+        self.max_variants = max(int(compile_config.get('max_variants', 8)), 0)
+
+        cache_dir = compile_config.get('cache_dir')
+        if cache_dir:
+            configure_artifact_cache(cache_dir)
+
+        # 编译后的模块引用同一个UNet，不注册为子模块，避免state_dict重复
+        self.__dict__['_compiled'] = torch.compile(
+            unet, mode=compile_config.get('mode', 'default'), dynamic=False
+        )
+
+        # 每个变体是dynamo缓存中的一个编译图，上限需容纳所有变体，否则会被静默回退为eager
+        dynamo_config = torch._dynamo.config
+        limit_name = 'recompile_limit' if hasattr(dynamo_config, 'recompile_limit') else 'cache_size_limit'
+        setattr(dynamo_config, limit_name, max(getattr(dynamo_config, limit_name), self.max_variants))
+
+        self.variants: Dict[VariantKey, int] = {}
+        self.seen: Dict[VariantKey, int] = {}
+        self.warmed_up = False
+        self._warming = False
+        self._lock = threading.Lock()
+        logger.info(f"UNet编译变体缓存已启用 (mode={compile_config.get('mode', 'default')}, "
+                    f"compile_after={self.compile_after}, max_variants={self.max_variants})")
+
+    def __getattr__(self, name: str):
+        # 管道通过 unet.config、unet.dtype 等访问原UNet的属性
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self._modules['_orig_mod'], name)
+
+    def variant_key(self, sample: torch.Tensor, kwargs: Dict[str, Any]) -> VariantKey:
+        """输入对应的变体键"""
+        batch, _, height, width = sample.shape
+        dtype = _autocast_dtype(sample.device.type) or sample.dtype
+        controlled = kwargs.get('down_block_additional_residuals') is not None
+        return batch, height, width, str(dtype).replace('torch.', ''), controlled
+
+    def _admit(self, key: VariantKey) -> Tuple[bool, bool]:
+        """
+        判断该形状是否使用编译图
+
+        Returns:
+            (是否使用编译图, 是否为新编译的变体)
+        """
+        with self._lock:
+            if key in self.variants:
+                self.variants[key] += 1
+                return True, False
+
+            self.seen[key] = self.seen.get(key, 0) + 1
+            if len(self.variants) >= self.max_variants:
+                if self.seen[key] == 1:
+                    logger.info(f"UNet编译变体已达上限 {self.max_variants}，形状 {key} 使用未编译的UNet")
+                return False, False
+            if not self._warming and self.seen[key] < self.compile_after:
+                return False, False
+
+            self.variants[key] = 1
+            del self.seen[key]
+            return True, True
+
+    def forward(self, sample: torch.Tensor, *args, **kwargs):
+        key = self.variant_key(sample, kwargs)
+        compiled, new = self._admit(key)
+        get_registry().record_cache('unet_compile', compiled)
+        if not compiled:
+            return self._orig_mod(sample, *args, **kwargs)
+        if not new:
+            return self._compiled(sample, *args, **kwargs)
+
+        batch, height, width, dtype, controlled = key
+        logger.info(f"编译UNet变体: 批大小 {batch}, 潜变量 {width}x{height}, {dtype}"
+                    f"{', ControlNet' if controlled else ''}")
+        with span('unet_compile', batch=batch, width=width, height=height, dtype=dtype):
+            return self._compiled(sample, *args, **kwargs)
+
+    @contextmanager
+    def warming(self):
+        """预热上下文：其间遇到的形状不论出现次数都会编译"""
+        self.warmed_up = True
+        self._warming = True
+        try:
+            yield
+        finally:
+            self._warming = False
+
+    def stats(self) -> Dict[str, Any]:
+        """已编译变体的调用次数与尚未编译形状的出现次数"""
+        with self._lock:
+            return {
+                'variants': {str(key): count for key, count in self.variants.items()},
+                'eager': {str(key): count for key, count in self.seen.items()},
+            }
@@ -0,0 +1,759 @@
+"""
+类型化配置
+配置文件在进程内只解析一次，校验后构建为不可变的数据类对象，由各组件共享：
+- 各配置段是冻结的数据类（Python 3.10+ 使用 __slots__），同时实现只读映射接口，
+  接收子配置的组件可以继续使用 config.get('key', default)
+- 类型、取值范围和未知配置项在加载时报错，而不是在首次使用时
+- 环境变量 GAT__<段>__<项>=<值> 覆盖配置文件中的值（值按YAML解析），
+  例如 GAT__GENERATION__WIDTH=768、GAT__HARDWARE__DEVICE=cpu
+- hash / digest() 是配置内容的稳定摘要，可作为管道与结果缓存的键
+- RELOADABLE_FIELDS 中的配置项（生成默认值、缓存大小等）可在运行中重新加载，
+  不需要重启工作线程；其他配置项变化时需要重启
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from collections.abc import Mapping as MappingABC
+from dataclasses import MISSING, dataclass, field
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple, Union, get_args, get_origin, get_type_hints
+
+import yaml
+
+from ..utils.memory_utils import parse_memory_size
+
+logger = logging.getLogger(__name__)
+
+# 覆盖配置项的环境变量前缀，层级之间以双下划线分隔
+ENV_PREFIX = 'GAT__'
+
+# 运行中可以重新加载的配置项（前缀匹配），其余配置项在构建管道和工作线程时读取，变化后需要重启
+RELOADABLE_FIELDS = (
+    'generation',
+    'models.controlnet.guidance_start',
+    'models.controlnet.guidance_end',
+    'models.controlnet.outside_range',
+    'hardware.vae_tiling',
+    'output.image_format',
+    'output.quality',
+    'output.organize_by_date',
+    'output.save_metadata',
+    'output.include_prompts',
+    'output.thumbnails',
+    'ui.job_queue.poll_interval',
+    'performance.memory.max_memory_usage',
+    'performance.memory.cleanup_interval',
+    'performance.memory.idle_offload_after',
+    'performance.regeneration.max_entries',
+    'performance.tracing.enabled',
+    'performance.tracing.sync_cuda',
+    'performance.tracing.chrome_trace_dir',
+    'performance.token_merging.ratio',
+    'performance.token_merging.resolution_ratios',
+    'performance.profiler',
+)
+
+# Python 3.10 起数据类支持 slots
+_SECTION_OPTIONS = {'frozen': True, **({'slots': True} if sys.version_info >= (3, 10) else {})}
+
+
+class ConfigError(ValueError):
+    """配置内容无效"""
+
+
+class ConfigSection(MappingABC):
+    """配置段基类：不可变数据类，同时提供只读映射接口"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.__dataclass_fields__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.__dataclass_fields__)
+
+    def __len__(self) -> int:
+        return len(self.__dataclass_fields__)
+
+    @classmethod
+    def from_dict(cls, data: Mapping, path: str = ''):
+        """由配置字典构建（缺省项使用默认值，类型或取值无效时抛出ConfigError）"""
+        return _build(cls, data, path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为普通字典（可序列化为YAML/JSON）"""
+        return _thaw(self)
+
+
+def _check(condition: bool, message: str):
+    if not condition:
+        raise ConfigError(message)
+
+
+def _check_choice(value: str, choices: Tuple[str, ...], name: str):
+    _check(value in choices, f"{name} 必须是 {', '.join(choices)} 之一，实际为 {value!r}")
+
+
+def _check_fraction(value: float, name: str):
+    _check(0.0 <= value <= 1.0, f"{name} 必须在 [0, 1] 范围内，实际为 {value}")
+
+
+def _check_memory_size(value: Union[str, int], name: str):
+    try:
+        parse_memory_size(value)
+    except (ValueError, TypeError):
+        raise ConfigError(f"{name} 不是有效的内存大小: {value!r}")
+
+
+def _frozen_map(**kwargs) -> Any:
+    return field(default_factory=lambda: MappingProxyType(dict(kwargs)))
+
+
+# ---------------------------------------------------------------- 模型
+
+@dataclass(**_SECTION_OPTIONS)
+class BaseModelConfig(ConfigSection):
+    path: str
+    type: str = "stable-diffusion"
+    precision: str = "fp16"
+    snapshot: Optional[str] = None
+
+    def __post_init__(self):
+        _check_choice(self.precision, ('fp16', 'fp32', 'bf16'), 'models.base_model.precision')
+
+
+@dataclass(**_SECTION_OPTIONS)
+class LoRAConfig(ConfigSection):
+    path: str
+    trigger_word: str = ""
+    weight: float = 0.8
+    enabled: bool = True
+
+
+@dataclass(**_SECTION_OPTIONS)
+class ControlNetConfig(ConfigSection):
+    type: str = "t2i-adapter"
+    models: Mapping[str, str] = _frozen_map()
+    enabled: bool = True
+    guidance_start: float = 0.0
+    guidance_end: float = 1.0
+    outside_range: str = "drop"
+
+    def __post_init__(self):
+        _check(0.0 <= self.guidance_start < self.guidance_end <= 1.0,
+               f"models.controlnet 需满足 0 <= guidance_start < guidance_end <= 1，"
+               f"实际为 {self.guidance_start}, {self.guidance_end}")
+        _check_choice(self.outside_range, ('drop', 'reuse'), 'models.controlnet.outside_range')
+
+
+@dataclass(**_SECTION_OPTIONS)
+class ModelsConfig(ConfigSection):
+    base_model: BaseModelConfig
+    lora: Mapping[str, LoRAConfig] = _frozen_map()
+    controlnet: ControlNetConfig = field(default_factory=ControlNetConfig)
+
+
+# ---------------------------------------------------------------- 生成
+
+@dataclass(**_SECTION_OPTIONS)
+class BucketConfig(ConfigSection):
+    enabled: bool = True
+    multiple: int = 64
+    max_aspect_ratio: float = 2.5
+    max_pixels: Optional[int] = None
+
+    def __post_init__(self):
+        _check(self.multiple >= 8 and self.multiple % 8 == 0, "generation.buckets.multiple 必须是8的正整数倍")
+        _check(self.max_aspect_ratio >= 1.0, "generation.buckets.max_aspect_ratio 不能小于1")
+        _check(self.max_pixels is None or self.max_pixels >= self.multiple ** 2,
+               "generation.buckets.max_pixels 不能小于一个 multiple x multiple 分桶")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class GenerationConfig(ConfigSection):
+    num_inference_steps: int = 20
+    guidance_scale: float = 7.5
+    width: int = 512
+    height: int = 512
+    timeout: Optional[float] = None
+    batch_size: int = 4
+    num_images: int = 4
+    pack_requests: int = 1
+    cfg_truncation: float = 1.0
+    quality_threshold: float = 0.7
+    diversity_threshold: float = 0.3
+    buckets: BucketConfig = field(default_factory=BucketConfig)
+
+    def __post_init__(self):
+        _check(self.num_inference_steps >= 1, "generation.num_inference_steps 必须为正数")
+        _check(self.guidance_scale >= 0, "generation.guidance_scale 不能为负数")
+        for name in ('width', 'height'):
+            value = getattr(self, name)
+            _check(value > 0 and value % 8 == 0, f"generation.{name} 必须是8的正整数倍，实际为 {value}")
+        _check(self.timeout is None or self.timeout > 0, "generation.timeout 必须为正数或null")
+        for name in ('batch_size', 'num_images', 'pack_requests'):
+            _check(getattr(self, name) >= 1, f"generation.{name} 必须为正整数")
+        for name in ('cfg_truncation', 'quality_threshold', 'diversity_threshold'):
+            _check_fraction(getattr(self, name), f"generation.{name}")
+
+
+# ---------------------------------------------------------------- 硬件
+
+@dataclass(**_SECTION_OPTIONS)
+class VAETilingConfig(ConfigSection):
+    enabled: bool = True
+    memory_fraction: float = 0.25
+    overlap: float = 0.25
+    min_tile_size: int = 256
+    max_tile_size: int = 1024
+
+    def __post_init__(self):
+        _check(0.0 < self.memory_fraction <= 1.0, "hardware.vae_tiling.memory_fraction 必须在 (0, 1] 范围内")
+        _check(0.0 <= self.overlap < 1.0, "hardware.vae_tiling.overlap 必须在 [0, 1) 范围内")
+        _check(0 < self.min_tile_size <= self.max_tile_size,
+               "hardware.vae_tiling 需满足 0 < min_tile_size <= max_tile_size")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class CPUOptimizationConfig(ConfigSection):
+    enabled: bool = True
+    dtype: str = "float32"
+    quantize_int8: bool = False
+    channels_last: bool = True
+    num_threads: int = 0
+    num_interop_threads: int = 1
+    compile: bool = False
+    compile_mode: str = "default"
+    warmup_steps: int = 2
+
+    def __post_init__(self):
+        _check_choice(self.dtype, ('float32', 'bfloat16'), 'hardware.cpu_optimization.dtype')
+        _check_choice(self.compile_mode, ('default', 'reduce-overhead', 'max-autotune'),
+                      'hardware.cpu_optimization.compile_mode')
+        _check(self.num_threads >= 0 and self.num_interop_threads >= 0 and self.warmup_steps >= 0,
+               "hardware.cpu_optimization 的线程数与预热步数不能为负数")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class CompileConfig(ConfigSection):
+    enabled: bool = False
+    mode: str = "default"
+    warmup_shapes: Tuple[Tuple[int, ...], ...] = ()
+    warmup_controlnet: Optional[str] = None
+    warmup_steps: int = 2
+    compile_after: int = 2
+    max_variants: int = 8
+    cache_dir: Optional[str] = "data/cache/compiled"
+
+    def __post_init__(self):
+        _check_choice(self.mode, ('default', 'reduce-overhead', 'max-autotune'), 'hardware.compile.mode')
+        for shape in self.warmup_shapes:
+            _check(len(shape) == 3 and all(value > 0 for value in shape),
+                   f"hardware.compile.warmup_shapes 的每一项必须是 [图像数, 宽, 高]，实际为 {list(shape)}")
+            _check(shape[1] % 8 == 0 and shape[2] % 8 == 0,
+                   f"hardware.compile.warmup_shapes 的宽高必须是8的倍数，实际为 {list(shape)}")
+        _check(self.warmup_steps >= 1, "hardware.compile.warmup_steps 必须为正整数")
+        _check(self.compile_after >= 1, "hardware.compile.compile_after 必须为正整数")
+        _check(self.max_variants >= 0, "hardware.compile.max_variants 不能为负数")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class OnnxConfig(ConfigSection):
+    cache_dir: str = "data/cache/onnx"
+    opset: int = 17
+    graph_optimization: str = "all"
+    num_threads: int = 0
+    max_sessions: int = 2
+
+    def __post_init__(self):
+        _check_choice(self.graph_optimization, ('disable', 'basic', 'extended', 'all'),
+                      'hardware.onnx.graph_optimization')
+        _check(self.opset >= 14, "hardware.onnx.opset 不能低于14（注意力算子导出需要）")
+        _check(self.num_threads >= 0, "hardware.onnx.num_threads 不能为负数")
+        _check(self.max_sessions >= 1, "hardware.onnx.max_sessions 必须为正整数")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class HardwareConfig(ConfigSection):
+    device: str = "auto"
+    memory_efficient: bool = True
+    use_xformers: bool = True
+    residency: str = "all"
+    backend: str = "torch"
+    vae_tiling: VAETilingConfig = field(default_factory=VAETilingConfig)
+    cpu_optimization: CPUOptimizationConfig = field(default_factory=CPUOptimizationConfig)
+    compile: CompileConfig = field(default_factory=CompileConfig)
+    onnx: OnnxConfig = field(default_factory=OnnxConfig)
+
+    def __post_init__(self):
+        _check(re.match(r'^(auto|cpu|mps|cuda(:\d+)?)$', self.device) is not None,
+               f"hardware.device 必须是 auto, cpu, cuda[:N], mps 之一，实际为 {self.device!r}")
+        _check_choice(self.residency, ('all', 'model', 'sequential', 'mmap'), 'hardware.residency')
+        _check_choice(self.backend, ('torch', 'onnxruntime'), 'hardware.backend')
+
+
+# ---------------------------------------------------------------- 输入
+
+@dataclass(**_SECTION_OPTIONS)
+class TessellationConfig(ConfigSection):
+    backend: str = "auto"
+    render_resolution: int = 512
+    pixel_error: float = 0.5
+    angular_deflection: float = 0.5
+    cache_dir: str = "data/cache/tessellation"
+
+    def __post_init__(self):
+        _check_choice(self.backend, ('auto', 'occ', 'freecad', 'stub'), 'input.tessellation.backend')
+        _check(self.render_resolution > 0 and self.pixel_error > 0 and self.angular_deflection > 0,
+               "input.tessellation 的分辨率与误差必须为正数")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class ImagePreprocessingConfig(ConfigSection):
+    resize: bool = True
+    max_size: int = 1024
+    normalize: bool = True
+
+
+@dataclass(**_SECTION_OPTIONS)
+class SixViewsConfig(ConfigSection):
+    enabled: bool = True
+    angles: Tuple[float, ...] = (0, 90, 180, 270, 45, 135)
+    distance: float = 2.0
+
+
+@dataclass(**_SECTION_OPTIONS)
+class InputConfig(ConfigSection):
+    cad_formats: Tuple[str, ...] = (".step", ".stp", ".iges", ".igs", ".obj", ".stl")
+    tessellation: TessellationConfig = field(default_factory=TessellationConfig)
+    image_preprocessing: ImagePreprocessingConfig = field(default_factory=ImagePreprocessingConfig)
+    six_views: SixViewsConfig = field(default_factory=SixViewsConfig)
+
+
+# ---------------------------------------------------------------- 输出
+
+@dataclass(**_SECTION_OPTIONS)
+class OutputWriterConfig(ConfigSection):
+    workers: int = 2
+    max_pending: int = 8
+    fsync: bool = True
+    fsync_batch: int = 8
+    fsync_interval: float = 1.0
+
+    def __post_init__(self):
+        _check(self.workers >= 1 and self.max_pending >= 1 and self.fsync_batch >= 1,
+               "output.writer 的线程数、队列长度与同步批量必须为正整数")
+        _check(self.fsync_interval > 0, "output.writer.fsync_interval 必须为正数")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class ThumbnailConfig(ConfigSection):
+    enabled: bool = True
+    max_size: int = 256
+    format: str = "webp"
+    quality: int = 80
+
+    def __post_init__(self):
+        _check_choice(self.format, ('webp', 'jpeg', 'png'), 'output.thumbnails.format')
+        _check(self.max_size > 0 and 1 <= self.quality <= 100, "output.thumbnails 的尺寸或质量无效")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class OutputIndexConfig(ConfigSection):
+    enabled: bool = True
+    path: str = "data/output/index.sqlite"
+
+
+@dataclass(**_SECTION_OPTIONS)
+class BatchConfig(ConfigSection):
+    job_store: str = "data/output/batch_jobs.sqlite"
+    max_attempts: int = 2
+
+    def __post_init__(self):
+        _check(self.max_attempts >= 1, "output.batch.max_attempts 必须为正整数")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class OutputConfig(ConfigSection):
+    image_format: str = "png"
+    quality: int = 95
+    base_path: str = "data/output"
+    organize_by_date: bool = True
+    save_metadata: bool = True
+    include_prompts: bool = True
+    writer: OutputWriterConfig = field(default_factory=OutputWriterConfig)
+    thumbnails: ThumbnailConfig = field(default_factory=ThumbnailConfig)
+    index: OutputIndexConfig = field(default_factory=OutputIndexConfig)
+    batch: BatchConfig = field(default_factory=BatchConfig)
+
+    def __post_init__(self):
+        image_format = self.image_format.lower()
+        _check_choice(image_format, ('png', 'jpeg', 'jpg', 'webp'), 'output.image_format')
+        # 统一为规范名称，下游只需处理 png/jpeg/webp
+        object.__setattr__(self, 'image_format', 'jpeg' if image_format == 'jpg' else image_format)
+        _check(1 <= self.quality <= 100, "output.quality 必须在 1-100 范围内")
+
+
+# ---------------------------------------------------------------- 界面与日志
+
+@dataclass(**_SECTION_OPTIONS)
+class JobQueueConfig(ConfigSection):
+    max_pending: int = 16
+    preview_interval: int = 2
+    poll_interval: float = 0.5
+    abandon_after: Optional[float] = 30
+    save_outputs: bool = True
+
+    def __post_init__(self):
+        _check(self.max_pending >= 1, "ui.job_queue.max_pending 必须为正整数")
+        _check(self.preview_interval >= 0, "ui.job_queue.preview_interval 不能为负数")
+        _check(self.poll_interval > 0, "ui.job_queue.poll_interval 必须为正数")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class UIConfig(ConfigSection):
+    type: str = "streamlit"
+    theme: str = "light"
+    layout: str = "wide"
+    features: Mapping[str, bool] = _frozen_map()
+    job_queue: JobQueueConfig = field(default_factory=JobQueueConfig)
+
+    def __post_init__(self):
+        _check_choice(self.type, ('streamlit', 'gradio', 'fastapi'), 'ui.type')
+
+
+@dataclass(**_SECTION_OPTIONS)
+class LoggingConfig(ConfigSection):
+    level: str = "INFO"
+    file: str = "logs/gat.log"
+    max_size: str = "10MB"
+    backup_count: int = 5
+
+    def __post_init__(self):
+        _check_choice(self.level.upper(), ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'), 'logging.level')
+        _check_memory_size(self.max_size, 'logging.max_size')
+
+
+# ---------------------------------------------------------------- 性能
+
+@dataclass(**_SECTION_OPTIONS)
+class CacheConfig(ConfigSection):
+    enabled: bool = True
+    max_size: str = "1GB"
+    ttl: float = 3600
+
+    def __post_init__(self):
+        _check_memory_size(self.max_size, 'performance.cache.max_size')
+
+
+@dataclass(**_SECTION_OPTIONS)
+class ParallelConfig(ConfigSection):
+    enabled: bool = True
+    max_workers: int = 4
+
+
+@dataclass(**_SECTION_OPTIONS)
+class MemoryConfig(ConfigSection):
+    enabled: bool = True
+    cleanup_interval: float = 300
+    max_memory_usage: str = "8GB"
+    idle_offload_after: float = 300
+    offload_dir: str = "data/cache/offload"
+    background_cleanup: bool = True
+
+    def __post_init__(self):
+        _check(self.cleanup_interval > 0, "performance.memory.cleanup_interval 必须为正数")
+        _check_memory_size(self.max_memory_usage, 'performance.memory.max_memory_usage')
+
+
+@dataclass(**_SECTION_OPTIONS)
+class TracingConfig(ConfigSection):
+    enabled: bool = False
+    model_hooks: bool = True
+    sync_cuda: bool = False
+    chrome_trace_dir: str = ""
+
+
+@dataclass(**_SECTION_OPTIONS)
+class RegenerationConfig(ConfigSection):
+    enabled: bool = False
+    max_entries: int = 4
+
+    def __post_init__(self):
+        _check(self.max_entries >= 1, "performance.regeneration.max_entries 必须为正整数")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class TokenMergingConfig(ConfigSection):
+    enabled: bool = False
+    ratio: float = 0.5
+    resolution_ratios: Mapping[int, float] = _frozen_map()
+    max_downsample: int = 1
+    stride: int = 2
+
+    def __post_init__(self):
+        for name, ratio in (('ratio', self.ratio), *self.resolution_ratios.items()):
+            _check(0.0 <= ratio < 1.0, f"performance.token_merging 的合并比例 {name} 必须在 [0, 1) 范围内")
+        _check(self.max_downsample >= 1 and self.stride >= 1,
+               "performance.token_merging 的 max_downsample 与 stride 必须为正整数")
+
+
+@dataclass(**_SECTION_OPTIONS)
+class ProfilerConfig(ConfigSection):
+    enabled: bool = False
+    record_flops: bool = True
+    output_dir: str = "data/profiles"
+
+
+@dataclass(**_SECTION_OPTIONS)
+class PerformanceConfig(ConfigSection):
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    parallel: ParallelConfig = field(default_factory=ParallelConfig)
+    memory: MemoryConfig = field(default_factory=MemoryConfig)
+    tracing: TracingConfig = field(default_factory=TracingConfig)
+    regeneration: RegenerationConfig = field(default_factory=RegenerationConfig)
+    token_merging: TokenMergingConfig = field(default_factory=TokenMergingConfig)
+    profiler: ProfilerConfig = field(default_factory=ProfilerConfig)
+
+
+# ---------------------------------------------------------------- 完整配置
+
+@dataclass(**_SECTION_OPTIONS)
+class AppConfig(ConfigSection):
+    """完整配置（materials、interaction 尚未由代码读取，保留为只读映射）"""
+    models: ModelsConfig
+    generation: GenerationConfig = field(default_factory=GenerationConfig)
+    hardware: HardwareConfig = field(default_factory=HardwareConfig)
+    input: InputConfig = field(default_factory=InputConfig)
+    output: OutputConfig = field(default_factory=OutputConfig)
+    materials: Mapping[str, Any] = _frozen_map()
+    interaction: Mapping[str, Any] = _frozen_map()
+    ui: UIConfig = field(default_factory=UIConfig)
+    logging: LoggingConfig = field(default_factory=LoggingConfig)
+    performance: PerformanceConfig = field(default_factory=PerformanceConfig)
+
+    def digest(self, *sections: str) -> str:
+        """
+        配置内容的稳定摘要
+
+        Args:
+            sections: 只计算这些配置段（如 'models', 'hardware'），默认全部
+
+        Returns:
+            str: 16字节blake2b十六进制摘要
+        """
+        data = self.to_dict()
+        if sections:
+            data = {name: data[name] for name in sections}
+        payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    @property
+    def hash(self) -> str:
+        """完整配置的摘要"""
+        return self.digest()
+
+
+# ---------------------------------------------------------------- 构建与转换
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, MappingABC):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    if isinstance(value, MappingABC):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+def _convert(value: Any, annotation: Any, path: str) -> Any:
+    """按字段注解转换并校验一个配置值"""
+    origin = get_origin(annotation)
+    if annotation is Any:
+        return _freeze(value)
+    if origin is Union:
+        if value is None and type(None) in get_args(annotation):
+            return None
+        inner = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return _convert(value, inner[0], path)
+    if origin is tuple:
+        _check(isinstance(value, (list, tuple)), f"{path} 必须是列表")
+        item_type = get_args(annotation)[0]
+        return tuple(_convert(item, item_type, f"{path}[{i}]") for i, item in enumerate(value))
+    if origin is MappingABC:
+        _check(isinstance(value, MappingABC), f"{path} 必须是映射")
+        key_type, value_type = get_args(annotation)
+        return MappingProxyType({
+            _convert(key, key_type, f"{path}.{key}"): _convert(item, value_type, f"{path}.{key}")
+            for key, item in value.items()
+        })
+    if isinstance(annotation, type) and issubclass(annotation, ConfigSection):
+        return _build(annotation, value, path)
+    if annotation is bool:
+        _check(isinstance(value, bool), f"{path} 必须是布尔值，实际为 {value!r}")
+        return value
+    if annotation is int:
+        # 映射键来自环境变量时是字符串
+        if isinstance(value, str) and re.match(r'^-?\d+$', value):
+            return int(value)
+        _check(isinstance(value, int) and not isinstance(value, bool), f"{path} 必须是整数，实际为 {value!r}")
+        return value
+    if annotation is float:
+        _check(isinstance(value, (int, float)) and not isinstance(value, bool), f"{path} 必须是数值，实际为 {value!r}")
+        return float(value)
+    if annotation is str:
+        _check(isinstance(value, str), f"{path} 必须是字符串，实际为 {value!r}")
+        return value
+    raise TypeError(f"不支持的配置字段类型: {annotation}")
+
+
+def _build(cls, data: Any, path: str):
+    """由字典构建配置段：校验未知项与缺失的必填项，逐字段转换"""
+    name = path or cls.__name__
+    if data is None:
+        data = {}
+    _check(isinstance(data, MappingABC), f"{name} 必须是映射")
+    hints = get_type_hints(cls)
+    unknown = [key for key in data if key not in cls.__dataclass_fields__]
+    _check(not unknown, f"未知配置项: {', '.join(f'{path}.{key}' if path else str(key) for key in unknown)}")
+
+    values = {}
+    for field_name, spec in cls.__dataclass_fields__.items():
+        field_path = f"{path}.{field_name}" if path else field_name
+        if field_name in data:
+            values[field_name] = _convert(data[field_name], hints[field_name], field_path)
+        elif spec.default is MISSING and spec.default_factory is MISSING:
+            raise ConfigError(f"缺少必填配置项: {field_path}")
+    return cls(**values)
+
+
+def apply_env_overrides(data: Dict[str, Any], environ: Mapping[str, str]) -> Dict[str, Any]:
+    """
+    应用 GAT__<段>__<项> 形式的环境变量覆盖
+
+    Args:
+        data: 配置文件解析得到的字典（不修改）
+        environ: 环境变量
+
+    Returns:
+        Dict: 应用覆盖后的新字典
+    """
+    result = _thaw(data)
+    for name, raw in environ.items():
+        if not name.startswith(ENV_PREFIX):
+            continue
+        keys = [key.lower() for key in name[len(ENV_PREFIX):].split('__')]
+        try:
+            value = yaml.safe_load(raw)
+        except yaml.YAMLError:
+            value = raw
+
+        target = result
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+            _check(isinstance(target, dict), f"环境变量 {name} 覆盖的不是配置段")
+        target[keys[-1]] = value
+        logger.info(f"配置项 {'.'.join(keys)} 由环境变量 {name} 覆盖")
+    return result
+
+
+def changed_fields(old: AppConfig, new: AppConfig) -> List[str]:
+    """两份配置之间值不同的配置项（点分路径）"""
+    changes = []
+
+    def compare(a: Any, b: Any, path: str):
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in list(a) + [key for key in b if key not in a]:
+                compare(a.get(key), b.get(key), f"{path}.{key}" if path else str(key))
+        elif a != b:
+            changes.append(path)
+
+    compare(old.to_dict(), new.to_dict(), '')
+    return changes
+
+
+def is_reloadable(path: str) -> bool:
+    """配置项是否可以在运行中重新加载"""
+    return any(path == prefix or path.startswith(prefix + '.') for prefix in RELOADABLE_FIELDS)
+
+
+_loaded: Dict[str, AppConfig] = {}
+_loaded_lock = threading.Lock()
+
+
+def read_config(config_path: str, environ: Optional[Mapping[str, str]] = None) -> AppConfig:
+    """
+    读取并校验配置文件（不使用缓存）
+
+    Args:
+        config_path: 配置文件路径
+        environ: 环境变量，默认 os.environ
+
+    Returns:
+        AppConfig: 校验后的不可变配置
+    """
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f) or {}
+        return AppConfig.from_dict(apply_env_overrides(data, os.environ if environ is None else environ))
+    except Exception as e:
+        logger.error(f"加载配置文件失败: {e}")
+        raise
+
+
+def load_config(config_path: str = "configs/config.yaml") -> AppConfig:
+    """
+    加载配置（同一路径在进程内只解析一次，之后返回同一个对象）
+
+    Args:
+        config_path: 配置文件路径
+
+    Returns:
+        AppConfig: 校验后的不可变配置
+    """
+    key = str(Path(config_path).resolve())
+    with _loaded_lock:
+        if key not in _loaded:
+            _loaded[key] = read_config(config_path)
+            logger.info(f"配置已加载: {config_path}（{_loaded[key].hash}）")
+        return _loaded[key]
+
+
+def reload_config(current: AppConfig, config_path: str) -> Tuple[AppConfig, List[str]]:
+    """
+    重新读取配置文件，检查相对当前配置的变化是否都可以在运行中生效
+
+    Args:
+        current: 正在使用的配置
+        config_path: 配置文件路径
+
+    Returns:
+        (新配置, 变化的配置项)
+
+    Raises:
+        ConfigError: 配置无效，或有变化的配置项需要重启后生效（此时已加载的配置保持不变）
+    """
+    config = read_config(config_path)
+    changes = changed_fields(current, config)
+    blocked = [path for path in changes if not is_reloadable(path)]
+    if blocked:
+        raise ConfigError(f"以下配置项需要重启后生效: {', '.join(blocked)}")
+
+    with _loaded_lock:
+        _loaded[str(Path(config_path).resolve())] = config
+    logger.info(f"配置已重新加载（{config.hash}），变化的配置项: {', '.join(changes) or '无'}")
+    return config, changes
@@ -6,16 +6,107 @@ ControlNet处理器
 import torch
 import cv2
 import numpy as np
-from typing import Optional, Union, Tuple
+from contextlib import contextmanager
+from typing import Callable, Optional, Union, Tuple
 import logging
 from PIL import Image
 
-from diffusers import ControlNetModel, StableDiffusionControlNetPipeline
-from controlnet_aux import CannyDetector, OpenposeDetector, MidasDetector
+from .resolution_buckets import Size, fit_to_size
+from ..utils.tracing import get_tracer, span
 
 logger = logging.getLogger(__name__)
 
 
+@contextmanager
+def _patched_forward(module: torch.nn.Module, make_forward: Callable[[Callable], Callable]):
+    """
+    在上下文内替换模块实例的forward
+
+    Args:
+        module: 模块
+        make_forward: 接收原forward、返回新forward的函数
+    """
+    # 保留实例上已有的forward（如accelerate卸载钩子或其他包装），退出时原样恢复
+    patched = 'forward' in module.__dict__
+    previous = module.__dict__.get('forward')
+    module.forward = make_forward(module.forward)
+    try:
+        yield
+    finally:
+        if patched:
+            module.forward = previous
+        else:
+            del module.forward
+
+
+@contextmanager
+def static_conditioning(controlnet: torch.nn.Module, conditioning_scale: float, outside_range: str = "drop"):
+    """
+    针对静态控制图的ControlNet计算优化（一次管道调用内有效）
+
+    - 控制图编码：控制图在各去噪步之间不变，编码结果只计算一次；
+      批内各行相同（同一控制图的多张图像及CFG两个分支）时只编码一行再扩展
+    - 步数范围：管道在 control_guidance_start/end 之外以强度0调用ControlNet，此时不再计算：
+      drop 模式不加残差（与强度0结果一致），reuse 模式复用最近一次残差并按原强度缩放
+    - CFG截断后只剩条件分支时，控制图批量随之减半
+
+    Args:
+        controlnet: ControlNet模型
+        conditioning_scale: 配置的ControlNet强度（reuse模式缩放复用的残差）
+        outside_range: 步数范围之外的处理方式 (drop, reuse)
+    """
+    embedding_cache = {}
+    last_residuals = []
+
+    def make_embedding_forward(original):
+        def forward(controlnet_cond):
+            key = (controlnet_cond.data_ptr(), tuple(controlnet_cond.shape), controlnet_cond.stride())
+            if key not in embedding_cache:
+                first = controlnet_cond[:1]
+                if controlnet_cond.shape[0] > 1 and torch.equal(first.expand_as(controlnet_cond), controlnet_cond):
+                    embedding = original(first)
+                    embedding = embedding.expand(controlnet_cond.shape[0], *embedding.shape[1:])
+                else:
+                    embedding = original(controlnet_cond)
+                embedding_cache.clear()
+                embedding_cache[key] = embedding
+            return embedding_cache[key]
+        return forward
+
+    def make_controlnet_forward(original):
+        def forward(*args, **kwargs):
+            scale = kwargs.get('conditioning_scale', 1.0)
+            if kwargs.get('guess_mode') or kwargs.get('return_dict', True) or not isinstance(scale, (int, float)):
+                return original(*args, **kwargs)
+
+            # CFG截断后潜变量只剩条件分支，控制图仍是两个分支拼接的批量，取后半部分与之对应
+            sample = args[0] if args else kwargs['sample']
+            controlnet_cond = kwargs.get('controlnet_cond')
+            if controlnet_cond is not None and controlnet_cond.shape[0] > sample.shape[0]:
+                kwargs['controlnet_cond'] = controlnet_cond[-sample.shape[0]:]
+
+            if scale == 0:
+                if outside_range == 'reuse' and last_residuals:
+                    # 残差可能在CFG截断前保存（两个分支），同样取后半部分与潜变量批量对应
+                    down, mid = last_residuals[0]
+                    batch = sample.shape[0]
+                    return [t[-batch:] * conditioning_scale for t in down], mid[-batch:] * conditioning_scale
+                # UNet在残差为None时不叠加ControlNet输出
+                return None, None
+
+            if outside_range != 'reuse':
+                return original(*args, **kwargs)
+            # 以强度1.0计算并保存，便于在范围外按原强度复用
+            down, mid = original(*args, **{**kwargs, 'conditioning_scale': 1.0})
+            last_residuals[:] = [(down, mid)]
+            return [t * scale for t in down], mid * scale
+        return forward
+
+    with _patched_forward(controlnet.controlnet_cond_embedding, make_embedding_forward), \
+            _patched_forward(controlnet, make_controlnet_forward):
+        yield
+
+
 class ControlNetProcessor:
     """ControlNet处理器"""
     
@@ -30,27 +121,113 @@ class ControlNetProcessor:
         self.controlnet_models = {}
         self.detectors = {}
         self.pipeline = None
+        self.pipeline_type = None
+        self.memory_governor = None
         
-        # 初始化检测器
-        self._initialize_detectors()
+    def attach_memory_governor(self, governor):
+        """
+        接入内存管理器，登记已加载的ControlNet模型和检测器
         
-    def _initialize_detectors(self):
-        """初始化各种检测器"""
-        try:
-            # Canny边缘检测器
-            self.detectors['canny'] = CannyDetector()
-            
-            # OpenPose姿态检测器
-            self.detectors['openpose'] = OpenposeDetector.from_pretrained("lllyasviel/ControlNet")
+        Args:
+            governor: MemoryGovernor实例
+        """
+        self.memory_governor = governor
+        for controlnet_type in self.controlnet_models:
+            self._register_controlnet(controlnet_type)
+        for name in self.detectors:
+            self._register_detector(name)
+    
+    def _register_controlnet(self, controlnet_type: str):
+        """在内存管理器中登记ControlNet模型（空闲时可卸载，超出预算时可驱逐）"""
+        if self.memory_governor is None:
+            return
+        self.memory_governor.register_module(
+            f"controlnet:{controlnet_type}",
+            self.controlnet_models[controlnet_type],
+            kind='controlnet',
+            evict_fn=lambda: self.unload_controlnet_model(controlnet_type)
+        )
+    
+    def _register_detector(self, name: str):
+        """在内存管理器中登记检测器"""
+        detector = self.detectors.get(name)
+        if self.memory_governor is None or detector is None:
+            return
+        
+        from .memory_governor import module_nbytes
+        
+        model = getattr(detector, 'model', None)
+        size_fn = (lambda: module_nbytes(model)) if isinstance(model, torch.nn.Module) else (lambda: 0)
+        self.memory_governor.register(
+            f"detector:{name}",
+            size_fn,
+            kind='detector',
+            evict_fn=lambda: self.unload_detector(name)
+        )
+    
+    def unload_detector(self, name: str):
+        """
+        卸载检测器，下次使用时重新加载
+        
+        Args:
+            name: 检测器名称
+        """
+        self.detectors.pop(name, None)
+        if self.memory_governor is not None:
+            self.memory_governor.unregister(f"detector:{name}", restore=False)
+        logger.info(f"ControlNet检测器 {name} 已卸载")
+    
+    def unload_controlnet_model(self, controlnet_type: str):
+        """
+        卸载ControlNet模型，使用该模型的管道一并释放
+        
+        Args:
+            controlnet_type: ControlNet类型
+        """
+        self.controlnet_models.pop(controlnet_type, None)
+        if self.pipeline_type == controlnet_type:
+            self.pipeline = None
+            self.pipeline_type = None
+        if self.memory_governor is not None:
+            self.memory_governor.unregister(f"controlnet:{controlnet_type}", restore=False)
+        logger.info(f"ControlNet模型 {controlnet_type} 已卸载")
+        
+    def _get_detector(self, name: str):
+        """
+        获取检测器，首次使用时才加载
+        
+        检测器需要导入controlnet_aux并下载权重，延迟到实际使用对应方法时再初始化。
+        
+        Args:
+            name: 检测器名称 (canny, openpose, midas)
             
-            # Midas深度检测器
-            self.detectors['midas'] = MidasDetector.from_pretrained("lllyasviel/ControlNet")
+        Returns:
+            检测器实例，加载失败时返回None
+        """
+        if name in self.detectors:
+            return self.detectors[name]
+        
+        try:
+            from controlnet_aux import CannyDetector, OpenposeDetector, MidasDetector
+            
+            if name == 'canny':
+                detector = CannyDetector()
+            elif name == 'openpose':
+                detector = OpenposeDetector.from_pretrained("lllyasviel/ControlNet")
+            elif name == 'midas':
+                detector = MidasDetector.from_pretrained("lllyasviel/ControlNet")
+            else:
+                raise ValueError(f"不支持的检测器: {name}")
             
-            logger.info("ControlNet检测器初始化完成")
+            logger.info(f"ControlNet检测器 {name} 初始化完成")
             
         except Exception as e:
-            logger.error(f"ControlNet检测器初始化失败: {e}")
-            raise
+            logger.error(f"ControlNet检测器 {name} 初始化失败: {e}")
+            detector = None
+        
+        self.detectors[name] = detector
+        self._register_detector(name)
+        return detector
     
     def load_controlnet_model(self, controlnet_type: str, device: torch.device) -> bool:
         """
@@ -64,6 +241,8 @@ class ControlNetProcessor:
             bool: 加载是否成功
         """
         try:
+            from diffusers import ControlNetModel
+            
             if controlnet_type not in self.config['models']:
                 logger.error(f"不支持的ControlNet类型: {controlnet_type}")
                 return False
@@ -73,12 +252,18 @@ class ControlNetProcessor:
             logger.info(f"加载ControlNet模型: {controlnet_type}")
             
             # 加载ControlNet模型
-            controlnet = ControlNetModel.from_pretrained(
-                model_path,
-                torch_dtype=torch.float16 if device.type == 'cuda' else torch.float32
-            )
+            with span('controlnet_load', controlnet=controlnet_type):
+                controlnet = ControlNetModel.from_pretrained(
+                    model_path,
+                    torch_dtype=torch.float16 if device.type == 'cuda' else torch.float32
+                )
+            
+            tracer = get_tracer()
+            if tracer.enabled:
+                tracer.instrument_module(controlnet, 'controlnet_step')
             
             self.controlnet_models[controlnet_type] = controlnet.to(device)
+            self._register_controlnet(controlnet_type)
             
             logger.info(f"ControlNet模型 {controlnet_type} 加载成功")
             return True
@@ -99,19 +284,25 @@ class ControlNetProcessor:
             bool: 创建是否成功
         """
         try:
+            from diffusers import StableDiffusionControlNetPipeline
+            
             if controlnet_type not in self.controlnet_models:
                 logger.error(f"ControlNet模型 {controlnet_type} 未加载")
                 return False
             
             controlnet = self.controlnet_models[controlnet_type]
             
-            # 创建ControlNet管道
-            self.pipeline = StableDiffusionControlNetPipeline.from_pretrained(
-                base_pipeline,
+            # 与基础管道共享文本编码器、UNet、VAE等组件（含已融合的LoRA），不重复占用内存
+            components = dict(base_pipeline.components)
+            components.pop('controlnet', None)
+            self.pipeline = StableDiffusionControlNetPipeline(
+                **components,
                 controlnet=controlnet,
-                torch_dtype=torch.float16 if controlnet.device.type == 'cuda' else torch.float32
+                requires_safety_checker=False
             )
             
+            self.pipeline_type = controlnet_type
+            
             # 启用优化
             if hasattr(self.pipeline, 'enable_attention_slicing'):
                 self.pipeline.enable_attention_slicing()
@@ -123,39 +314,65 @@ class ControlNetProcessor:
             logger.error(f"ControlNet管道创建失败: {e}")
             return False
     
+    @staticmethod
+    def load_image(cad_image: Union[str, np.ndarray, Image.Image]) -> np.ndarray:
+        """
+        加载CAD输入图像
+        
+        Args:
+            cad_image: CAD图像（路径、numpy数组或PIL图像）
+            
+        Returns:
+            np.ndarray: RGB图像数组（数组输入原样返回）
+        """
+        if isinstance(cad_image, str):
+            image = cv2.imread(cad_image)
+            if image is None:
+                raise ValueError(f"无法读取图像: {cad_image}")
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        elif isinstance(cad_image, np.ndarray):
+            return cad_image
+        elif isinstance(cad_image, Image.Image):
+            return np.array(cad_image)
+        else:
+            raise ValueError("不支持的图像格式")
+    
     def process_cad_input(self, cad_image: Union[str, np.ndarray, Image.Image], 
-                         method: str = "canny") -> np.ndarray:
+                         method: str = "canny", size: Optional[Size] = None) -> np.ndarray:
         """
         处理CAD输入图像
         
         Args:
             cad_image: CAD图像（路径、numpy数组或PIL图像）
             method: 处理方法 (canny, sketch, depth)
+            size: 输出尺寸 (宽, 高)；提供时先按比例缩放并填充到该尺寸再提取控制图，
+                管道不再拉伸控制图；默认保持输入尺寸
             
         Returns:
             np.ndarray: 处理后的控制图像
         """
         try:
-            # 加载图像
-            if isinstance(cad_image, str):
-                image = cv2.imread(cad_image)
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            elif isinstance(cad_image, np.ndarray):
-                image = cad_image
-            elif isinstance(cad_image, Image.Image):
-                image = np.array(cad_image)
-            else:
-                raise ValueError("不支持的图像格式")
+            image = self.load_image(cad_image)
+            
+            # 在目标分辨率上提取边缘等特征，线宽与输出分辨率一致
+            if size is not None:
+                image = fit_to_size(image, size)
             
             # 根据方法处理图像
-            if method == "canny":
-                return self._process_canny(image)
-            elif method == "sketch":
-                return self._process_sketch(image)
-            elif method == "depth":
-                return self._process_depth(image)
-            else:
-                raise ValueError(f"不支持的处理方法: {method}")
+            with span('controlnet_preprocess', method=method):
+                if method == "canny":
+                    control = self._process_canny(image)
+                elif method == "sketch":
+                    control = self._process_sketch(image)
+                elif method == "depth":
+                    control = self._process_depth(image)
+                else:
+                    raise ValueError(f"不支持的处理方法: {method}")
+            
+            # 检测器可能按自身分辨率输出，长宽比已一致，直接缩放到目标尺寸
+            if size is not None and isinstance(control, np.ndarray) and control.shape[1::-1] != tuple(size):
+                control = cv2.resize(control, tuple(size), interpolation=cv2.INTER_LINEAR)
+            return control
                 
         except Exception as e:
             logger.error(f"CAD输入处理失败: {e}")
@@ -217,8 +434,9 @@ class ControlNetProcessor:
         """深度图处理"""
         try:
             # 使用Midas检测器
-            if 'midas' in self.detectors:
-                depth = self.detectors['midas'](image)
+            midas = self._get_detector('midas')
+            if midas is not None:
+                depth = midas(image)
                 return depth
             else:
                 # 简单的深度估计
@@ -251,19 +469,26 @@ class ControlNetProcessor:
             if self.pipeline is None:
                 raise ValueError("ControlNet管道未初始化")
             
-            # 生成参数
+            # 生成参数（其余参数如width/height/generator原样传给管道）
             generation_params = {
+                'num_inference_steps': 20,
+                'guidance_scale': 7.5,
+                'controlnet_conditioning_scale': 1.0,
+                'num_images_per_prompt': 1,
+                **self.guidance_range(),
+                **kwargs,
                 'prompt': prompt,
                 'image': controlnet_input,
-                'negative_prompt': negative_prompt,
-                'num_inference_steps': kwargs.get('num_inference_steps', 20),
-                'guidance_scale': kwargs.get('guidance_scale', 7.5),
-                'controlnet_conditioning_scale': kwargs.get('controlnet_conditioning_scale', 1.0),
-                'num_images_per_prompt': kwargs.get('num_images_per_prompt', 1)
+                'negative_prompt': negative_prompt
             }
             
             # 生成图像
-            result = self.pipeline(**generation_params)
+            with static_conditioning(
+                self.pipeline.controlnet,
+                generation_params['controlnet_conditioning_scale'],
+                self.config.get('outside_range', 'drop')
+            ):
+                result = self.pipeline(**generation_params)
             
             logger.info("ControlNet图像生成完成")
             return result
@@ -272,6 +497,13 @@ class ControlNetProcessor:
             logger.error(f"ControlNet生成失败: {e}")
             raise
     
+    def guidance_range(self) -> dict:
+        """配置的ControlNet作用步数范围（占总步数的比例）"""
+        return {
+            'control_guidance_start': self.config.get('guidance_start', 0.0),
+            'control_guidance_end': self.config.get('guidance_end', 1.0)
+        }
+    
     def extract_six_views(self, cad_model_path: str) -> dict:
         """
         从CAD模型提取六视图
@@ -0,0 +1,118 @@
+"""
+CPU推理优化模块
+为纯CPU部署提供bfloat16自动混合精度、线性层动态int8量化、channels_last
+内存格式与线程数配置。torch.compile编译由 compiled_unet 模块按形状管理，
+compile 相关配置项保留为 hardware.compile 的兼容开关
+"""
+
+import logging
+import os
+from contextlib import nullcontext
+from typing import Any, Dict
+
+import torch
+
+from ..utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 支持的自动混合精度类型
+AUTOCAST_DTYPES = {
+    'float32': None,
+    'bfloat16': torch.bfloat16,
+}
+
+
+def available_cpu_count() -> int:
+    """当前进程可用的CPU数量（考虑容器/taskset的亲和性限制）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class CPUInferenceOptimizer:
+    """CPU推理优化器"""
+
+    def __init__(self, cpu_config: Dict):
+        """
+        初始化CPU推理优化器
+
+        Args:
+            cpu_config: CPU优化配置（对应配置文件 hardware.cpu_optimization）
+        """
+        self.config = cpu_config
+        self.num_threads = cpu_config.get('num_threads', 0)
+        self.num_interop_threads = cpu_config.get('num_interop_threads', 1)
+        self.channels_last = cpu_config.get('channels_last', True)
+        self.quantize_int8 = cpu_config.get('quantize_int8', False)
+        # 兼容开关，由AIEngine转为 hardware.compile 配置
+        self.compile = cpu_config.get('compile', False)
+        self.compile_mode = cpu_config.get('compile_mode', 'default')
+        self.warmup_steps = cpu_config.get('warmup_steps', 2)
+
+        dtype_name = cpu_config.get('dtype', 'float32')
+        if dtype_name not in AUTOCAST_DTYPES:
+            raise ValueError(f"不支持的CPU推理精度: {dtype_name}")
+        self.autocast_dtype = AUTOCAST_DTYPES[dtype_name]
+
+        if self.quantize_int8 and self.autocast_dtype is not None:
+            # 动态量化线性层只接受float32输入
+            logger.warning("int8量化与bfloat16自动混合精度不能同时启用，已禁用bfloat16")
+            self.autocast_dtype = None
+
+        self.quantized = False
+
+    def configure_threads(self):
+        """配置intra-op/inter-op线程数，需在任何推理前调用"""
+        num_threads = self.num_threads or available_cpu_count()
+        torch.set_num_threads(num_threads)
+
+        try:
+            torch.set_num_interop_threads(self.num_interop_threads)
+        except RuntimeError as e:
+            # inter-op线程池启动后不可再修改
+            logger.warning(f"inter-op线程数设置失败: {e}")
+
+        logger.info(f"CPU线程配置: intra-op={torch.get_num_threads()}, "
+                    f"inter-op={torch.get_num_interop_threads()}")
+
+    def optimize_pipeline(self, pipeline: Any):
+        """
+        对管道应用不影响权重数值的优化（内存格式）
+
+        Args:
+            pipeline: Stable Diffusion管道
+        """
+        if self.channels_last:
+            pipeline.unet.to(memory_format=torch.channels_last)
+            pipeline.vae.to(memory_format=torch.channels_last)
+            logger.info("UNet/VAE已切换为channels_last内存格式")
+
+    def quantize(self, pipeline: Any):
+        """
+        对UNet和文本编码器的线性层做动态int8量化
+
+        量化后权重无法再融合LoRA，因此应在LoRA加载之后、首次推理之前调用。
+
+        Args:
+            pipeline: Stable Diffusion管道
+        """
+        if not self.quantize_int8 or self.quantized:
+            return
+
+        from torch.ao.quantization import quantize_dynamic
+
+        unet = getattr(pipeline.unet, '_orig_mod', pipeline.unet)
+        with span('cpu_quantize'):
+            quantize_dynamic(unet, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+            quantize_dynamic(pipeline.text_encoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+        self.quantized = True
+        logger.info("UNet/文本编码器线性层已完成动态int8量化")
+
+    def inference_context(self):
+        """推理上下文：启用bfloat16时返回CPU autocast，否则为空上下文"""
+        if self.autocast_dtype is None:
+            return nullcontext()
+        return torch.autocast('cpu', dtype=self.autocast_dtype)
@@ -8,28 +8,54 @@ import logging
 from typing import List, Dict, Optional, Union, Tuple
 from PIL import Image
 import numpy as np
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
 from pathlib import Path
 
 from .ai_engine import AIEngine
 from .lora_manager import LoRAManager
 from .controlnet_processor import ControlNetProcessor
+from .cancellation import CancellationToken, DeadlineExceeded, GenerationCancelled
+from .config import AppConfig, ConfigError, GenerationConfig, load_config, reload_config
+from .regeneration import RegenerationCache
+from .resolution_buckets import ResolutionBuckets, Size
+from .output_store import OutputIndex, build_metadata, encode_thumbnail, new_run_id, png_info
+from .output_writer import OutputWriter, WriteResult
+from .metrics import get_registry
+from ..utils.tracing import Trace, get_tracer, span
 
 logger = logging.getLogger(__name__)
 
+# 输出格式 -> PIL格式名称
+PIL_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'jpg': 'JPEG', 'webp': 'WEBP'}
+
 
 class ImageGenerator:
     """图像生成器主类"""
     
-    def __init__(self, config_path: str = "configs/config.yaml"):
+    def __init__(self, config_path: Union[str, AppConfig] = "configs/config.yaml"):
         """
         初始化图像生成器
         
         Args:
-            config_path: 配置文件路径
+            config_path: 配置文件路径，或已加载的配置（此时不支持重新加载）
         """
-        self.config_path = config_path
+        self.config_path = None if isinstance(config_path, AppConfig) else config_path
+        self.config = config_path if isinstance(config_path, AppConfig) else None
+        self.config_hash = None
         self.ai_engine = None
         self.generation_config = None
+        self.tracing_config = None
+        self.regeneration_cache = None
+        self.resolution_buckets = None
+        self.output_config = None
+        self.thumbnail_config = None
+        self.output_index = None
+        self.output_writer = None
+        self._writer_lock = threading.Lock()
         
         # 初始化组件
         self._initialize()
@@ -37,14 +63,33 @@ class ImageGenerator:
     def _initialize(self):
         """初始化所有组件"""
         try:
+            # 配置文件在进程内只解析一次，AI引擎与生成器共用同一个配置对象
+            if self.config is None:
+                self.config = load_config(self.config_path)
+            
             # 初始化AI引擎
-            self.ai_engine = AIEngine(self.config_path)
+            self.ai_engine = AIEngine(self.config)
             
             # 获取生成配置
-            import yaml
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
-                self.generation_config = config['generation']
+            self._apply_config(self.config)
+            
+            # 结果索引：记录所有运行的生成参数，供界面查询
+            index_config = self.output_config.index
+            if index_config.enabled:
+                self.output_index = OutputIndex(index_config.path)
+            
+            # 增量重新生成：保留最近几次生成的中间结果
+            regeneration_config = self.config.performance.regeneration
+            if regeneration_config.enabled:
+                self.regeneration_cache = RegenerationCache(regeneration_config.max_entries)
+                governor = self.ai_engine.memory_governor
+                if governor is not None:
+                    governor.register(
+                        'regeneration_cache',
+                        self.regeneration_cache.nbytes,
+                        kind='regeneration_cache',
+                        evict_fn=self.regeneration_cache.clear
+                    )
             
             logger.info("图像生成器初始化完成")
             
@@ -52,6 +97,43 @@ class ImageGenerator:
             logger.error(f"图像生成器初始化失败: {e}")
             raise
     
+    def _apply_config(self, config: AppConfig):
+        """更新生成器持有的配置段（每次生成和保存时读取）"""
+        self.config = config
+        # 配置摘要随结果保存，用于区分不同配置下生成的结果
+        self.config_hash = config.hash
+        self.generation_config = config.generation
+        self.resolution_buckets = ResolutionBuckets(
+            config.generation.buckets, config.generation.width, config.generation.height
+        )
+        self.tracing_config = config.performance.tracing
+        self.output_config = config.output
+        self.thumbnail_config = config.output.thumbnails
+        if self.regeneration_cache is not None:
+            self.regeneration_cache.max_entries = config.performance.regeneration.max_entries
+    
+    def reload_config(self) -> List[str]:
+        """
+        重新读取配置文件，在不重建管道、不重启工作线程的情况下应用变化
+        
+        只允许 config.RELOADABLE_FIELDS 中的配置项（生成默认值、缓存大小等）变化，
+        新配置从下一次生成起生效；其他配置项变化时保持原配置不变。
+        
+        Returns:
+            List[str]: 变化的配置项
+            
+        Raises:
+            ConfigError: 配置无效，或有变化的配置项需要重启后生效
+        """
+        if self.config_path is None:
+            raise ConfigError("图像生成器由配置对象创建，无法重新加载配置文件")
+        
+        config, changes = reload_config(self.config, self.config_path)
+        if changes:
+            self.ai_engine.apply_config(config)
+            self._apply_config(config)
+        return changes
+    
     def generate_from_cad(
         self,
         cad_input: Union[str, np.ndarray, Image.Image],
@@ -59,6 +141,8 @@ class ImageGenerator:
         lora_name: str = "morphy_richards",
         controlnet_method: str = "canny",
         num_images: int = 4,
+        cancel_token: Optional[CancellationToken] = None,
+        timeout: Optional[float] = None,
         **kwargs
     ) -> Dict[str, any]:
         """
@@ -70,51 +154,173 @@ class ImageGenerator:
             lora_name: 使用的LoRA模型名称
             controlnet_method: ControlNet处理方法
             num_images: 生成图像数量
-            **kwargs: 其他生成参数
+            cancel_token: 取消令牌，各阶段之间和每个去噪步结束时检查
+            timeout: 本次请求的最长执行时间（秒），默认使用配置 generation.timeout
+            **kwargs: 其他生成参数（step_callback 透传给 AIEngine.generate_images，用于进度回调）
             
         Returns:
-            Dict: 生成结果字典
+            Dict: 生成结果字典（timings为各阶段耗时，peak_memory为峰值内存；未启用追踪时为空）
+        """
+        return self._generate_group(
+            [cad_input], [prompt], lora_name, controlnet_method, num_images,
+            cancel_token, timeout, **kwargs
+        )[0]
+    
+    def _generate_group(
+        self,
+        cad_inputs: List[Union[str, np.ndarray, Image.Image]],
+        prompts: List[str],
+        lora_name: str,
+        controlnet_method: str,
+        num_images: int,
+        cancel_token: Optional[CancellationToken] = None,
+        timeout: Optional[float] = None,
+        **kwargs
+    ) -> List[Dict[str, any]]:
         """
+        在一次管道调用中生成一组请求（共用LoRA、ControlNet方法和生成参数）
+        
+        多个请求的条件/无条件分支打包成一个批量，去噪循环只执行一次；
+        单个请求时与逐个生成完全相同。
+        
+        Returns:
+            List[Dict]: 与输入一一对应的生成结果
+        """
+        metrics = get_registry()
+        count = len(prompts)
+        metrics.in_flight.inc(count)
+        start_time = time.perf_counter()
+        cancel_token = self._cancel_token(cancel_token, timeout or self.generation_config.timeout)
         try:
-            logger.info(f"开始从CAD生成图像，LoRA: {lora_name}, 方法: {controlnet_method}")
-            
-            # 1. 加载LoRA模型
-            if not self.ai_engine.load_lora(lora_name):
-                raise ValueError(f"LoRA模型 {lora_name} 加载失败")
+            logger.info(f"开始从CAD生成图像，LoRA: {lora_name}, 方法: {controlnet_method}, 请求数: {count}")
             
-            # 2. 处理CAD输入
-            controlnet_input = self._process_cad_input(cad_input, controlnet_method)
-            
-            # 3. 构建完整提示词
-            full_prompt = self._build_prompt(prompt, lora_name)
-            
-            # 4. 生成图像
-            images = self.ai_engine.generate_images(
-                prompt=full_prompt,
-                controlnet_input=controlnet_input,
-                num_images=num_images,
-                **kwargs
-            )
+            with get_tracer().trace('generate_from_cad') as trace:
+                # 1. 加载LoRA模型
+                self._check_cancelled(cancel_token)
+                with span('lora_load', lora=lora_name):
+                    if not self.ai_engine.load_lora(lora_name):
+                        raise ValueError(f"LoRA模型 {lora_name} 加载失败")
+                
+                # 2. 处理CAD输入并准备对应的ControlNet管道
+                self._check_cancelled(cancel_token)
+                with span('cad_preprocess', method=controlnet_method):
+                    requested_size = self._requested_size(kwargs)
+                    controlnet_inputs = [
+                        self._control_input(cad_input, controlnet_method, requested_size) for cad_input in cad_inputs
+                    ]
+                
+                # 输出分辨率即控制图所在的分桶，合批的请求需位于同一分桶
+                sizes = {tuple(control.shape[-2:]) for control in controlnet_inputs}
+                if len(sizes) > 1:
+                    raise ValueError(f"合批请求的分辨率不一致: {sorted(sizes)}")
+                height, width = sizes.pop()
+                kwargs = {**kwargs, 'width': width, 'height': height}
+                with span('controlnet_prepare', controlnet=controlnet_method):
+                    if not self.ai_engine.prepare_controlnet(controlnet_method):
+                        raise ValueError(f"ControlNet {controlnet_method} 管道准备失败")
+                
+                # 3. 构建完整提示词
+                with span('prompt_build'):
+                    full_prompts = [self._build_prompt(prompt, lora_name) for prompt in prompts]
+                
+                # 4. 生成图像（去噪循环内每步检查取消令牌）
+                with span('generate'):
+                    images = self.ai_engine.generate_images(
+                        prompt=full_prompts[0] if count == 1 else full_prompts,
+                        controlnet_input=controlnet_inputs[0] if count == 1 else controlnet_inputs,
+                        num_images=num_images,
+                        cancel_token=cancel_token,
+                        state_cache=self.regeneration_cache,
+                        **kwargs
+                    )
+                
+                # 5. 后处理图像
+                with span('post_process'):
+                    processed_images = self._post_process_images(images)
+                
+                # 界面图库使用的缩略图，生成时编码一次
+                thumbnails = None
+                if self.thumbnail_config.enabled:
+                    with span('thumbnails'):
+                        thumbnails = [self._encode_thumbnail(image) for image in processed_images]
             
-            # 5. 后处理图像
-            processed_images = self._post_process_images(images)
+            # 6. 构建结果（输出图像按提示词顺序分组）
+            per_request = len(processed_images) // count
+            timings = trace.timings() if trace is not None else {}
+            trace_file = self._export_trace(trace) if trace is not None else None
+            if trace is not None:
+                logger.info(f"生成耗时: {timings}")
             
-            # 6. 构建结果
-            result = {
-                'images': processed_images,
-                'prompt': full_prompt,
-                'lora_used': lora_name,
-                'controlnet_method': controlnet_method,
-                'num_generated': len(processed_images),
-                'generation_params': kwargs
-            }
+            duration = time.perf_counter() - start_time
+            results = []
+            for i, full_prompt in enumerate(full_prompts):
+                request_images = processed_images[i * per_request:(i + 1) * per_request]
+                result = {
+                    'images': request_images,
+                    'prompt': full_prompt,
+                    'lora_used': lora_name,
+                    'controlnet_method': controlnet_method,
+                    'num_generated': len(request_images),
+                    'generation_params': {k: v for k, v in kwargs.items() if k != 'step_callback'},
+                    'timings': timings,
+                    'peak_memory': trace.peak_memory() if trace is not None else {},
+                    'trace': trace,
+                    'config_hash': self.config_hash
+                }
+                if thumbnails is not None:
+                    result['thumbnails'] = thumbnails[i * per_request:(i + 1) * per_request]
+                if count > 1:
+                    result['packed_requests'] = count
+                
+                # 开启UNet分析时附加块级耗时汇总
+                if self.ai_engine.last_profile is not None:
+                    result['unet_profile'] = self.ai_engine.last_profile.summary()
+                
+                if trace is not None:
+                    result['trace_file'] = trace_file
+                
+                metrics.record_request(
+                    'success',
+                    duration,
+                    timings=timings,
+                    lora=lora_name,
+                    num_images=len(request_images)
+                )
+                results.append(result)
             
             logger.info(f"成功生成 {len(processed_images)} 张图像")
-            return result
+            return results
             
+        except GenerationCancelled as e:
+            status = 'timeout' if isinstance(e, DeadlineExceeded) else 'cancelled'
+            for _ in range(count):
+                metrics.record_request(status, time.perf_counter() - start_time)
+            logger.info(f"CAD图像生成已中止: {e}")
+            raise
         except Exception as e:
+            for _ in range(count):
+                metrics.record_request('error', time.perf_counter() - start_time)
             logger.error(f"CAD图像生成失败: {e}")
             raise
+        finally:
+            metrics.in_flight.dec(count)
+    
+    def _control_input(self, cad_input: Union[str, np.ndarray, Image.Image], method: str,
+                       requested_size: Optional[Size] = None) -> torch.Tensor:
+        """预处理CAD输入（启用增量重新生成时复用缓存的控制图）"""
+        if self.regeneration_cache is not None:
+            return self.regeneration_cache.control(
+                cad_input, method, lambda: self._process_cad_input(cad_input, method, requested_size),
+                size_key=requested_size or self.resolution_buckets.key
+            )
+        return self._process_cad_input(cad_input, method, requested_size)
+    
+    def _requested_size(self, kwargs: Dict) -> Optional[Size]:
+        """调用方显式指定的输出尺寸（只指定一边时另一边使用 generation 配置）；未指定时按分桶选择"""
+        if not kwargs.get('width') and not kwargs.get('height'):
+            return None
+        return (int(kwargs.get('width') or self.generation_config.width),
+                int(kwargs.get('height') or self.generation_config.height))
     
     def generate_batch(
         self,
@@ -122,6 +328,8 @@ class ImageGenerator:
         prompts: List[str],
         lora_name: str = "morphy_richards",
         controlnet_method: str = "canny",
+        cancel_token: Optional[CancellationToken] = None,
+        timeout: Optional[float] = None,
         **kwargs
     ) -> List[Dict[str, any]]:
         """
@@ -132,42 +340,108 @@ class ImageGenerator:
             prompts: 提示词列表
             lora_name: 使用的LoRA模型名称
             controlnet_method: ControlNet处理方法
+            cancel_token: 取消令牌，取消后剩余输入不再执行
+            timeout: 整个批次的最长执行时间（秒），各输入另受 generation.timeout 限制
             **kwargs: 其他生成参数
             
+        输入按输出分辨率分桶分组，同一分桶内每 generation.pack_requests 个输入打包为一次管道调用，
+        条件/无条件分支在同一批量中计算。
+            
         Returns:
-            List[Dict]: 批量生成结果列表
+            List[Dict]: 批量生成结果列表（与输入顺序一致）
         """
+        metrics = get_registry()
+        pending = min(len(cad_inputs), len(prompts))
+        metrics.queue_depth.inc(pending)
+        cancel_token = self._cancel_token(cancel_token, timeout)
+        # 每次管道调用打包的请求数（1表示逐个生成）
+        pack_size = self.generation_config.pack_requests
+        num_images = kwargs.pop('num_images', 4)
+        total = pending
+        results = [None] * total
         try:
-            results = []
+            # 按分桶分组（每个输入只读取一次，分组后以数组传入），分组内保持输入顺序
+            processor = self.ai_engine.controlnet_processor
+            requested_size = self._requested_size(kwargs)
+            images = []
+            buckets: Dict[Size, List[int]] = {}
+            for i in range(total):
+                image = processor.load_image(cad_inputs[i])
+                images.append(image)
+                size = self.resolution_buckets.select(image.shape[1], image.shape[0], requested_size)
+                buckets.setdefault(size, []).append(i)
             
-            for i, (cad_input, prompt) in enumerate(zip(cad_inputs, prompts)):
-                logger.info(f"处理第 {i+1}/{len(cad_inputs)} 个输入")
-                
-                result = self.generate_from_cad(
-                    cad_input=cad_input,
-                    prompt=prompt,
-                    lora_name=lora_name,
-                    controlnet_method=controlnet_method,
-                    **kwargs
-                )
-                
-                results.append(result)
+            for (width, height), indices in buckets.items():
+                for start in range(0, len(indices), pack_size):
+                    group = indices[start:start + pack_size]
+                    logger.info(f"处理分桶 {width}x{height} 的 {len(group)} 个输入"
+                                f"（第 {', '.join(str(i + 1) for i in group)}/{total} 个）")
+                    
+                    metrics.queue_depth.dec(len(group))
+                    pending -= len(group)
+                    group_results = self._generate_group(
+                        [images[i] for i in group],
+                        [prompts[i] for i in group],
+                        lora_name,
+                        controlnet_method,
+                        num_images,
+                        cancel_token=cancel_token,
+                        **{**kwargs, 'width': width, 'height': height}
+                    )
+                    for i, result in zip(group, group_results):
+                        results[i] = result
             
-            logger.info(f"批量生成完成，共处理 {len(results)} 个输入")
+            logger.info(f"批量生成完成，共处理 {total} 个输入")
             return results
             
+        except GenerationCancelled as e:
+            completed = sum(result is not None for result in results)
+            logger.info(f"批量生成已中止（完成 {completed} 个）: {e}")
+            raise
         except Exception as e:
             logger.error(f"批量生成失败: {e}")
             raise
+        finally:
+            # 失败时未执行的输入不再计入队列
+            metrics.queue_depth.dec(pending)
+    
+    @staticmethod
+    def _cancel_token(cancel_token: Optional[CancellationToken],
+                      timeout: Optional[float]) -> Optional[CancellationToken]:
+        """合并调用方的取消令牌与超时：有超时时创建子令牌，不修改调用方的令牌"""
+        if not timeout:
+            return cancel_token
+        if cancel_token is None:
+            return CancellationToken(timeout)
+        return cancel_token.child(timeout)
+    
+    @staticmethod
+    def _check_cancelled(cancel_token: Optional[CancellationToken]):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+    
+    def _export_trace(self, trace: Trace) -> Optional[str]:
+        """配置了 performance.tracing.chrome_trace_dir 时导出Chrome trace"""
+        trace_dir = self.tracing_config.chrome_trace_dir
+        if not trace_dir:
+            return None
+        
+        try:
+            filename = f"{trace.name}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{id(trace):x}.json"
+            return str(trace.export_chrome_trace(Path(trace_dir) / filename))
+        except Exception as e:
+            logger.warning(f"Chrome trace导出失败: {e}")
+            return None
     
     def _process_cad_input(self, cad_input: Union[str, np.ndarray, Image.Image], 
-                          method: str) -> torch.Tensor:
-        """处理CAD输入"""
+                          method: str, requested_size: Optional[Size] = None) -> torch.Tensor:
+        """处理CAD输入（按长宽比选择分桶，控制图缩放填充到分桶尺寸）"""
         try:
             # 使用ControlNet处理器处理CAD输入
-            processed_image = self.ai_engine.controlnet_processor.process_cad_input(
-                cad_input, method
-            )
+            processor = self.ai_engine.controlnet_processor
+            image = processor.load_image(cad_input)
+            size = self.resolution_buckets.select(image.shape[1], image.shape[0], requested_size)
+            processed_image = processor.process_cad_input(image, method, size=size)
             
             # 转换为tensor
             if isinstance(processed_image, np.ndarray):
@@ -188,6 +462,15 @@ class ImageGenerator:
             logger.error(f"CAD输入处理失败: {e}")
             raise
     
+    def _encode_thumbnail(self, image: Image.Image) -> bytes:
+        """按 output.thumbnails 配置编码缩略图"""
+        return encode_thumbnail(
+            image,
+            max_size=self.thumbnail_config.max_size,
+            image_format=self.thumbnail_config.format,
+            quality=self.thumbnail_config.quality
+        )
+    
     def _build_prompt(self, base_prompt: str, lora_name: str) -> str:
         """构建完整提示词"""
         try:
@@ -253,35 +536,132 @@ class ImageGenerator:
             logger.error(f"图像后处理失败: {e}")
             raise
     
-    def save_images(self, images: List[Image.Image], output_dir: str, 
-                   prefix: str = "generated") -> List[str]:
+    def save_images(self, images: List[Image.Image], output_dir: str,
+                   prefix: str = "generated", result: Optional[Dict] = None,
+                   run_id: Optional[str] = None, metadata: Optional[Dict] = None) -> List[str]:
         """
         保存生成的图像
         
+        启用 output.organize_by_date 时保存到 output_dir/日期/运行标识/，否则文件名以运行标识开头，
+        不会覆盖之前的结果。提供生成结果且启用 output.save_metadata 时，生成参数写入PNG文本块和
+        同名JSON旁注文件，并追加到结果索引；结果带有缩略图时一并写入 thumbs/ 子目录。
+        
         Args:
             images: 图像列表
             output_dir: 输出目录
             prefix: 文件名前缀
+            result: generate_from_cad 的返回值（提供生成参数）
+            run_id: 运行标识，同一运行的多次保存位于同一目录；默认每次调用新建
+            metadata: 附加写入旁注文件的元数据
             
         Returns:
-            List[str]: 保存的文件路径列表
+            List[str]: 保存的图像路径列表
+        """
+        saved_paths, _, commit = self._write_outputs(images, output_dir, prefix, result, run_id, metadata)
+        if commit is not None:
+            commit()
+        return saved_paths
+    
+    def save_images_async(self, images: List[Image.Image], output_dir: str,
+                          prefix: str = "generated", result: Optional[Dict] = None,
+                          run_id: Optional[str] = None, metadata: Optional[Dict] = None) -> Future:
+        """
+        提交到后台写出服务保存图像（参数同 save_images）
+        
+        编码与写盘在写出线程上进行，调用方可以立即开始下一次生成；
+        output.writer.max_pending 个任务等待写出时阻塞。
+        
+        Returns:
+            Future: 完成时为保存的图像路径列表，此时文件已同步到磁盘并记录到结果索引
+        """
+        with self._writer_lock:
+            if self.output_writer is None:
+                writer_config = self.output_config.writer
+                self.output_writer = OutputWriter(
+                    self._write_outputs,
+                    max_pending=writer_config.max_pending,
+                    workers=writer_config.workers,
+                    fsync=writer_config.fsync,
+                    fsync_batch=writer_config.fsync_batch,
+                    fsync_interval=writer_config.fsync_interval
+                )
+        return self.output_writer.submit(images, output_dir, prefix, result, run_id or new_run_id(), metadata)
+    
+    def _write_outputs(self, images: List[Image.Image], output_dir: str, prefix: str,
+                       result: Optional[Dict], run_id: Optional[str], metadata: Optional[Dict]) -> WriteResult:
+        """
+        编码并写出图像、缩略图和旁注文件
+        
+        Returns:
+            (图像路径, 写出的全部文件, 追加结果索引的提交动作)
         """
         try:
+            run_id = run_id or new_run_id()
             output_path = Path(output_dir)
+            if self.output_config.organize_by_date:
+                output_path = output_path / time.strftime('%Y-%m-%d') / run_id
+            else:
+                prefix = f"{run_id}_{prefix}"
             output_path.mkdir(parents=True, exist_ok=True)
             
+            image_format = self.output_config.image_format.lower()
+            pil_format = PIL_FORMATS[image_format]
+            extension = 'jpg' if pil_format == 'JPEG' else image_format
+            save_options = {} if pil_format == 'PNG' else {'quality': self.output_config.quality}
+            
+            image_metadata = None
+            if result is not None and self.output_config.save_metadata:
+                image_metadata = build_metadata(
+                    result, self.output_config.include_prompts, self.generation_config
+                )
+                if extension == 'png':
+                    save_options['pnginfo'] = png_info(image_metadata)
+            
+            # 生成时已编码的缩略图直接写出，不再重新编码
+            thumbnails = result.get('thumbnails') if result is not None else None
+            if thumbnails is not None and len(thumbnails) != len(images):
+                thumbnails = None
+            thumbnail_extension = self.thumbnail_config.format.lower()
+            
             saved_paths = []
+            thumbnail_paths = []
             
             for i, image in enumerate(images):
-                filename = f"{prefix}_{i+1:03d}.png"
+                filename = f"{prefix}_{i+1:03d}.{extension}"
                 filepath = output_path / filename
                 
-                image.save(filepath, "PNG", quality=95)
+                with span('save', file=filename):
+                    image.save(filepath, pil_format, **save_options)
+                    if thumbnails is not None:
+                        thumbnail_path = output_path / 'thumbs' / f"{prefix}_{i+1:03d}.{thumbnail_extension}"
+                        thumbnail_path.parent.mkdir(exist_ok=True)
+                        thumbnail_path.write_bytes(thumbnails[i])
+                        thumbnail_paths.append(str(thumbnail_path))
                 saved_paths.append(str(filepath))
                 
                 logger.info(f"图像已保存: {filepath}")
             
-            return saved_paths
+            files = saved_paths + thumbnail_paths
+            commit = None
+            if image_metadata is not None:
+                sidecar = {
+                    **image_metadata,
+                    **(metadata or {}),
+                    'run_id': run_id,
+                    'images': [Path(path).name for path in saved_paths],
+                    'timings': result.get('timings', {}),
+                    'config_hash': result.get('config_hash'),
+                }
+                sidecar_path = output_path / f"{prefix}.json"
+                sidecar_path.write_text(
+                    json.dumps(sidecar, indent=2, ensure_ascii=False, default=str), encoding='utf-8'
+                )
+                files.append(str(sidecar_path))
+                if self.output_index is not None:
+                    index = self.output_index
+                    commit = lambda: index.add(run_id, saved_paths, image_metadata, thumbnail_paths or None)
+            
+            return saved_paths, files, commit
             
         except Exception as e:
             logger.error(f"图像保存失败: {e}")
@@ -291,15 +671,20 @@ class ImageGenerator:
         """获取可用的LoRA模型列表"""
         return self.ai_engine.get_available_loras()
     
-    def get_generation_config(self) -> Dict:
+    def get_generation_config(self) -> GenerationConfig:
         """获取生成配置"""
         return self.generation_config
     
     def cleanup(self):
         """清理资源"""
         try:
+            # 先写完队列中的输出，再关闭结果索引
+            if self.output_writer is not None:
+                self.output_writer.close()
             if self.ai_engine:
                 self.ai_engine.cleanup()
+            if self.output_index is not None:
+                self.output_index.close()
             logger.info("图像生成器资源清理完成")
         except Exception as e:
             logger.error(f"图像生成器资源清理失败: {e}")
@@ -0,0 +1,286 @@
+"""
+生成任务队列
+多个会话共享同一个图像生成器：任务提交到队列后由后台工作线程依次执行，
+提交方轮询任务状态获取进度和中间预览，可在排队或执行过程中取消任务。
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+from .cancellation import CancellationToken, DeadlineExceeded, GenerationCancelled
+from .metrics import get_registry
+
+logger = logging.getLogger(__name__)
+
+# SD 1.x 潜空间到RGB的线性近似，用于不经过VAE解码的低成本预览
+LATENT_RGB_FACTORS = torch.tensor([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+])
+
+
+def latents_to_previews(latents: torch.Tensor, scale: int = 8) -> List[Image.Image]:
+    """
+    将潜变量线性映射为RGB预览图
+
+    Args:
+        latents: [B, 4, h, w] 潜变量
+        scale: 放大倍数（对应VAE下采样倍数）
+
+    Returns:
+        List[Image.Image]: 每个样本一张预览图
+    """
+    latents = latents.detach().float().cpu()
+    rgb = torch.einsum('bchw,cr->bhwr', latents, LATENT_RGB_FACTORS)
+    rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).round().to(torch.uint8).numpy()
+    previews = []
+    for array in rgb:
+        image = Image.fromarray(np.ascontiguousarray(array))
+        if scale > 1:
+            image = image.resize((image.width * scale, image.height * scale), Image.BILINEAR)
+        previews.append(image)
+    return previews
+
+
+class JobStatus:
+    """任务状态"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    TIMEOUT = 'timeout'
+
+    FINISHED = (COMPLETED, FAILED, CANCELLED, TIMEOUT)
+
+
+class GenerationJob:
+    """一个生成任务"""
+
+    def __init__(self, job_id: str, params: Dict[str, Any], timeout: Optional[float] = None):
+        self.id = job_id
+        self.params = params
+        # 截止时间从提交时开始计算，包含排队时间
+        self.token = CancellationToken(timeout)
+        self.status = JobStatus.QUEUED
+        self.step = 0
+        self.total_steps = 0
+        self.previews: List[Image.Image] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.saved_paths: List[str] = []
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.last_seen = time.monotonic()
+
+    @property
+    def progress(self) -> float:
+        """进度（0~1）"""
+        if self.status == JobStatus.COMPLETED:
+            return 1.0
+        return self.step / self.total_steps if self.total_steps else 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in JobStatus.FINISHED
+
+    def cancel(self, reason: str = "任务已取消"):
+        """请求取消（排队中的任务不再执行，执行中的任务在下一个去噪步结束时停止）"""
+        self.token.cancel(reason)
+
+    def heartbeat(self):
+        """提交方仍在关注该任务"""
+        self.last_seen = time.monotonic()
+
+
+class JobQueue:
+    """单工作线程的生成任务队列"""
+
+    def __init__(self, generator: Any, max_pending: int = 16, preview_interval: int = 2,
+                 max_finished: int = 64, abandon_after: Optional[float] = None,
+                 output_dir: Optional[str] = None):
+        """
+        初始化任务队列
+
+        Args:
+            generator: ImageGenerator实例
+            max_pending: 最多排队的任务数
+            preview_interval: 每隔多少个去噪步更新一次预览（0表示不生成预览）
+            max_finished: 保留的已结束任务数
+            abandon_after: 提交方超过该时间（秒）未调用 heartbeat 时视为已离开并取消任务，None表示不检查
+            output_dir: 完成的结果保存到该目录（记录到结果索引），None表示不保存
+        """
+        self.generator = generator
+        self.output_dir = output_dir
+        self.preview_interval = preview_interval
+        self.max_finished = max_finished
+        self.abandon_after = abandon_after
+        self._queue: "queue.Queue[Optional[GenerationJob]]" = queue.Queue(maxsize=max_pending)
+        self._jobs: "OrderedDict[str, GenerationJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._worker = threading.Thread(target=self._run, name="generation-worker", daemon=True)
+        self._worker.start()
+
+    def submit(self, timeout: Optional[float] = None, **params) -> GenerationJob:
+        """
+        提交生成任务
+
+        Args:
+            timeout: 从提交起的最长时间（秒，含排队），None表示只受 generation.timeout 限制
+            **params: ImageGenerator.generate_from_cad 的参数
+
+        Returns:
+            GenerationJob: 任务对象
+        """
+        job = GenerationJob(f"job-{next(self._ids)}", params, timeout)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise RuntimeError("生成队列已满，请稍后再试")
+
+        get_registry().queue_depth.inc()
+        logger.info(f"任务 {job.id} 已提交，排队位置 {self.position(job.id)}")
+        return job
+
+    def get(self, job_id: str) -> Optional[GenerationJob]:
+        """按ID获取任务"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def heartbeat(self, job_id: str):
+        """提交方轮询任务时调用，表明仍在等待结果"""
+        job = self.get(job_id)
+        if job is not None:
+            job.heartbeat()
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消任务
+
+        Returns:
+            bool: 任务存在且尚未结束
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel()
+        logger.info(f"任务 {job_id} 已请求取消")
+        return True
+
+    def position(self, job_id: str) -> int:
+        """排队位置（1表示下一个执行，0表示已开始或不存在）"""
+        with self._lock:
+            queued = [job.id for job in self._jobs.values() if job.status == JobStatus.QUEUED]
+        return queued.index(job_id) + 1 if job_id in queued else 0
+
+    def stop(self):
+        """停止工作线程（已排队的任务不再执行）"""
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            get_registry().queue_depth.dec()
+            self._execute(job)
+            self._prune()
+
+    def _execute(self, job: GenerationJob):
+        self._check_abandoned(job)
+        if job.token.cancelled:
+            # 排队期间已取消或超时，不再占用工作线程
+            self._finish(job, JobStatus.TIMEOUT if job.token.expired else JobStatus.CANCELLED)
+            return
+
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        try:
+            result = self.generator.generate_from_cad(
+                **job.params,
+                cancel_token=job.token,
+                step_callback=lambda step, total, latents: self._on_step(job, step, total, latents)
+            )
+            job.result = result
+            self._save(job)
+            self._finish(job, JobStatus.COMPLETED)
+        except DeadlineExceeded as e:
+            job.error = str(e)
+            self._finish(job, JobStatus.TIMEOUT)
+        except GenerationCancelled as e:
+            job.error = str(e)
+            self._finish(job, JobStatus.CANCELLED)
+        except Exception as e:
+            job.error = str(e)
+            logger.error(f"任务 {job.id} 执行失败: {e}")
+            self._finish(job, JobStatus.FAILED)
+
+    def _save(self, job: GenerationJob):
+        """提交结果到后台写出服务，写盘与下一个任务的生成重叠（保存失败不影响任务状态）"""
+        if self.output_dir is None:
+            return
+        try:
+            future = self.generator.save_images_async(
+                job.result['images'], self.output_dir, prefix=f"ui_{job.result['lora_used']}", result=job.result
+            )
+            future.add_done_callback(lambda done: self._on_saved(job, done))
+        except Exception as e:
+            logger.warning(f"任务 {job.id} 结果保存失败: {e}")
+
+    def _on_saved(self, job: GenerationJob, future: Future):
+        # 原地追加：界面在任务完成时已持有该列表
+        try:
+            job.saved_paths.extend(future.result())
+        except Exception as e:
+            logger.warning(f"任务 {job.id} 结果保存失败: {e}")
+
+    def _on_step(self, job: GenerationJob, step: int, total: int, latents: torch.Tensor):
+        """去噪步回调：更新进度与预览，检查提交方是否已离开（取消令牌由生成器检查）"""
+        job.step = step
+        job.total_steps = total
+        self._check_abandoned(job)
+        if job.token.cancelled:
+            return
+        if self.preview_interval and (step % self.preview_interval == 0 or step == total):
+            try:
+                job.previews = latents_to_previews(latents)
+            except Exception as e:
+                logger.warning(f"预览生成失败: {e}")
+
+    def _check_abandoned(self, job: GenerationJob):
+        if self.abandon_after and time.monotonic() - job.last_seen > self.abandon_after:
+            job.cancel("提交方已离开")
+
+    def _finish(self, job: GenerationJob, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        if status != JobStatus.COMPLETED:
+            job.previews = []
+        logger.info(f"任务 {job.id} 结束: {status}")
+
+    def _prune(self):
+        """只保留最近 max_finished 个已结束任务"""
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+            for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self._jobs[job_id]
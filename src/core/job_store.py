@@ -0,0 +1,178 @@
+"""
+批量任务存储
+将清单中每个条目的执行状态记录在本地SQLite数据库中，批量运行中断后重新启动时
+跳过已完成的条目，只执行未完成或失败次数未超过上限的条目。
+
+条目以参数内容的哈希为键：清单中修改过的行视为新条目，未修改的行保持原有状态。
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    manifest TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    outputs TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_manifest_status ON entries (manifest, status);
+"""
+
+
+class EntryStatus:
+    """条目状态"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    # 图像已生成、正在写出
+    WRITING = 'writing'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+
+def entry_key(manifest: str, params: Dict[str, Any]) -> str:
+    """清单条目的内容哈希（不含行号，清单中插入或删除其他行不影响已有条目）"""
+    params = {name: value for name, value in params.items() if name != 'line'}
+    payload = manifest + '\n' + json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class JobStore:
+    """基于SQLite的批量任务状态存储（线程安全）"""
+
+    def __init__(self, path: str):
+        """
+        打开（或创建）任务存储
+
+        Args:
+            path: SQLite数据库文件路径
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        # WAL模式下写入不阻塞读取，进程崩溃时已提交的状态不会丢失
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def add_entries(self, manifest: str, entries: List[Dict[str, Any]]) -> int:
+        """
+        登记清单条目（已登记的条目保持原状态）
+
+        Args:
+            manifest: 清单标识
+            entries: 条目参数列表，需包含 line（清单中的行号）
+
+        Returns:
+            int: 新登记的条目数
+        """
+        now = time.time()
+        rows = [
+            (entry_key(manifest, entry), manifest, entry['line'], json.dumps(entry, ensure_ascii=False, default=str), now)
+            for entry in entries
+        ]
+        with self._lock:
+            before = self._count(manifest)
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO entries (key, manifest, line, params, updated_at) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+            self._conn.execute('COMMIT')
+            return self._count(manifest) - before
+
+    def _count(self, manifest: str) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM entries WHERE manifest = ?', (manifest,)).fetchone()[0]
+
+    def recover(self, manifest: str) -> int:
+        """
+        将上次运行中断时处于执行或写出状态的条目重置为待执行
+
+        Returns:
+            int: 重置的条目数
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE entries SET status = ?, updated_at = ? WHERE manifest = ? AND status IN (?, ?)',
+                (EntryStatus.PENDING, time.time(), manifest, EntryStatus.RUNNING, EntryStatus.WRITING)
+            )
+            return cursor.rowcount
+
+    def pending(self, manifest: str, max_attempts: int = 1) -> List[Dict[str, Any]]:
+        """
+        待执行的条目（按清单行号排序）
+
+        Args:
+            manifest: 清单标识
+            max_attempts: 失败条目的最多尝试次数，未达到时重新执行
+
+        Returns:
+            List[Dict]: 条目参数（含 key）
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key, params FROM entries WHERE manifest = ? '
+                'AND (status = ? OR (status = ? AND attempts < ?)) ORDER BY line',
+                (manifest, EntryStatus.PENDING, EntryStatus.FAILED, max_attempts)
+            ).fetchall()
+        return [{**json.loads(params), 'key': key} for key, params in rows]
+
+    def _update(self, key: str, sql: str, values: tuple):
+        with self._lock:
+            self._conn.execute(f'UPDATE entries SET {sql}, updated_at = ? WHERE key = ?', values + (time.time(), key))
+
+    def mark_running(self, key: str):
+        """条目开始执行"""
+        self._update(key, 'status = ?, attempts = attempts + 1', (EntryStatus.RUNNING,))
+
+    def mark_writing(self, key: str):
+        """条目图像已生成，等待写出"""
+        self._update(key, 'status = ?', (EntryStatus.WRITING,))
+
+    def mark_completed(self, key: str, outputs: List[str]):
+        """条目完成（输出文件已全部写出）"""
+        self._update(key, 'status = ?, outputs = ?, error = NULL',
+                     (EntryStatus.COMPLETED, json.dumps(outputs, ensure_ascii=False)))
+
+    def mark_failed(self, key: str, error: str):
+        """条目失败"""
+        self._update(key, 'status = ?, error = ?', (EntryStatus.FAILED, error))
+
+    def summary(self, manifest: Optional[str] = None) -> Dict[str, int]:
+        """各状态的条目数"""
+        with self._lock:
+            if manifest is None:
+                rows = self._conn.execute('SELECT status, COUNT(*) FROM entries GROUP BY status').fetchall()
+            else:
+                rows = self._conn.execute(
+                    'SELECT status, COUNT(*) FROM entries WHERE manifest = ? GROUP BY status', (manifest,)
+                ).fetchall()
+        return dict(rows)
+
+    def failures(self, manifest: str) -> List[Dict[str, Any]]:
+        """失败条目的行号与错误信息"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT line, attempts, error FROM entries WHERE manifest = ? AND status = ? ORDER BY line',
+                (manifest, EntryStatus.FAILED)
+            ).fetchall()
+        return [{'line': line, 'attempts': attempts, 'error': error} for line, attempts, error in rows]
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
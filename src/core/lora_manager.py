@@ -5,17 +5,33 @@ LoRA模型管理器
 
 import torch
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Mapping, Optional, Any, Tuple
 from pathlib import Path
 import json
 
+from .metrics import get_registry
+from ..utils.tracing import span
+
 logger = logging.getLogger(__name__)
 
+# kohya格式键前缀 -> 管道组件
+_KOHYA_PREFIXES = {
+    'lora_unet_': 'unet',
+    'lora_te_': 'text_encoder',
+    'lora_te1_': 'text_encoder',
+}
+
+# 各种LoRA格式中低秩矩阵的键后缀
+_DOWN_SUFFIXES = ('.lora_down.weight', '.lora.down.weight', '.lora_A.weight',
+                  '.lora_linear_layer.down.weight')
+_UP_SUFFIXES = ('.lora_up.weight', '.lora.up.weight', '.lora_B.weight',
+                '.lora_linear_layer.up.weight')
+
 
 class LoRAManager:
     """LoRA模型管理器"""
     
-    def __init__(self, lora_config: Dict):
+    def __init__(self, lora_config: Mapping):
         """
         初始化LoRA管理器
         
@@ -26,12 +42,16 @@ class LoRAManager:
         self.loaded_loras = {}
         self.available_loras = self._scan_available_loras()
         
+        # LoRA文件内容缓存与融合增量缓存，切换LoRA时避免重复读取和计算
+        self.state_dict_cache: Dict[str, Dict[str, torch.Tensor]] = {}
+        self.delta_cache: Dict[str, Dict[Tuple[str, str], torch.Tensor]] = {}
+        
     def _scan_available_loras(self) -> Dict[str, Dict]:
         """扫描可用的LoRA模型"""
         available = {}
         
         for lora_name, lora_info in self.config.items():
-            if isinstance(lora_info, dict) and lora_info.get('enabled', True):
+            if isinstance(lora_info, Mapping) and lora_info.get('enabled', True):
                 lora_path = Path(lora_info['path'])
                 if lora_path.exists():
                     available[lora_name] = {
@@ -61,20 +81,21 @@ class LoRAManager:
                 logger.error(f"LoRA模型 {lora_name} 不可用")
                 return False
             
+            # 权重已融合进管道，重复应用会叠加权重
+            if lora_name in self.loaded_loras:
+                logger.info(f"LoRA模型 {lora_name} 已加载")
+                return True
+            
             lora_info = self.available_loras[lora_name]
-            lora_path = lora_info['path']
             weight = lora_info['weight']
             
             logger.info(f"加载LoRA模型: {lora_name} (权重: {weight})")
             
-            # 加载LoRA权重
-            if lora_path.endswith('.safetensors'):
-                lora_state_dict = self._load_safetensors(lora_path)
-            else:
-                lora_state_dict = torch.load(lora_path, map_location='cpu')
-            
-            # 应用LoRA权重到管道
-            self._apply_lora_to_pipeline(pipeline, lora_state_dict, weight)
+            # 计算并融合LoRA权重增量
+            with span('lora_deltas', lora=lora_name):
+                deltas = self._get_lora_deltas(lora_name, pipeline)
+            with span('lora_fuse', lora=lora_name, modules=len(deltas)):
+                self._apply_lora_to_pipeline(pipeline, deltas, sign=1.0)
             
             # 记录已加载的LoRA
             self.loaded_loras[lora_name] = {
@@ -82,7 +103,7 @@ class LoRAManager:
                 'trigger_word': lora_info['trigger_word']
             }
             
-            logger.info(f"LoRA模型 {lora_name} 加载成功")
+            logger.info(f"LoRA模型 {lora_name} 加载成功，融合 {len(deltas)} 个模块")
             return True
             
         except Exception as e:
@@ -100,57 +121,163 @@ class LoRAManager:
         
         return state_dict
     
-    def _apply_lora_to_pipeline(self, pipeline: Any, lora_state_dict: Dict, weight: float):
-        """将LoRA权重应用到管道"""
-        try:
-            # 获取unet和text_encoder
-            unet = pipeline.unet
-            text_encoder = pipeline.text_encoder
+    def _load_lora_state_dict(self, lora_name: str) -> Dict[str, torch.Tensor]:
+        """读取LoRA文件，结果缓存在state_dict_cache中"""
+        if lora_name in self.state_dict_cache:
+            return self.state_dict_cache[lora_name]
+        
+        lora_path = self.available_loras[lora_name]['path']
+        with span('lora_read', lora=lora_name):
+            if lora_path.endswith('.safetensors'):
+                lora_state_dict = self._load_safetensors(lora_path)
+            else:
+                lora_state_dict = torch.load(lora_path, map_location='cpu')
+        
+        self.state_dict_cache[lora_name] = lora_state_dict
+        return lora_state_dict
+    
+    def _get_lora_deltas(self, lora_name: str, pipeline: Any) -> Dict[Tuple[str, str], torch.Tensor]:
+        """获取LoRA的权重增量（已乘以配置权重），结果缓存在delta_cache中"""
+        get_registry().record_cache('lora', lora_name in self.delta_cache)
+        if lora_name in self.delta_cache:
+            return self.delta_cache[lora_name]
+        
+        lora_state_dict = self._load_lora_state_dict(lora_name)
+        weight = self.available_loras[lora_name]['weight']
+        deltas = self._compute_lora_deltas(pipeline, lora_state_dict, weight)
+        if not deltas:
+            logger.warning(f"LoRA模型 {lora_name} 中没有与管道匹配的权重")
+        
+        self.delta_cache[lora_name] = deltas
+        return deltas
+    
+    @staticmethod
+    def _split_lora_key(key: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """
+        解析LoRA权重键
+        
+        Returns:
+            (组件名, 扁平化模块键, 角色 down/up/alpha)，无法识别时返回 (None, None, None)
+        """
+        for suffixes, role in ((_DOWN_SUFFIXES, 'down'), (_UP_SUFFIXES, 'up'), (('.alpha',), 'alpha')):
+            suffix = next((s for s in suffixes if key.endswith(s)), None)
+            if suffix is not None:
+                base = key[:-len(suffix)]
+                break
+        else:
+            return None, None, None
+        
+        # kohya格式: lora_unet_down_blocks_0_attentions_0_..._to_q
+        for prefix, component in _KOHYA_PREFIXES.items():
+            if base.startswith(prefix):
+                return component, base[len(prefix):], role
+        
+        # diffusers/peft格式: unet.down_blocks.0.attentions.0....to_q
+        for component in ('unet', 'text_encoder'):
+            if base.startswith(component + '.'):
+                return component, base[len(component) + 1:].replace('.', '_'), role
+        
+        return None, None, None
+    
+    def _compute_lora_deltas(self, pipeline: Any, lora_state_dict: Dict,
+                             weight: float) -> Dict[Tuple[str, str], torch.Tensor]:
+        """
+        计算LoRA对各模块权重的增量 up @ down * (alpha / rank) * weight
+        
+        Args:
+            pipeline: Stable Diffusion管道
+            lora_state_dict: LoRA权重
+            weight: LoRA权重系数
+            
+        Returns:
+            Dict: (组件名, 模块名) -> 与模块权重同形状的增量
+        """
+        grouped = {}
+        for key, tensor in lora_state_dict.items():
+            component, flat_name, role = self._split_lora_key(key)
+            if component is not None:
+                grouped.setdefault((component, flat_name), {})[role] = tensor
+        
+        # 扁平化模块名 -> 模块名（kohya格式以下划线代替点号）
+        module_lookup = {}
+        for component in ('unet', 'text_encoder'):
+            model = getattr(pipeline, component, None)
+            if model is None:
+                continue
+            for name, module in model.named_modules():
+                if isinstance(module, (torch.nn.Linear, torch.nn.Conv2d)):
+                    module_lookup[(component, name.replace('.', '_'))] = (name, module)
+        
+        deltas = {}
+        for group_key, lora in grouped.items():
+            if 'down' not in lora or 'up' not in lora or group_key not in module_lookup:
+                continue
             
-            # 应用LoRA权重到UNet
-            self._apply_lora_to_unet(unet, lora_state_dict, weight)
+            module_name, module = module_lookup[group_key]
+            down = lora['down'].float()
+            up = lora['up'].float()
+            rank = down.shape[0]
+            scale = float(lora['alpha']) / rank if 'alpha' in lora else 1.0
             
-            # 应用LoRA权重到Text Encoder（如果存在）
-            self._apply_lora_to_text_encoder(text_encoder, lora_state_dict, weight)
+            if down.dim() == 4 and down.shape[2:] != (1, 1):
+                # 卷积LoRA (LoCon): up [out, r, 1, 1], down [r, in, k, k]
+                delta = torch.einsum('or,rikl->oikl', up.flatten(1), down)
+            else:
+                delta = up.flatten(1) @ down.flatten(1)
             
+            delta = (delta * scale * weight).reshape(module.weight.shape)
+            deltas[(group_key[0], module_name)] = delta.to(module.weight.dtype)
+        
+        return deltas
+    
+    def _apply_lora_to_pipeline(self, pipeline: Any, deltas: Dict[Tuple[str, str], torch.Tensor],
+                                sign: float = 1.0):
+        """
+        将LoRA权重增量融合到管道（sign=-1时从权重中移除）
+        
+        Args:
+            pipeline: Stable Diffusion管道
+            deltas: (组件名, 模块名) -> 权重增量
+            sign: 1.0融合，-1.0移除
+        """
+        try:
+            for (component, module_name), delta in deltas.items():
+                module = getattr(pipeline, component).get_submodule(module_name)
+                module.weight.data.add_(delta.to(module.weight.device, module.weight.dtype), alpha=sign)
+                
         except Exception as e:
             logger.error(f"应用LoRA权重失败: {e}")
             raise
     
-    def _apply_lora_to_unet(self, unet: Any, lora_state_dict: Dict, weight: float):
-        """将LoRA权重应用到UNet"""
-        for name, module in unet.named_modules():
-            if 'lora' in name.lower():
-                # 查找对应的LoRA权重
-                lora_key = name.replace('.', '_')
-                if lora_key in lora_state_dict:
-                    # 应用LoRA权重
-                    lora_weight = lora_state_dict[lora_key] * weight
-                    if hasattr(module, 'weight'):
-                        module.weight.data += lora_weight
-    
-    def _apply_lora_to_text_encoder(self, text_encoder: Any, lora_state_dict: Dict, weight: float):
-        """将LoRA权重应用到Text Encoder"""
-        for name, module in text_encoder.named_modules():
-            if 'lora' in name.lower():
-                lora_key = name.replace('.', '_')
-                if lora_key in lora_state_dict:
-                    lora_weight = lora_state_dict[lora_key] * weight
-                    if hasattr(module, 'weight'):
-                        module.weight.data += lora_weight
-    
-    def unload_lora(self, lora_name: str) -> bool:
+    def register_fused_lora(self, lora_name: str):
+        """
+        登记已融合在模型权重中的LoRA（例如从快照加载的模型）
+        
+        Args:
+            lora_name: LoRA模型名称
+        """
+        lora_info = self.available_loras.get(lora_name) or self.config.get(lora_name, {})
+        self.loaded_loras[lora_name] = {
+            'weight': lora_info.get('weight', 0.8),
+            'trigger_word': lora_info.get('trigger_word', '')
+        }
+    
+    def unload_lora(self, lora_name: str, pipeline: Any = None) -> bool:
         """
         卸载LoRA模型
         
         Args:
             lora_name: LoRA模型名称
+            pipeline: Stable Diffusion管道，提供时从权重中移除LoRA增量
             
         Returns:
             bool: 卸载是否成功
         """
         try:
             if lora_name in self.loaded_loras:
+                if pipeline is not None:
+                    deltas = self._get_lora_deltas(lora_name, pipeline)
+                    self._apply_lora_to_pipeline(pipeline, deltas, sign=-1.0)
                 del self.loaded_loras[lora_name]
                 logger.info(f"LoRA模型 {lora_name} 已卸载")
                 return True
@@ -161,6 +288,19 @@ class LoRAManager:
             logger.error(f"卸载LoRA模型 {lora_name} 失败: {e}")
             return False
     
+    def cache_nbytes(self) -> int:
+        """LoRA权重缓存与增量缓存占用的内存（字节）"""
+        total = 0
+        for cache in (self.state_dict_cache, self.delta_cache):
+            for tensors in cache.values():
+                total += sum(t.numel() * t.element_size() for t in tensors.values())
+        return total
+    
+    def clear_caches(self):
+        """清空LoRA缓存（已融合的权重不受影响，卸载时会重新计算增量）"""
+        self.state_dict_cache.clear()
+        self.delta_cache.clear()
+    
     def get_available_loras(self) -> List[str]:
         """获取可用的LoRA模型列表"""
         return list(self.available_loras.keys())
@@ -0,0 +1,395 @@
+"""
+内存管理器
+按 performance.memory 配置约束进程内模型与缓存的内存占用：
+- 统计已注册组件（管道、ControlNet模型、检测器、LoRA缓存、结果缓存等）的常驻大小
+- 空闲超时的子模块（文本编码器、VAE、未使用的ControlNet）卸载到CPU或磁盘
+- 超出预算时按最近最少使用顺序驱逐可驱逐组件
+- 提供当前内存使用情况查询接口
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+from ..utils.memory_utils import format_memory_size, parse_memory_size, process_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def module_nbytes(module: torch.nn.Module) -> int:
+    """统计模块参数与缓冲区实际占用的字节数（不含meta/已卸载的张量）"""
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        if tensor.device.type != 'meta':
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModuleOffloader:
+    """
+    子模块卸载器
+
+    加速设备上的模块卸载到CPU内存；CPU上的模块将参数写入磁盘safetensors文件后释放，
+    再次前向计算前通过forward pre-hook自动从磁盘恢复。
+    """
+
+    def __init__(self, name: str, module: torch.nn.Module, device: torch.device,
+                 offload_dir: str = "data/cache/offload",
+                 on_restore: Optional[Callable[[], None]] = None):
+        """
+        初始化子模块卸载器
+
+        Args:
+            name: 组件名称（用作磁盘文件名）
+            module: 需要管理的模块
+            device: 模块的工作设备
+            offload_dir: 磁盘卸载目录
+            on_restore: 模块被恢复时的回调（用于标记组件被使用）
+        """
+        self.name = name
+        self.module = module
+        self.device = device
+        self.offload_path = Path(offload_dir) / f"{name.replace(':', '_')}.safetensors"
+        self.on_restore = on_restore
+        self.offloaded = False
+        # 磁盘文件与当前权重一致时无需重复写入；权重被修改（如融合LoRA）后需调用mark_dirty
+        self.persisted = False
+        self._channels_last_params = set()
+        self._hooks = []
+
+        # pipeline可能直接调用子模块（如vae.decode内部调用decoder），因此在模块及其直接子模块上都注册钩子
+        for target in [module] + list(module.children()):
+            self._hooks.append(target.register_forward_pre_hook(self._pre_forward))
+
+    def _pre_forward(self, *args):
+        if self.offloaded:
+            self.restore()
+        if self.on_restore is not None:
+            self.on_restore()
+
+    def offload(self):
+        """卸载模块权重"""
+        if self.offloaded:
+            return
+
+        if self.device.type != 'cpu':
+            self.module.to('cpu')
+        else:
+            if not self.persisted:
+                from safetensors.torch import save_file
+
+                self.offload_path.parent.mkdir(parents=True, exist_ok=True)
+                params = {name: p.detach().contiguous() for name, p in self.module.named_parameters()}
+                save_file(params, str(self.offload_path))
+                self.persisted = True
+
+            self._channels_last_params = {
+                name for name, p in self.module.named_parameters()
+                if p.dim() == 4 and p.is_contiguous(memory_format=torch.channels_last)
+            }
+            for param in self.module.parameters():
+                param.data = torch.empty(0, dtype=param.dtype)
+
+        self.offloaded = True
+        logger.info(f"组件 {self.name} 已卸载到{'CPU' if self.device.type != 'cpu' else '磁盘'}")
+
+    def restore(self):
+        """恢复模块权重到工作设备"""
+        if not self.offloaded:
+            return
+
+        if self.device.type != 'cpu':
+            self.module.to(self.device)
+        else:
+            from safetensors.torch import load_file
+
+            params = load_file(str(self.offload_path), device='cpu')
+            for name, param in self.module.named_parameters():
+                tensor = params[name]
+                if name in self._channels_last_params:
+                    tensor = tensor.contiguous(memory_format=torch.channels_last)
+                param.data = tensor
+
+        self.offloaded = False
+        logger.info(f"组件 {self.name} 已恢复")
+
+    def mark_dirty(self):
+        """标记权重已被修改，下次卸载时重新写入磁盘"""
+        self.persisted = False
+
+    def resident_nbytes(self) -> int:
+        """模块在工作设备上的常驻大小"""
+        return 0 if self.offloaded else module_nbytes(self.module)
+
+    def remove(self, restore: bool = True):
+        """
+        移除钩子
+
+        Args:
+            restore: 是否恢复权重；模块即将被丢弃时无需恢复
+        """
+        if restore:
+            self.restore()
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks.clear()
+
+
+class ManagedComponent:
+    """内存管理器中登记的组件"""
+
+    def __init__(self, name: str, kind: str, size_fn: Callable[[], int],
+                 evict_fn: Optional[Callable[[], None]] = None,
+                 offloader: Optional[ModuleOffloader] = None):
+        self.name = name
+        self.kind = kind
+        self.size_fn = size_fn
+        self.evict_fn = evict_fn
+        self.offloader = offloader
+        self.last_used = time.monotonic()
+
+    @property
+    def evictable(self) -> bool:
+        return self.evict_fn is not None
+
+    @property
+    def offloaded(self) -> bool:
+        return self.offloader is not None and self.offloader.offloaded
+
+
+class MemoryGovernor:
+    """内存管理器"""
+
+    def __init__(self, memory_config: Dict, device: torch.device):
+        """
+        初始化内存管理器
+
+        Args:
+            memory_config: 内存配置（对应配置文件 performance.memory）
+            device: 计算设备
+        """
+        self.device = device
+        self.update_limits(memory_config)
+        self.offload_dir = memory_config.get('offload_dir', 'data/cache/offload')
+
+        # 按最近使用顺序排列，最早使用的在前
+        self.components: "OrderedDict[str, ManagedComponent]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._active = 0
+        self._last_cleanup = time.monotonic()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def update_limits(self, memory_config: Dict):
+        """
+        更新内存预算与整理间隔（重新加载配置时调用，下一次整理起生效）
+
+        Args:
+            memory_config: 内存配置（对应配置文件 performance.memory）
+        """
+        self.config = memory_config
+        self.budget = parse_memory_size(memory_config.get('max_memory_usage', '8GB'))
+        self.cleanup_interval = memory_config.get('cleanup_interval', 300)
+        self.idle_offload_after = memory_config.get('idle_offload_after', self.cleanup_interval)
+
+    def register(self, name: str, size_fn: Callable[[], int], kind: str = "cache",
+                 evict_fn: Optional[Callable[[], None]] = None) -> ManagedComponent:
+        """
+        登记组件
+
+        Args:
+            name: 组件名称
+            size_fn: 返回当前常驻字节数的函数
+            kind: 组件类型（pipeline, controlnet, detector, lora_cache, result_cache 等）
+            evict_fn: 驱逐函数；为None表示不可驱逐（仍计入用量）
+
+        Returns:
+            ManagedComponent: 登记的组件
+        """
+        with self._lock:
+            self.unregister(name)
+            component = ManagedComponent(name, kind, size_fn, evict_fn)
+            self.components[name] = component
+            self.components.move_to_end(name)
+            return component
+
+    def register_module(self, name: str, module: torch.nn.Module, kind: str = "submodule",
+                        evict_fn: Optional[Callable[[], None]] = None,
+                        offloadable: bool = True) -> ManagedComponent:
+        """
+        登记torch模块，可选在空闲时卸载
+
+        Args:
+            name: 组件名称
+            module: torch模块
+            kind: 组件类型
+            evict_fn: 驱逐函数
+            offloadable: 是否允许空闲卸载
+
+        Returns:
+            ManagedComponent: 登记的组件
+        """
+        with self._lock:
+            self.unregister(name)
+            offloader = None
+            if offloadable:
+                offloader = ModuleOffloader(name, module, self.device, self.offload_dir,
+                                            on_restore=lambda: self.touch(name))
+                size_fn = offloader.resident_nbytes
+            else:
+                size_fn = lambda: module_nbytes(module)
+            component = ManagedComponent(name, kind, size_fn, evict_fn, offloader)
+            self.components[name] = component
+            return component
+
+    def unregister(self, name: str, restore: bool = True):
+        """
+        取消登记组件（不会驱逐）
+
+        Args:
+            name: 组件名称
+            restore: 已卸载的模块是否恢复权重；组件被丢弃时传False
+        """
+        with self._lock:
+            component = self.components.pop(name, None)
+            if component is not None and component.offloader is not None:
+                component.offloader.remove(restore)
+
+    def offloaders(self) -> List[ModuleOffloader]:
+        """所有已登记模块的卸载器"""
+        with self._lock:
+            return [c.offloader for c in self.components.values() if c.offloader is not None]
+
+    def touch(self, name: str):
+        """标记组件被使用"""
+        with self._lock:
+            component = self.components.get(name)
+            if component is not None:
+                component.last_used = time.monotonic()
+                self.components.move_to_end(name)
+
+    @contextmanager
+    def active(self):
+        """推理期间的上下文：期间不会卸载或驱逐模块"""
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def total_usage(self) -> int:
+        """已登记组件的常驻字节数总和"""
+        with self._lock:
+            return sum(self._safe_size(c) for c in self.components.values())
+
+    @staticmethod
+    def _safe_size(component: ManagedComponent) -> int:
+        try:
+            return int(component.size_fn())
+        except Exception as e:
+            logger.warning(f"组件 {component.name} 大小统计失败: {e}")
+            return 0
+
+    def usage(self) -> Dict[str, Any]:
+        """
+        获取当前内存使用情况
+
+        Returns:
+            Dict: 预算、总用量、进程RSS以及各组件的大小和状态
+        """
+        with self._lock:
+            now = time.monotonic()
+            components = {}
+            for name, component in self.components.items():
+                components[name] = {
+                    'kind': component.kind,
+                    'bytes': self._safe_size(component),
+                    'idle_seconds': round(now - component.last_used, 1),
+                    'offloaded': component.offloaded,
+                    'evictable': component.evictable,
+                }
+            total = sum(info['bytes'] for info in components.values())
+
+        return {
+            'budget_bytes': self.budget,
+            'used_bytes': total,
+            'process_rss_bytes': process_rss_bytes(),
+            'components': components,
+        }
+
+    def enforce(self) -> List[str]:
+        """
+        执行一次内存整理：卸载空闲子模块，超出预算时按LRU驱逐
+
+        Returns:
+            List[str]: 执行的动作描述
+        """
+        actions = []
+        with self._lock:
+            self._last_cleanup = time.monotonic()
+            if self._active:
+                # 推理进行中，推迟整理
+                return actions
+
+            now = time.monotonic()
+            for component in list(self.components.values()):
+                if (component.offloader is not None and not component.offloaded
+                        and now - component.last_used >= self.idle_offload_after):
+                    component.offloader.offload()
+                    actions.append(f"offload:{component.name}")
+
+            total = self.total_usage()
+            for component in list(self.components.values()):
+                if total <= self.budget:
+                    break
+                if not component.evictable:
+                    continue
+                size = self._safe_size(component)
+                if size == 0:
+                    continue
+                component.evict_fn()
+                total -= size
+                actions.append(f"evict:{component.name}")
+                logger.info(f"内存超出预算，已驱逐 {component.name} ({format_memory_size(size)})")
+
+            if total > self.budget:
+                logger.warning(f"内存用量 {format_memory_size(total)} 仍超出预算 "
+                               f"{format_memory_size(self.budget)}，没有更多可驱逐的组件")
+
+        return actions
+
+    def maybe_enforce(self) -> List[str]:
+        """距上次整理超过cleanup_interval时执行整理"""
+        if time.monotonic() - self._last_cleanup >= self.cleanup_interval:
+            return self.enforce()
+        return []
+
+    def start(self):
+        """启动后台整理线程，使空闲的长驻服务也能按时释放内存"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="memory-governor", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.cleanup_interval):
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"内存整理失败: {e}")
+
+    def stop(self):
+        """停止后台整理线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
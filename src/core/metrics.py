@@ -0,0 +1,407 @@
+"""
+运行指标模块
+进程内的指标注册表，由各组件在处理请求时更新：队列深度、请求速率、各阶段耗时直方图、
+缓存命中率、内存用量、各LoRA生成的图像数等。
+
+指标以Prometheus文本格式导出（API模式的 /metrics），也可以字典形式读取
+（Streamlit侧边栏面板），不依赖任何外部服务或客户端库。
+"""
+
+import bisect
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 阶段耗时直方图的默认桶边界（秒），覆盖毫秒级预处理到分钟级CPU推理
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    """指标基类，按标签值分别记录"""
+
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        """(样本名, 标签值, 数值) 列表"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        """Prometheus文本格式的行"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for sample_name, labelvalues, value in self.samples():
+            names = self.labelnames
+            if sample_name.endswith('_bucket'):
+                names = names + ('le',)
+            lines.append(f"{sample_name}{_format_labels(names, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        """增加计数"""
+        if amount < 0:
+            raise ValueError("计数器只能增加")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        """读取计数"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def values(self) -> Dict[LabelValues, float]:
+        """所有标签组合的计数"""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        suffix = '' if self.name.endswith('_total') else '_total'
+        return [(self.name + suffix, key, value) for key, value in sorted(self.values().items())]
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值；可设置回调在读取时计算"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def clear(self):
+        """清除所有标签组合（用于每次采集时重建的分组指标）"""
+        with self._lock:
+            self._values.clear()
+
+    def set_function(self, function: Callable[[], float]):
+        """读取时调用function计算数值（仅无标签指标）"""
+        self._function = function
+
+    def get(self, **labels) -> float:
+        if self._function is not None:
+            return float(self._function())
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def values(self) -> Dict[LabelValues, float]:
+        if self._function is not None:
+            return {(): float(self._function())}
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in sorted(self.values().items())]
+
+
+class Histogram(_Metric):
+    """累积直方图"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> (各桶计数（非累积，最后一个为+Inf）, 总和, 次数)
+        self._values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels):
+        """记录一次观测"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def summary(self) -> Dict[LabelValues, Dict[str, float]]:
+        """各标签组合的次数、均值和近似分位数（按桶上界估计）"""
+        with self._lock:
+            snapshot = {key: ([c for c in state[0]], state[1], state[2]) for key, state in self._values.items()}
+
+        result = {}
+        for key, (counts, total, count) in snapshot.items():
+            result[key] = {
+                'count': count,
+                'mean': total / count if count else 0.0,
+                'p50': self._quantile(counts, count, 0.5),
+                'p95': self._quantile(counts, count, 0.95),
+            }
+        return result
+
+    def _quantile(self, counts: List[int], count: int, q: float) -> float:
+        if count == 0:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def samples(self):
+        with self._lock:
+            snapshot = sorted((key, [c for c in state[0]], state[1], state[2]) for key, state in self._values.items())
+
+        samples = []
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", key + (_format_value(bound),), cumulative))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+class RateMeter:
+    """滑动窗口内的事件速率（次/秒）"""
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def mark(self):
+        with self._lock:
+            self._events.append(time.monotonic())
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            while self._events and now - self._events[0] > self.window:
+                self._events.popleft()
+            return len(self._events) / self.window
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self.start_time = time.time()
+
+        # 服务指标
+        self.requests = self.counter('gat_requests_total', '生成请求数', ['status'])
+        self.request_rate = RateMeter()
+        self.requests_per_second = self.gauge('gat_requests_per_second', '最近60秒的请求速率')
+        self.requests_per_second.set_function(self.request_rate.rate)
+        self.queue_depth = self.gauge('gat_queue_depth', '等待执行的生成请求数')
+        self.in_flight = self.gauge('gat_requests_in_flight', '正在执行的生成请求数')
+        self.request_duration = self.histogram('gat_request_duration_seconds', '生成请求端到端耗时')
+        self.stage_duration = self.histogram('gat_stage_duration_seconds', '各处理阶段每个请求的累计耗时', ['stage'])
+        self.images_generated = self.counter('gat_images_generated_total', '各LoRA生成的图像数', ['lora'])
+        self.cache_requests = self.counter('gat_cache_requests_total', '缓存查询次数', ['cache', 'result'])
+        self.memory_bytes = self.gauge('gat_memory_bytes', '内存用量', ['kind'])
+        self.component_memory_bytes = self.gauge('gat_component_memory_bytes', '各登记组件的常驻内存', ['component'])
+
+    def _add(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"指标 {metric.name} 已以不同类型或标签注册")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """获取或创建计数器"""
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """获取或创建瞬时值指标"""
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """获取或创建直方图"""
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """
+        添加采集回调，导出前调用（用于刷新内存用量等按需读取的指标）
+
+        Args:
+            collector: 无参回调
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], None]):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def collect(self):
+        """执行所有采集回调"""
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                # 采集失败不影响其他指标导出
+                logger.warning(f"指标采集失败: {e}")
+
+    # ---- 组件上报的便捷方法 ----
+
+    def record_cache(self, cache: str, hit: bool):
+        """记录一次缓存查询"""
+        self.cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+    def record_request(self, status: str, duration: float, timings: Optional[Dict[str, float]] = None,
+                       lora: Optional[str] = None, num_images: int = 0):
+        """
+        记录一次完成的生成请求
+
+        Args:
+            status: success、error、cancelled 或 timeout
+            duration: 端到端耗时（秒）
+            timings: 各阶段耗时（追踪结果中的timings）
+            lora: 使用的LoRA名称
+            num_images: 生成图像数
+        """
+        self.requests.inc(status=status)
+        self.request_rate.mark()
+        self.request_duration.observe(duration)
+        for stage, seconds in (timings or {}).items():
+            if stage != 'total':
+                self.stage_duration.observe(seconds, stage=stage)
+        if lora and num_images:
+            self.images_generated.inc(num_images, lora=lora)
+
+    def update_memory(self, usage: Dict):
+        """
+        按内存管理器的用量报告刷新内存指标
+
+        Args:
+            usage: MemoryGovernor.usage() 的返回值
+        """
+        if not usage:
+            return
+        self.memory_bytes.set(usage.get('budget_bytes') or 0, kind='budget')
+        self.memory_bytes.set(usage.get('used_bytes') or 0, kind='registered')
+        if usage.get('process_rss_bytes') is not None:
+            self.memory_bytes.set(usage['process_rss_bytes'], kind='process_rss')
+        self.component_memory_bytes.clear()
+        for name, info in usage.get('components', {}).items():
+            self.component_memory_bytes.set(info['bytes'], component=name)
+
+    def cache_hit_rates(self) -> Dict[str, Dict[str, float]]:
+        """各缓存的命中次数、查询次数与命中率"""
+        stats: Dict[str, Dict[str, float]] = {}
+        for (cache, result), value in self.cache_requests.values().items():
+            entry = stats.setdefault(cache, {'hits': 0, 'requests': 0})
+            entry['requests'] += value
+            if result == 'hit':
+                entry['hits'] += value
+        for entry in stats.values():
+            entry['hit_rate'] = entry['hits'] / entry['requests'] if entry['requests'] else 0.0
+        return stats
+
+    def render(self) -> str:
+        """导出Prometheus文本格式（text/plain; version=0.0.4）"""
+        self.collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict:
+        """面板展示用的指标摘要"""
+        self.collect()
+        return {
+            'uptime_seconds': time.time() - self.start_time,
+            'requests': {status: value for (status,), value in self.requests.values().items()},
+            'requests_per_second': self.requests_per_second.get(),
+            'queue_depth': self.queue_depth.get(),
+            'in_flight': self.in_flight.get(),
+            'request_duration': self.request_duration.summary().get((), {}),
+            'stage_duration': {stage: info for (stage,), info in self.stage_duration.summary().items()},
+            'cache_hit_rates': self.cache_hit_rates(),
+            'memory_bytes': {kind: value for (kind,), value in self.memory_bytes.values().items()},
+            'images_generated': {lora: value for (lora,), value in self.images_generated.values().items()},
+        }
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    """进程级共享指标注册表"""
+    return _registry
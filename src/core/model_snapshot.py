@@ -0,0 +1,203 @@
+"""
+模型快照模块
+将准备好的Stable Diffusion管道（已融合LoRA、已选定精度、调度器配置）
+序列化为单个safetensors文件，新的工作进程通过mmap一次性挂载，跳过
+from_pretrained的逐组件加载与随机初始化
+
+快照文件布局:
+- 张量: `<组件名>.<参数名>`，组件为 unet / vae / text_encoder
+- 元数据: 各组件配置、调度器配置、分词器文件、精度、已融合的LoRA等（JSON字符串）
+"""
+
+import json
+import logging
+import tempfile
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "gat-sd-snapshot"
+SNAPSHOT_VERSION = "1"
+
+# 需要保存权重的管道组件
+WEIGHT_COMPONENTS = ('unet', 'vae', 'text_encoder')
+
+
+def _component_config(component: Any) -> Dict:
+    """获取diffusers/transformers组件的配置字典"""
+    config = component.config
+    if hasattr(config, 'to_dict'):
+        return config.to_dict()
+    return dict(config)
+
+
+def save_snapshot(
+    pipeline: Any,
+    snapshot_path: Union[str, Path],
+    fused_loras: Optional[List[str]] = None,
+    source_model: str = ""
+) -> Path:
+    """
+    保存管道快照
+
+    Args:
+        pipeline: 已准备好的StableDiffusionPipeline
+        snapshot_path: 快照文件路径（.safetensors）
+        fused_loras: 已融合进权重的LoRA名称列表
+        source_model: 源模型路径，用于校验快照是否过期
+
+    Returns:
+        Path: 快照文件路径
+    """
+    from safetensors.torch import save_file
+
+    snapshot_path = Path(snapshot_path)
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tensors = {}
+    seen_storages = set()
+    metadata = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'source_model': source_model,
+        'dtype': str(pipeline.unet.dtype).replace('torch.', ''),
+        'fused_loras': json.dumps(fused_loras or []),
+    }
+
+    for name in WEIGHT_COMPONENTS:
+        # 编译后的模块（torch.compile、UNet编译变体缓存）保存原模块的权重
+        component = getattr(pipeline, name)
+        component = getattr(component, '_orig_mod', component)
+        for key, tensor in component.state_dict().items():
+            tensor = tensor.detach().to('cpu').contiguous()
+            # safetensors不允许共享存储的张量，遇到共享权重时复制一份
+            storage_key = (tensor.data_ptr(), tensor.numel())
+            if storage_key in seen_storages:
+                tensor = tensor.clone()
+            seen_storages.add(storage_key)
+            tensors[f"{name}.{key}"] = tensor
+
+        metadata[f"{name}_class"] = type(component).__name__
+        metadata[f"{name}_config"] = json.dumps(_component_config(component))
+
+    scheduler = pipeline.scheduler
+    metadata['scheduler_class'] = type(scheduler).__name__
+    metadata['scheduler_config'] = json.dumps(dict(scheduler.config))
+
+    # 分词器文件较小，直接内嵌到元数据中，使快照自包含
+    tokenizer = pipeline.tokenizer
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tokenizer.save_pretrained(tmp_dir)
+        tokenizer_files = {
+            path.name: path.read_text(encoding='utf-8')
+            for path in Path(tmp_dir).iterdir() if path.is_file()
+        }
+    metadata['tokenizer_class'] = type(tokenizer).__name__
+    metadata['tokenizer_files'] = json.dumps(tokenizer_files)
+
+    # 先写临时文件再替换，避免其他进程读到半写入的快照
+    tmp_path = snapshot_path.with_suffix(snapshot_path.suffix + '.tmp')
+    save_file(tensors, str(tmp_path), metadata=metadata)
+    tmp_path.replace(snapshot_path)
+
+    logger.info(f"模型快照已保存: {snapshot_path} ({len(tensors)} 个张量)")
+    return snapshot_path
+
+
+def read_snapshot_metadata(snapshot_path: Union[str, Path]) -> Dict[str, str]:
+    """读取快照元数据（不加载张量）"""
+    from safetensors import safe_open
+
+    with safe_open(str(snapshot_path), framework="pt", device="cpu") as f:
+        metadata = f.metadata() or {}
+
+    if metadata.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"不是有效的模型快照: {snapshot_path}")
+    if metadata.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"不支持的快照版本: {metadata.get('version')}")
+    return metadata
+
+
+def _empty_weights():
+    """创建不分配权重内存的模型构造上下文"""
+    try:
+        from accelerate import init_empty_weights
+        return init_empty_weights()
+    except ImportError:
+        return nullcontext()
+
+
+def _attach_state_dict(module: torch.nn.Module, state_dict: Dict[str, torch.Tensor]):
+    """将mmap张量直接挂载到模块上，不做额外复制"""
+    try:
+        module.load_state_dict(state_dict, strict=True, assign=True)
+    except TypeError:
+        # torch < 2.1 不支持assign，逐个替换空权重
+        from accelerate.utils import set_module_tensor_to_device
+
+        for name, tensor in state_dict.items():
+            set_module_tensor_to_device(module, name, 'cpu', value=tensor)
+
+
+def load_snapshot(snapshot_path: Union[str, Path]) -> Any:
+    """
+    从快照构建StableDiffusionPipeline
+
+    张量通过safetensors的mmap读取，模型在空权重上下文中构造后直接挂载，
+    整个过程不会执行随机初始化。
+
+    Args:
+        snapshot_path: 快照文件路径
+
+    Returns:
+        StableDiffusionPipeline: 位于CPU上的管道
+    """
+    import diffusers
+    import transformers
+    from safetensors.torch import load_file
+
+    metadata = read_snapshot_metadata(snapshot_path)
+    all_tensors = load_file(str(snapshot_path), device='cpu')
+
+    grouped = {name: {} for name in WEIGHT_COMPONENTS}
+    for key, tensor in all_tensors.items():
+        component_name, param_name = key.split('.', 1)
+        grouped[component_name][param_name] = tensor
+
+    components = {}
+    for name in ('unet', 'vae'):
+        model_cls = getattr(diffusers, metadata[f"{name}_class"])
+        with _empty_weights():
+            model = model_cls.from_config(json.loads(metadata[f"{name}_config"]))
+        _attach_state_dict(model, grouped[name])
+        components[name] = model.eval()
+
+    text_encoder_cls = getattr(transformers, metadata['text_encoder_class'])
+    text_config = text_encoder_cls.config_class.from_dict(json.loads(metadata['text_encoder_config']))
+    with _empty_weights():
+        text_encoder = text_encoder_cls(text_config)
+    _attach_state_dict(text_encoder, grouped['text_encoder'])
+    components['text_encoder'] = text_encoder.eval()
+
+    scheduler_cls = getattr(diffusers, metadata['scheduler_class'])
+    components['scheduler'] = scheduler_cls.from_config(json.loads(metadata['scheduler_config']))
+
+    tokenizer_cls = getattr(transformers, metadata['tokenizer_class'])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for file_name, content in json.loads(metadata['tokenizer_files']).items():
+            (Path(tmp_dir) / file_name).write_text(content, encoding='utf-8')
+        components['tokenizer'] = tokenizer_cls.from_pretrained(tmp_dir)
+
+    pipeline = diffusers.StableDiffusionPipeline(
+        **components,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False
+    )
+
+    logger.info(f"已从快照挂载模型: {snapshot_path}")
+    return pipeline
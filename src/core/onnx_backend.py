@@ -0,0 +1,541 @@
+"""
+ONNX Runtime CPU推理后端
+将文本编码器、UNet（含ControlNet残差输入）和VAE解码器导出为ONNX，由ONNX Runtime
+（启用图优化）执行，管道的其余部分（调度器、ControlNet、图像后处理）仍使用PyTorch：
+
+- 导出结果按模型指纹与已融合的LoRA缓存在 hardware.onnx.cache_dir，同一组合只导出一次，
+  切换LoRA后首次推理导出新的组合，内存中最多保留 max_sessions 套会话
+- 推理期间管道中的文本编码器、UNet和VAE解码器临时替换为调用ONNX Runtime会话的模块，
+  输入输出通过IO绑定直接读写torch张量的内存，不经过numpy复制
+- UNet图总是带ControlNet残差输入，不使用ControlNet的步骤绑定全零残差（加零不改变结果）
+- LoRA融合、快照与内存管理仍作用于原PyTorch模块
+
+使用不支持的参数（如 attention_mask、cross_attention_kwargs）时自动回退到PyTorch模块。
+"""
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from ..utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 导出的组件（每个组件一个子目录，大模型的外部权重文件与图放在一起）
+ONNX_COMPONENTS = ('text_encoder', 'unet', 'vae_decoder')
+
+# 计入模型指纹的权重与配置文件
+FINGERPRINT_SUFFIXES = ('.safetensors', '.bin', '.ckpt', '.pt', '.json')
+
+# ONNX张量类型 -> (torch类型, numpy类型)
+_ORT_TYPES = {
+    'tensor(float)': (torch.float32, np.float32),
+    'tensor(float16)': (torch.float16, np.float16),
+    'tensor(int64)': (torch.int64, np.int64),
+    'tensor(int32)': (torch.int32, np.int32),
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL',
+}
+
+
+def path_fingerprint(path: str) -> List:
+    """文件或目录中权重/配置文件的 (相对路径, 大小, 修改时间)，路径不存在时为路径本身（如Hub模型ID）"""
+    root = Path(path)
+    if root.is_file():
+        files = [root]
+        root = root.parent
+    elif root.is_dir():
+        files = sorted(f for f in root.rglob('*') if f.is_file() and f.suffix in FINGERPRINT_SUFFIXES)
+    else:
+        return [str(path)]
+
+    fingerprint = []
+    for file in files:
+        stat = file.stat()
+        fingerprint.append([file.relative_to(root).as_posix(), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def residual_shapes(unet_config: Any, batch: int, height: int, width: int
+                    ) -> Tuple[List[Tuple[int, ...]], Tuple[int, ...]]:
+    """
+    ControlNet残差的形状（与UNet下采样路径逐层对应）
+
+    Args:
+        unet_config: UNet配置
+        batch: 批大小
+        height: 潜变量高度
+        width: 潜变量宽度
+
+    Returns:
+        (下采样块残差形状列表, 中间块残差形状)
+    """
+    channels = list(unet_config.block_out_channels)
+    layers = unet_config.layers_per_block
+    if isinstance(layers, int):
+        layers = [layers] * len(channels)
+
+    shapes = [(batch, channels[0], height, width)]
+    for index, (out_channels, num_layers) in enumerate(zip(channels, layers)):
+        shapes.extend([(batch, out_channels, height, width)] * num_layers)
+        if index < len(channels) - 1:
+            # 步长2、填充1的下采样卷积
+            height, width = (height + 1) // 2, (width + 1) // 2
+            shapes.append((batch, out_channels, height, width))
+    return shapes, (batch, channels[-1], height, width)
+
+
+# ---------------------------------------------------------------- 导出
+
+class _TextEncoderGraph(torch.nn.Module):
+    def __init__(self, text_encoder: torch.nn.Module):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids):
+        return self.text_encoder(input_ids, return_dict=False)[0]
+
+
+class _UNetGraph(torch.nn.Module):
+    def __init__(self, unet: torch.nn.Module):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep, encoder_hidden_states, *residuals):
+        return self.unet(
+            sample, timestep, encoder_hidden_states,
+            down_block_additional_residuals=list(residuals[:-1]),
+            mid_block_additional_residual=residuals[-1],
+            return_dict=False
+        )[0]
+
+
+class _VAEDecoderGraph(torch.nn.Module):
+    def __init__(self, decoder: torch.nn.Module):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, latent):
+        return self.decoder(latent)
+
+
+@contextmanager
+def _default_attention(unet: torch.nn.Module):
+    """导出期间使用默认注意力处理器（切片注意力按导出时的批大小展开循环，令牌合并依赖运行时状态）"""
+    from diffusers.models.attention_processor import AttnProcessor2_0
+
+    processors = unet.attn_processors
+    unet.set_attn_processor(AttnProcessor2_0())
+    try:
+        yield
+    finally:
+        unet.set_attn_processor(processors)
+
+
+def _onnx_export(module: torch.nn.Module, args: tuple, path: Path, input_names: List[str],
+                 output_names: List[str], dynamic_axes: Dict[str, Dict[int, str]], opset: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    options = {}
+    # torch>=2.5 提供基于dynamo的导出器，这里使用支持 dynamic_axes 的TorchScript导出器
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        options['dynamo'] = False
+    # 超过2GB的模型由导出器自动写出外部权重文件（与图位于同一目录）
+    torch.onnx.export(
+        module, args, str(path),
+        input_names=input_names,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+        do_constant_folding=True,
+        **options
+    )
+
+
+def export_pipeline(pipeline: Any, output_dir: Path, opset: int = 17):
+    """
+    将管道的文本编码器、UNet和VAE解码器导出为ONNX（float32）
+
+    Args:
+        pipeline: Stable Diffusion管道（PyTorch模块，LoRA已融合）
+        output_dir: 输出目录，每个组件写入 <组件>/model.onnx
+        opset: ONNX算子集版本
+    """
+    unet = getattr(pipeline.unet, '_orig_mod', pipeline.unet)
+    text_encoder = pipeline.text_encoder
+    vae = pipeline.vae
+    sequence_length = pipeline.tokenizer.model_max_length
+    latent_size = unet.config.sample_size
+    latent_size = latent_size if isinstance(latent_size, int) else latent_size[0]
+    batch_axes = {0: 'batch'}
+    spatial_axes = {0: 'batch', 2: 'height', 3: 'width'}
+
+    with torch.no_grad():
+        with span('onnx_export', component='text_encoder'):
+            _onnx_export(
+                _TextEncoderGraph(text_encoder).eval(),
+                (torch.zeros(1, sequence_length, dtype=torch.int64),),
+                output_dir / 'text_encoder' / 'model.onnx',
+                ['input_ids'], ['last_hidden_state'],
+                {'input_ids': batch_axes, 'last_hidden_state': batch_axes},
+                opset
+            )
+
+        down_shapes, mid_shape = residual_shapes(unet.config, 2, latent_size, latent_size)
+        residual_names = [f"down_residual_{i}" for i in range(len(down_shapes))] + ['mid_residual']
+        residual_axes = {
+            name: {0: 'batch', 2: f"{name}_height", 3: f"{name}_width"} for name in residual_names
+        }
+        with span('onnx_export', component='unet'), _default_attention(unet):
+            _onnx_export(
+                _UNetGraph(unet).eval(),
+                (
+                    torch.randn(2, unet.config.in_channels, latent_size, latent_size),
+                    torch.tensor([999.0]),
+                    torch.randn(2, sequence_length, text_encoder.config.hidden_size),
+                    *[torch.zeros(shape) for shape in down_shapes + [mid_shape]],
+                ),
+                output_dir / 'unet' / 'model.onnx',
+                ['sample', 'timestep', 'encoder_hidden_states', *residual_names], ['out_sample'],
+                {'sample': spatial_axes, 'encoder_hidden_states': batch_axes, 'out_sample': spatial_axes,
+                 **residual_axes},
+                opset
+            )
+
+        with span('onnx_export', component='vae_decoder'):
+            _onnx_export(
+                _VAEDecoderGraph(vae.decoder).eval(),
+                (torch.randn(1, vae.config.latent_channels, latent_size, latent_size),),
+                output_dir / 'vae_decoder' / 'model.onnx',
+                ['latent'], ['sample'],
+                {'latent': spatial_axes, 'sample': spatial_axes},
+                opset
+            )
+
+
+# ---------------------------------------------------------------- 执行
+
+class OrtSession:
+    """ONNX Runtime会话，输入输出通过IO绑定直接使用torch张量的内存"""
+
+    def __init__(self, path: Path, options: Any):
+        import onnxruntime as ort
+
+        self.path = path
+        self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        self.input_types = {arg.name: _ORT_TYPES[arg.type] for arg in self.session.get_inputs()}
+        self.output_types = {arg.name: _ORT_TYPES[arg.type] for arg in self.session.get_outputs()}
+        # 图与外部权重文件的总大小，近似会话常驻内存
+        self.nbytes = sum(file.stat().st_size for file in path.parent.iterdir() if file.is_file())
+
+    def run(self, inputs: Mapping[str, torch.Tensor], output_shapes: Mapping[str, Sequence[int]]
+            ) -> Dict[str, torch.Tensor]:
+        """
+        执行推理
+
+        Args:
+            inputs: 输入名称 -> 张量（按图的输入类型转换为连续的CPU张量）
+            output_shapes: 输出名称 -> 形状（输出张量预先分配，由会话直接写入）
+
+        Returns:
+            Dict[str, torch.Tensor]: 输出名称 -> 张量
+        """
+        binding = self.session.io_binding()
+        # 绑定期间保持输入张量的引用
+        bound = []
+        for name, tensor in inputs.items():
+            torch_type, numpy_type = self.input_types[name]
+            tensor = tensor.detach().to('cpu', torch_type).contiguous()
+            bound.append(tensor)
+            binding.bind_input(name, 'cpu', 0, numpy_type, tuple(tensor.shape), tensor.data_ptr())
+
+        outputs = {}
+        for name, shape in output_shapes.items():
+            torch_type, numpy_type = self.output_types[name]
+            outputs[name] = torch.empty(tuple(shape), dtype=torch_type)
+            binding.bind_output(name, 'cpu', 0, numpy_type, tuple(shape), outputs[name].data_ptr())
+
+        self.session.run_with_iobinding(binding)
+        return outputs
+
+
+class _OrtModule(torch.nn.Module):
+    """推理期间替换管道组件的模块，未覆盖的属性（config、dtype等）取自原模块"""
+
+    def __init__(self, module: torch.nn.Module, backend: "OnnxBackend"):
+        super().__init__()
+        self._orig_mod = module
+        # 后端不是子模块，避免参与 to()/state_dict
+        self.__dict__['_backend'] = backend
+
+    def __getattr__(self, name: str):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self._modules['_orig_mod'], name)
+
+
+class OrtTextEncoder(_OrtModule):
+    def forward(self, input_ids, attention_mask=None, output_hidden_states=None, return_dict=None, **kwargs):
+        if attention_mask is not None or output_hidden_states or kwargs:
+            return self._orig_mod(input_ids, attention_mask=attention_mask,
+                                  output_hidden_states=output_hidden_states, return_dict=return_dict, **kwargs)
+
+        batch, length = input_ids.shape
+        hidden = self._backend.session('text_encoder').run(
+            {'input_ids': input_ids},
+            {'last_hidden_state': (batch, length, self._orig_mod.config.hidden_size)}
+        )['last_hidden_state']
+        # 管道只读取第一个输出（最后一层隐藏状态）
+        return (hidden.to(input_ids.device, self._orig_mod.dtype),)
+
+
+class OrtUNet(_OrtModule):
+    def __init__(self, module: torch.nn.Module, backend: "OnnxBackend"):
+        super().__init__(module, backend)
+        self._zero_residuals: Dict[Tuple[int, ...], List[torch.Tensor]] = {}
+
+    def _zeros(self, sample: torch.Tensor) -> List[torch.Tensor]:
+        """不使用ControlNet时绑定的全零残差（按形状缓存）"""
+        key = tuple(sample.shape)
+        if key not in self._zero_residuals:
+            down_shapes, mid_shape = residual_shapes(self._orig_mod.config, *key[:1], *key[2:])
+            self._zero_residuals[key] = [torch.zeros(shape) for shape in down_shapes + [mid_shape]]
+        return self._zero_residuals[key]
+
+    def forward(self, sample, timestep, encoder_hidden_states, timestep_cond=None, attention_mask=None,
+                cross_attention_kwargs=None, added_cond_kwargs=None, down_block_additional_residuals=None,
+                mid_block_additional_residual=None, return_dict=True, **kwargs):
+        if any(value is not None for value in (timestep_cond, attention_mask, cross_attention_kwargs,
+                                               added_cond_kwargs)) or kwargs:
+            return self._orig_mod(
+                sample, timestep, encoder_hidden_states, timestep_cond=timestep_cond,
+                attention_mask=attention_mask, cross_attention_kwargs=cross_attention_kwargs,
+                added_cond_kwargs=added_cond_kwargs,
+                down_block_additional_residuals=down_block_additional_residuals,
+                mid_block_additional_residual=mid_block_additional_residual, return_dict=return_dict, **kwargs
+            )
+
+        if down_block_additional_residuals is not None and mid_block_additional_residual is not None:
+            residuals = [*down_block_additional_residuals, mid_block_additional_residual]
+        else:
+            residuals = self._zeros(sample)
+        inputs = {
+            'sample': sample,
+            'timestep': torch.as_tensor(timestep).reshape(-1)[:1],
+            'encoder_hidden_states': encoder_hidden_states,
+            **{f"down_residual_{i}": residual for i, residual in enumerate(residuals[:-1])},
+            'mid_residual': residuals[-1],
+        }
+        out = self._backend.session('unet').run(inputs, {'out_sample': sample.shape})['out_sample']
+        out = out.to(sample.device, sample.dtype)
+        if not return_dict:
+            return (out,)
+
+        try:
+            from diffusers.models.unets.unet_2d_condition import UNet2DConditionOutput
+        except ImportError:
+            from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+        return UNet2DConditionOutput(sample=out)
+
+
+class OrtVAEDecoder(_OrtModule):
+    def __init__(self, module: torch.nn.Module, backend: "OnnxBackend", scale_factor: int):
+        super().__init__(module, backend)
+        self.scale_factor = scale_factor
+
+    def forward(self, z, latent_embeds=None):
+        if latent_embeds is not None:
+            return self._orig_mod(z, latent_embeds)
+
+        batch, _, height, width = z.shape
+        out_channels = self._orig_mod.conv_out.out_channels
+        shape = (batch, out_channels, height * self.scale_factor, width * self.scale_factor)
+        sample = self._backend.session('vae_decoder').run({'latent': z}, {'sample': shape})['sample']
+        return sample.to(z.device, z.dtype)
+
+
+class OnnxBackend:
+    """按模型与已融合LoRA管理ONNX导出与ONNX Runtime会话"""
+
+    def __init__(self, onnx_config: Mapping, model_fingerprint: Any, num_threads: int):
+        """
+        Args:
+            onnx_config: hardware.onnx 配置
+            model_fingerprint: 基础模型的指纹（权重文件的路径、大小与修改时间）
+            num_threads: ONNX Runtime intra-op线程数
+        """
+        import onnxruntime as ort
+
+        self.config = onnx_config
+        self.cache_dir = Path(onnx_config.get('cache_dir', 'data/cache/onnx'))
+        self.opset = int(onnx_config.get('opset', 17))
+        self.max_sessions = max(int(onnx_config.get('max_sessions', 2)), 1)
+        self.model_fingerprint = model_fingerprint
+
+        self.options = ort.SessionOptions()
+        self.options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel,
+            GRAPH_OPTIMIZATION_LEVELS[onnx_config.get('graph_optimization', 'all')]
+        )
+        self.options.intra_op_num_threads = num_threads
+        self.options.inter_op_num_threads = 1
+        self.options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+
+        # 导出键 -> 组件名 -> 会话，按最近使用排序
+        self.sessions: "OrderedDict[str, Dict[str, OrtSession]]" = OrderedDict()
+        self.active_key: Optional[str] = None
+        self.modules: Dict[str, _OrtModule] = {}
+        self._lock = threading.Lock()
+        logger.info(f"ONNX Runtime后端已启用 (onnxruntime {ort.__version__}, "
+                    f"图优化 {onnx_config.get('graph_optimization', 'all')}, 线程数 {num_threads})")
+
+    def export_key(self, fused_loras: Sequence[Tuple[str, float, str]]) -> str:
+        """
+        导出键：模型指纹、已融合的LoRA（名称、权重与文件指纹）、算子集与torch版本
+
+        Args:
+            fused_loras: (LoRA名称, 权重, 文件路径) 列表
+        """
+        loras = sorted([name, weight, path_fingerprint(path) if path else []]
+                       for name, weight, path in fused_loras)
+        payload = json.dumps({
+            'model': self.model_fingerprint,
+            'loras': loras,
+            'opset': self.opset,
+            'torch': torch.__version__,
+        }, sort_keys=True)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def prepare(self, pipeline: Any, fused_loras: Sequence[Tuple[str, float, str]]):
+        """
+        确保当前模型与LoRA组合的会话可用：依次查找内存中的会话、磁盘缓存，都没有时导出
+
+        Args:
+            pipeline: Stable Diffusion管道（PyTorch模块）
+            fused_loras: 当前已融合的 (LoRA名称, 权重, 文件路径) 列表
+        """
+        key = self.export_key(fused_loras)
+        with self._lock:
+            if key in self.sessions:
+                self.sessions.move_to_end(key)
+                self.active_key = key
+                return
+
+            export_dir = self.cache_dir / key
+            if not all((export_dir / name / 'model.onnx').exists() for name in ONNX_COMPONENTS):
+                self._export(pipeline, export_dir, fused_loras)
+
+            with span('onnx_session_load'):
+                sessions = {name: OrtSession(export_dir / name / 'model.onnx', self.options)
+                            for name in ONNX_COMPONENTS}
+            self.sessions[key] = sessions
+            self.active_key = key
+            while len(self.sessions) > self.max_sessions:
+                evicted, _ = self.sessions.popitem(last=False)
+                logger.info(f"释放ONNX会话: {evicted}")
+            logger.info(f"ONNX会话已加载: {key}")
+
+    def _export(self, pipeline: Any, export_dir: Path, fused_loras: Sequence[Tuple[str, float, str]]):
+        """导出到临时目录后整体改名，中断的导出不会被当作缓存"""
+        names = ', '.join(name for name, _, _ in fused_loras) or '无'
+        logger.info(f"导出ONNX模型（LoRA: {names}）: {export_dir}")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{export_dir.name}.", dir=self.cache_dir))
+        try:
+            export_pipeline(pipeline, tmp_dir, self.opset)
+            (tmp_dir / 'export.json').write_text(json.dumps({
+                'model': self.model_fingerprint,
+                'loras': [[name, weight, path] for name, weight, path in fused_loras],
+                'opset': self.opset,
+                'torch': torch.__version__,
+            }, ensure_ascii=False, indent=2), encoding='utf-8')
+            if export_dir.exists():
+                # 上次导出不完整，替换
+                shutil.rmtree(export_dir)
+            os.replace(tmp_dir, export_dir)
+        except Exception as e:
+            logger.error(f"ONNX模型导出失败: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def session(self, name: str) -> OrtSession:
+        """当前组合中指定组件的会话"""
+        if self.active_key not in self.sessions:
+            raise RuntimeError("ONNX会话未加载，推理前需调用 prepare()")
+        return self.sessions[self.active_key][name]
+
+    @contextmanager
+    def activate(self, pipeline: Any) -> Iterator[None]:
+        """
+        推理期间将管道的文本编码器、UNet和VAE解码器替换为ONNX Runtime模块
+
+        直接写入管道的实例属性，不修改管道配置；退出时恢复原模块。
+
+        Args:
+            pipeline: 本次推理使用的管道（基础管道或ControlNet管道）
+        """
+        originals = {name: pipeline.__dict__[name] for name in ('text_encoder', 'unet')}
+        vae = pipeline.vae
+        decoder = vae._modules['decoder']
+        modules = self.wrap(pipeline)
+        pipeline.__dict__['text_encoder'] = modules['text_encoder']
+        pipeline.__dict__['unet'] = modules['unet']
+        vae._modules['decoder'] = modules['vae_decoder']
+        try:
+            yield
+        finally:
+            pipeline.__dict__.update(originals)
+            vae._modules['decoder'] = decoder
+
+    def wrap(self, pipeline: Any) -> Dict[str, _OrtModule]:
+        """
+        管道组件对应的ONNX Runtime模块（原模块不变时复用，追踪钩子只需登记一次）
+
+        Returns:
+            Dict[str, _OrtModule]: 组件名 -> 模块
+        """
+        vae = pipeline.vae
+        components = {
+            'text_encoder': pipeline.text_encoder,
+            'unet': pipeline.unet,
+            'vae_decoder': vae.decoder,
+        }
+        for name, module in components.items():
+            wrapper = self.modules.get(name)
+            if wrapper is not None and wrapper._orig_mod is module:
+                continue
+            if name == 'text_encoder':
+                self.modules[name] = OrtTextEncoder(module, self)
+            elif name == 'unet':
+                self.modules[name] = OrtUNet(module, self)
+            else:
+                self.modules[name] = OrtVAEDecoder(module, self, 2 ** (len(vae.config.block_out_channels) - 1))
+        return self.modules
+
+    def nbytes(self) -> int:
+        """已加载会话的近似内存占用（字节）"""
+        with self._lock:
+            return sum(session.nbytes for sessions in self.sessions.values() for session in sessions.values())
+
+    def clear(self):
+        """释放所有会话（下次推理前从磁盘缓存重新加载）"""
+        with self._lock:
+            self.sessions.clear()
+            self.active_key = None
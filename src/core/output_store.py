@@ -0,0 +1,269 @@
+"""
+生成结果的存储与索引
+- 输出按 日期/运行 组织，同一次运行的图像位于同一目录，不会覆盖之前的结果
+- 生成参数以PNG文本块写入图像（parameters为可读文本，gat为JSON），并写出同名JSON旁注文件
+- 生成时为每张图像编码一次缩小的WebP缩略图，界面图库和历史结果只传输缩略图
+- 所有运行的图像记录追加到SQLite索引，界面按提示词/LoRA/种子查询时不需要扫描文件系统；
+  提示词使用FTS5全文索引（SQLite未编译FTS5时退化为LIKE查询）
+"""
+
+import io
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+logger = logging.getLogger(__name__)
+
+# 写入索引列的生成参数（其余参数保存在params列的JSON中）
+_INDEXED_PARAMS = ('seed', 'num_inference_steps', 'guidance_scale', 'width', 'height')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    prompt TEXT,
+    lora TEXT,
+    method TEXT,
+    seed INTEGER,
+    num_inference_steps INTEGER,
+    guidance_scale REAL,
+    width INTEGER,
+    height INTEGER,
+    params TEXT,
+    thumbnail TEXT
+);
+CREATE INDEX IF NOT EXISTS outputs_created ON outputs (created_at);
+CREATE INDEX IF NOT EXISTS outputs_lora ON outputs (lora, created_at);
+CREATE INDEX IF NOT EXISTS outputs_seed ON outputs (seed);
+CREATE INDEX IF NOT EXISTS outputs_run ON outputs (run_id);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS outputs_fts USING fts5(prompt, content='outputs', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS outputs_fts_insert AFTER INSERT ON outputs BEGIN
+    INSERT INTO outputs_fts (rowid, prompt) VALUES (new.id, new.prompt);
+END;
+"""
+
+
+def new_run_id() -> str:
+    """运行标识：时间 + 随机后缀（同一秒内的多次运行也不冲突）"""
+    return f"{time.strftime('%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+def encode_thumbnail(image: Image.Image, max_size: int = 256, image_format: str = 'webp',
+                     quality: int = 80) -> bytes:
+    """
+    编码缩略图
+
+    Args:
+        image: 原图
+        max_size: 缩略图长边像素
+        image_format: 编码格式
+        quality: 编码质量
+
+    Returns:
+        bytes: 编码后的缩略图
+    """
+    thumbnail = image.copy()
+    thumbnail.thumbnail((max_size, max_size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format=image_format.upper(), quality=quality)
+    return buffer.getvalue()
+
+
+def build_metadata(result: Dict[str, Any], include_prompts: bool = True,
+                   defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    由生成结果构建图像元数据
+
+    Args:
+        result: ImageGenerator.generate_from_cad 的返回值
+        include_prompts: 是否包含提示词与负面提示词
+        defaults: 未显式指定时生效的生成参数（generation配置）
+
+    Returns:
+        Dict: 元数据（lora、method、生成参数，以及可选的prompt）
+    """
+    params = {name: (defaults or {}).get(name) for name in _INDEXED_PARAMS if name != 'seed'}
+    params.update({
+        name: value for name, value in result.get('generation_params', {}).items()
+        if isinstance(value, (str, int, float, bool))
+    })
+    if not include_prompts:
+        params.pop('negative_prompt', None)
+
+    metadata = {
+        'lora': result.get('lora_used'),
+        'method': result.get('controlnet_method'),
+        'params': params,
+    }
+    if include_prompts:
+        metadata['prompt'] = result.get('prompt')
+    return metadata
+
+
+def png_info(metadata: Dict[str, Any]) -> PngInfo:
+    """生成参数的PNG文本块"""
+    params = metadata.get('params', {})
+    lines = []
+    if metadata.get('prompt'):
+        lines.append(metadata['prompt'])
+    if params.get('negative_prompt'):
+        lines.append(f"Negative prompt: {params['negative_prompt']}")
+    settings = {
+        'Steps': params.get('num_inference_steps'),
+        'CFG scale': params.get('guidance_scale'),
+        'Seed': params.get('seed'),
+        'Size': f"{params['width']}x{params['height']}" if params.get('width') and params.get('height') else None,
+        'LoRA': metadata.get('lora'),
+        'ControlNet': metadata.get('method'),
+    }
+    lines.append(', '.join(f"{name}: {value}" for name, value in settings.items() if value is not None))
+
+    info = PngInfo()
+    info.add_text('parameters', '\n'.join(lines))
+    info.add_itxt('gat', json.dumps(metadata, ensure_ascii=False, default=str))
+    return info
+
+
+class OutputIndex:
+    """所有运行的输出图像索引（SQLite，只追加，线程安全）"""
+
+    def __init__(self, path: str):
+        """
+        打开（或创建）索引
+
+        Args:
+            path: SQLite数据库文件路径
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # 批量运行与界面可能同时写入同一索引，等待锁而不是立即失败
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        # 早期创建的索引没有缩略图列
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(outputs)')}
+        if 'thumbnail' not in columns:
+            self._conn.execute('ALTER TABLE outputs ADD COLUMN thumbnail TEXT')
+        try:
+            self._conn.executescript(_FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite不支持FTS5，提示词查询使用LIKE: {e}")
+            self.full_text = False
+
+    def add(self, run_id: str, paths: List[str], metadata: Dict[str, Any],
+            thumbnails: Optional[List[Optional[str]]] = None) -> int:
+        """
+        追加一次保存的图像记录
+
+        Args:
+            run_id: 运行标识
+            paths: 图像路径
+            metadata: build_metadata 构建的元数据
+            thumbnails: 与图像对应的缩略图路径
+
+        Returns:
+            int: 追加的记录数
+        """
+        params = metadata.get('params', {})
+        now = time.time()
+        thumbnails = thumbnails or [None] * len(paths)
+        rows = [
+            (run_id, str(path), now, metadata.get('prompt'), metadata.get('lora'), metadata.get('method'),
+             *(params.get(name) for name in _INDEXED_PARAMS),
+             json.dumps(params, ensure_ascii=False, default=str),
+             str(thumbnail) if thumbnail else None)
+            for path, thumbnail in zip(paths, thumbnails)
+        ]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                'INSERT INTO outputs (run_id, path, created_at, prompt, lora, method, seed, num_inference_steps, '
+                'guidance_scale, width, height, params, thumbnail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self._conn.execute('COMMIT')
+        return len(rows)
+
+    def query(self, prompt: Optional[str] = None, lora: Optional[str] = None, seed: Optional[int] = None,
+              run_id: Optional[str] = None, since: Optional[float] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        查询输出记录（按时间倒序）
+
+        Args:
+            prompt: 提示词中包含的词（多个词需全部出现）
+            lora: LoRA名称
+            seed: 随机种子
+            run_id: 运行标识
+            since: 只返回该时间戳之后的记录
+            limit: 最多返回的记录数
+
+        Returns:
+            List[Dict]: 输出记录
+        """
+        conditions, values = [], []
+        if prompt and prompt.strip():
+            if self.full_text:
+                terms = ' '.join('"' + term.replace('"', '""') + '"' for term in re.split(r'[\s,]+', prompt) if term)
+                conditions.append('id IN (SELECT rowid FROM outputs_fts WHERE outputs_fts MATCH ?)')
+                values.append(terms)
+            else:
+                for term in re.split(r'[\s,]+', prompt):
+                    if term:
+                        conditions.append('prompt LIKE ?')
+                        values.append(f"%{term}%")
+        for column, value in (('lora', lora), ('seed', seed), ('run_id', run_id)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                values.append(value)
+        if since is not None:
+            conditions.append('created_at >= ?')
+            values.append(since)
+
+        sql = 'SELECT * FROM outputs'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        values.append(int(limit))
+
+        with self._lock:
+            rows = self._conn.execute(sql, values).fetchall()
+        records = []
+        for row in rows:
+            record = dict(row)
+            record['params'] = json.loads(record['params']) if record['params'] else {}
+            records.append(record)
+        return records
+
+    def loras(self) -> List[str]:
+        """索引中出现过的LoRA名称"""
+        with self._lock:
+            rows = self._conn.execute('SELECT DISTINCT lora FROM outputs WHERE lora IS NOT NULL').fetchall()
+        return sorted(row[0] for row in rows)
+
+    def count(self) -> int:
+        """索引中的记录总数"""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM outputs').fetchone()[0]
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,160 @@
+"""
+异步输出写出
+生成线程将图像与元数据提交到有界队列后立即返回 Future，由后台线程编码并写入磁盘，
+下一次去噪与上一次的编码、写盘重叠执行。队列满时提交方阻塞，避免生成快于写盘时
+图像在内存中无限堆积。
+
+写出的文件按批执行fsync：累积 fsync_batch 个任务或距上次同步超过 fsync_interval 秒时
+统一同步，之后才执行提交动作（如追加结果索引）并完成对应的 Future，Future 返回时文件已落盘。
+队列空闲时剩余的任务最迟在 fsync_interval 秒内同步。
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 写出函数的返回值：(返回给调用方的路径, 需要同步的文件, 落盘后执行的提交动作)
+WriteResult = Tuple[List[str], List[str], Optional[Callable[[], None]]]
+
+
+def fsync_files(files: List[str]):
+    """同步文件及其所在目录（目录同步保证新建的文件名落盘，Windows上跳过）"""
+    directories = set()
+    for file in files:
+        fd = os.open(file, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        directories.add(str(Path(file).parent))
+
+    if os.name != 'posix':
+        return
+    for directory in directories:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class OutputWriter:
+    """后台输出写出服务"""
+
+    def __init__(self, write_fn: Callable[..., WriteResult], max_pending: int = 8, workers: int = 2,
+                 fsync: bool = True, fsync_batch: int = 8, fsync_interval: float = 1.0):
+        """
+        初始化写出服务
+
+        Args:
+            write_fn: 写出函数，接收 submit 的参数，返回 (路径, 待同步文件, 提交动作)
+            max_pending: 队列中最多等待写出的任务数
+            workers: 写出线程数
+            fsync: 是否同步写出的文件
+            fsync_batch: 累积多少个任务执行一次同步
+            fsync_interval: 距上次同步的最长时间（秒）
+        """
+        self.write_fn = write_fn
+        self.fsync = fsync
+        self.fsync_batch = max(int(fsync_batch), 1)
+        self.fsync_interval = fsync_interval
+        self._queue: "queue.Queue[Optional[Tuple[Future, tuple, dict]]]" = queue.Queue(maxsize=max_pending)
+        self._unsynced: List[Tuple[Future, List[str], List[str], Optional[Callable[[], None]]]] = []
+        self._sync_lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._run, name=f"output-writer-{i}", daemon=True)
+            for i in range(max(int(workers), 1))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, *args: Any, **kwargs: Any) -> Future:
+        """
+        提交写出任务（队列满时阻塞）
+
+        Returns:
+            Future: 完成时为写出的路径列表；写出或同步失败时为对应异常
+        """
+        if self._closed:
+            raise RuntimeError("输出写出服务已关闭")
+        future = Future()
+        self._queue.put((future, args, kwargs))
+        return future
+
+    @property
+    def pending(self) -> int:
+        """等待写出的任务数"""
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                self._sync()
+                continue
+            if item is None:
+                self._sync()
+                return
+
+            future, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                paths, files, commit = self.write_fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"输出写出失败: {e}")
+                future.set_exception(e)
+                continue
+
+            with self._sync_lock:
+                self._unsynced.append((future, paths, files, commit))
+                due = (not self.fsync or len(self._unsynced) >= self.fsync_batch
+                       or time.monotonic() - self._last_sync >= self.fsync_interval)
+            if due:
+                self._sync()
+
+    def _sync(self):
+        """同步累积的文件，执行提交动作并完成对应的Future"""
+        with self._sync_lock:
+            batch, self._unsynced = self._unsynced, []
+            self._last_sync = time.monotonic()
+        if not batch:
+            return
+
+        if self.fsync:
+            try:
+                fsync_files([file for _, _, files, _ in batch for file in files])
+            except Exception as e:
+                logger.error(f"输出同步失败: {e}")
+                for future, _, _, _ in batch:
+                    future.set_exception(e)
+                return
+
+        for future, paths, _, commit in batch:
+            try:
+                if commit is not None:
+                    commit()
+                future.set_result(paths)
+            except Exception as e:
+                logger.error(f"输出提交失败: {e}")
+                future.set_exception(e)
+
+    def close(self, timeout: Optional[float] = None):
+        """写完队列中的任务后停止写出线程"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
@@ -0,0 +1,265 @@
+"""
+增量重新生成缓存
+设计师在同一CAD输入和种子上反复微调提示词或ControlNet强度时，保留上一次生成的中间结果，
+只重新计算受改动影响的部分：
+
+- 控制图：同一CAD输入与处理方法只预处理一次
+- 文本嵌入：正面与负面提示词分别缓存，文本和已融合的LoRA不变时不再运行文本编码器
+- 初始潜变量：按种子和形状缓存
+- ControlNet首步残差：首步的ControlNet输入与强度无关，残差按强度线性缩放，
+  仅改变 controlnet_conditioning_scale 时直接复用
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from PIL import Image
+
+from .metrics import get_registry
+
+logger = logging.getLogger(__name__)
+
+
+def input_fingerprint(value: Union[str, np.ndarray, Image.Image]) -> str:
+    """
+    CAD输入的内容指纹
+
+    文件按路径、大小和修改时间标识；数组和图像按像素内容哈希。
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(value, str):
+        stat = os.stat(value)
+        digest.update(f"{os.path.abspath(value)}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8'))
+    elif isinstance(value, np.ndarray):
+        digest.update(f"{value.shape}|{value.dtype}".encode('utf-8'))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, Image.Image):
+        digest.update(f"{value.size}|{value.mode}".encode('utf-8'))
+        digest.update(value.tobytes())
+    else:
+        raise ValueError(f"不支持的输入类型: {type(value).__name__}")
+    return digest.hexdigest()
+
+
+def initial_noise(pipeline: Any, seed: int, num_images: int, width: int, height: int,
+                  device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+    """按种子生成初始噪声潜变量，与管道以 torch.Generator('cpu').manual_seed(seed) 生成的结果一致"""
+    from diffusers.utils.torch_utils import randn_tensor
+
+    shape = (
+        num_images,
+        pipeline.unet.config.in_channels,
+        height // pipeline.vae_scale_factor,
+        width // pipeline.vae_scale_factor,
+    )
+    generator = torch.Generator(device='cpu').manual_seed(int(seed))
+    return randn_tensor(shape, generator=generator, device=device, dtype=dtype)
+
+
+def _tensors_nbytes(value: Any) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (list, tuple)):
+        return sum(_tensors_nbytes(item) for item in value)
+    return 0
+
+
+class RegenerationCache:
+    """保存最近几次生成的中间结果（每类按LRU保留 max_entries 条）"""
+
+    def __init__(self, max_entries: int = 4):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 每类中间结果保留的条目数
+        """
+        self.max_entries = max_entries
+        self._entries: Dict[str, "OrderedDict[Hashable, Any]"] = {
+            'control_map': OrderedDict(),
+            'prompt_embeds': OrderedDict(),
+            'negative_embeds': OrderedDict(),
+            'initial_latents': OrderedDict(),
+            'controlnet_residual': OrderedDict(),
+        }
+        # 控制图张量 id -> 缓存键，用于判断生成时传入的控制图是否来自缓存
+        self._control_keys: Dict[int, Hashable] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, key: Hashable) -> Any:
+        with self._lock:
+            entries = self._entries[kind]
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+        get_registry().record_cache(kind, value is not None)
+        return value
+
+    def _put(self, kind: str, key: Hashable, value: Any):
+        with self._lock:
+            entries = self._entries[kind]
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                _, evicted = entries.popitem(last=False)
+                if kind == 'control_map':
+                    self._control_keys.pop(id(evicted), None)
+
+    def control(self, cad_input: Union[str, np.ndarray, Image.Image], method: str,
+                compute: Callable[[], torch.Tensor], size_key: Hashable = None) -> torch.Tensor:
+        """
+        获取控制图张量（未命中时调用 compute 预处理）
+
+        Args:
+            cad_input: CAD输入
+            method: ControlNet处理方法
+            compute: 预处理函数
+            size_key: 决定控制图尺寸的参数（显式尺寸或分桶集合），不同时不复用
+
+        Returns:
+            torch.Tensor: 控制图张量（命中时为同一对象，调用方不应原地修改）
+        """
+        key = (input_fingerprint(cad_input), method, size_key)
+        tensor = self._get('control_map', key)
+        if tensor is None:
+            tensor = compute()
+            self._put('control_map', key, tensor)
+            with self._lock:
+                self._control_keys[id(tensor)] = key
+        return tensor
+
+    def control_key(self, tensor: Optional[torch.Tensor]) -> Optional[Hashable]:
+        """控制图来自缓存时返回其缓存键"""
+        if tensor is None:
+            return None
+        with self._lock:
+            return self._control_keys.get(id(tensor))
+
+    def _text_embeds(self, kind: str, pipeline: Any, text: str, base_key: Hashable,
+                     device: torch.device) -> torch.Tensor:
+        key = (text,) + base_key
+        embeds = self._get(kind, key)
+        if embeds is None:
+            embeds = pipeline.encode_prompt(text, device, 1, False)[0].detach()
+            self._put(kind, key, embeds)
+        return embeds
+
+    def prompt_embeds(self, pipeline: Any, prompt: Union[str, List[str]], negative_prompt: str,
+                      do_classifier_free_guidance: bool, lora_key: Hashable,
+                      device: torch.device) -> Tuple[Hashable, torch.Tensor, Optional[torch.Tensor]]:
+        """
+        获取文本嵌入（未命中时运行文本编码器）
+
+        正面与负面嵌入分别缓存：界面中的负面提示词通常不变，修改正面提示词时负面嵌入仍可复用。
+        单独编码的负面提示词与管道在CFG中编码的无条件嵌入一致。
+
+        Args:
+            pipeline: Stable Diffusion管道
+            prompt: 正面提示词（多个请求合批时为列表）
+            negative_prompt: 负面提示词（所有提示词共用）
+            do_classifier_free_guidance: 是否需要负面嵌入
+            lora_key: 已融合LoRA的标识（LoRA可能修改文本编码器权重）
+            device: 计算设备
+
+        Returns:
+            (缓存键, 正面嵌入, 负面嵌入)
+        """
+        prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        base_key = (lora_key, id(pipeline.text_encoder))
+        prompt_embeds = torch.cat([
+            self._text_embeds('prompt_embeds', pipeline, text, base_key, device) for text in prompts
+        ])
+        negative_embeds = None
+        if do_classifier_free_guidance:
+            negative_embeds = self._text_embeds('negative_embeds', pipeline, negative_prompt or "", base_key, device)
+            negative_embeds = negative_embeds.expand(len(prompts), -1, -1)
+
+        key = (tuple(prompts), negative_prompt if do_classifier_free_guidance else None) + base_key
+        return key, prompt_embeds, negative_embeds
+
+    def initial_latents(self, pipeline: Any, seed: int, num_images: int, width: int, height: int,
+                        device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+        """
+        获取初始噪声潜变量（与管道按相同种子生成的结果一致）
+
+        Args:
+            pipeline: Stable Diffusion管道
+            seed: 随机种子
+            num_images: 图像数量
+            width: 输出宽度
+            height: 输出高度
+            device: 计算设备
+            dtype: 潜变量数据类型
+
+        Returns:
+            torch.Tensor: 未乘 init_noise_sigma 的初始潜变量
+        """
+        key = (int(seed), num_images, width, height, str(device), dtype)
+        latents = self._get('initial_latents', key)
+        if latents is None:
+            latents = initial_noise(pipeline, seed, num_images, width, height, device, dtype)
+            self._put('initial_latents', key, latents)
+        return latents
+
+    @contextmanager
+    def controlnet_residuals(self, controlnet: torch.nn.Module, key: Hashable):
+        """
+        在上下文内复用ControlNet首步残差
+
+        首次调用以强度1.0计算残差并缓存，返回时再乘以本次强度，与直接按强度计算的结果一致。
+        guess_mode或多ControlNet（强度为列表）时不缓存。
+        步数范围限制跳过的步不会调用到这里，首次调用即ControlNet实际执行的第一步。
+
+        Args:
+            controlnet: ControlNet模型
+            key: 除ControlNet强度外决定首步输入的全部参数
+        """
+        # 保留实例上已有的forward（如accelerate卸载钩子），退出时原样恢复
+        patched = 'forward' in controlnet.__dict__
+        previous = controlnet.__dict__.get('forward')
+        original = controlnet.forward
+        calls = [0]
+
+        def forward(*args, **kwargs):
+            calls[0] += 1
+            scale = kwargs.get('conditioning_scale', 1.0)
+            if (calls[0] > 1 or kwargs.get('guess_mode') or kwargs.get('return_dict', True)
+                    or not isinstance(scale, (int, float))):
+                return original(*args, **kwargs)
+
+            residuals = self._get('controlnet_residual', key)
+            if residuals is None:
+                down, mid = original(*args, **{**kwargs, 'conditioning_scale': 1.0})
+                residuals = ([t.detach() for t in down], mid.detach())
+                self._put('controlnet_residual', key, residuals)
+            down, mid = residuals
+            return [t * scale for t in down], mid * scale
+
+        controlnet.forward = forward
+        try:
+            yield
+        finally:
+            if patched:
+                controlnet.forward = previous
+            else:
+                del controlnet.forward
+
+    def nbytes(self) -> int:
+        """缓存的中间结果占用的内存（字节）"""
+        with self._lock:
+            return sum(_tensors_nbytes(list(entries.values())) for entries in self._entries.values())
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            for entries in self._entries.values():
+                entries.clear()
+            self._control_keys.clear()
+        logger.info("增量重新生成缓存已清空")
@@ -0,0 +1,149 @@
+"""
+模型驻留策略
+决定管道各组件（文本编码器、UNet、VAE）在推理期间如何驻留内存，
+使小内存节点也能以可预期的延迟提供服务：
+
+- all:        所有组件常驻工作设备（默认）
+- model:      组件级分页，文本编码器只在编码提示词时、UNet只在去噪循环中、
+              VAE只在解码时驻留；加速设备上卸载到CPU，CPU上卸载到磁盘
+- sequential: 层级分页，每个子层只在前向计算时载入权重
+- mmap:       权重以内存映射文件为后备，由操作系统页缓存决定驻留
+"""
+
+import logging
+from pathlib import Path
+from typing import Any, Dict, List
+
+import torch
+
+from .memory_governor import ModuleOffloader
+
+logger = logging.getLogger(__name__)
+
+RESIDENCY_POLICIES = ('all', 'model', 'sequential', 'mmap')
+
+# 管道组件按推理阶段排列：编码提示词 -> 去噪 -> 解码
+STAGE_COMPONENTS = ('text_encoder', 'unet', 'vae')
+
+
+class ResidencyManager:
+    """管道组件驻留管理器"""
+
+    def __init__(self, policy: str, device: torch.device, offload_dir: str = "data/cache/offload"):
+        """
+        初始化驻留管理器
+
+        Args:
+            policy: 驻留策略 (all, model, sequential, mmap)
+            device: 计算设备
+            offload_dir: 卸载文件目录
+        """
+        if policy not in RESIDENCY_POLICIES:
+            raise ValueError(f"不支持的驻留策略: {policy}")
+
+        self.policy = policy
+        self.device = device
+        self.offload_dir = Path(offload_dir)
+        self.offloaders: Dict[str, ModuleOffloader] = {}
+
+    @property
+    def keeps_weights_resident(self) -> bool:
+        """权重是否始终常驻（只有all策略允许其他机制再卸载组件）"""
+        return self.policy == 'all'
+
+    def apply(self, pipeline: Any) -> Any:
+        """
+        按策略放置管道组件，替代 pipeline.to(device)
+
+        Args:
+            pipeline: Stable Diffusion管道（位于CPU上）
+
+        Returns:
+            处理后的管道
+        """
+        if self.policy == 'all':
+            return pipeline.to(self.device)
+
+        accelerator = self.device.type != 'cpu'
+
+        if self.policy == 'model':
+            if accelerator:
+                pipeline.enable_model_cpu_offload(device=self.device)
+            else:
+                self._setup_component_paging(pipeline)
+
+        elif self.policy == 'sequential':
+            if accelerator:
+                pipeline.enable_sequential_cpu_offload(device=self.device)
+            else:
+                self._setup_layer_paging(pipeline)
+
+        elif self.policy == 'mmap':
+            self._mmap_weights(pipeline)
+            if accelerator:
+                pipeline = pipeline.to(self.device)
+
+        logger.info(f"模型驻留策略: {self.policy}")
+        return pipeline
+
+    def _setup_component_paging(self, pipeline: Any):
+        """CPU上的组件级分页：进入某个阶段时载入该组件并卸载其他阶段的组件"""
+        for name in STAGE_COMPONENTS:
+            module = getattr(pipeline, name)
+            self.offloaders[name] = ModuleOffloader(
+                f"residency:{name}",
+                module,
+                self.device,
+                str(self.offload_dir),
+                on_restore=lambda active=name: self._page_out_others(active)
+            )
+
+        # 初始全部卸载，空闲时不占用内存
+        for offloader in self.offloaders.values():
+            offloader.offload()
+
+    def _page_out_others(self, active: str):
+        """某阶段组件开始前向计算时，卸载其他阶段的组件"""
+        for name, offloader in self.offloaders.items():
+            if name != active and not offloader.offloaded:
+                offloader.offload()
+
+    def _setup_layer_paging(self, pipeline: Any):
+        """CPU上的层级分页：权重写入磁盘内存映射文件，每层前向时载入"""
+        from accelerate import disk_offload
+
+        for name in STAGE_COMPONENTS:
+            module = getattr(pipeline, name)
+            disk_offload(module, str(self.offload_dir / 'sequential' / name), execution_device=self.device)
+
+    def _mmap_weights(self, pipeline: Any):
+        """将组件权重替换为内存映射文件中的张量，由操作系统按需换入换出"""
+        mmap_dir = self.offload_dir / 'mmap'
+        mmap_dir.mkdir(parents=True, exist_ok=True)
+
+        for name in STAGE_COMPONENTS:
+            module = getattr(pipeline, name)
+            path = mmap_dir / f"{name}.pt"
+            torch.save(module.state_dict(), path)
+            state_dict = torch.load(path, mmap=True, weights_only=True, map_location='cpu')
+            module.load_state_dict(state_dict, assign=True)
+
+    def end_request(self):
+        """一次生成结束，卸载仍驻留的组件（组件级分页）"""
+        for offloader in self.offloaders.values():
+            if not offloader.offloaded:
+                offloader.offload()
+
+    def restore_all(self):
+        """恢复所有分页组件（例如在融合LoRA前）"""
+        for offloader in self.offloaders.values():
+            offloader.restore()
+
+    def mark_dirty(self):
+        """权重被修改后调用，使磁盘副本在下次卸载时重新写入"""
+        for offloader in self.offloaders.values():
+            offloader.mark_dirty()
+
+    def all_offloaders(self) -> List[ModuleOffloader]:
+        """所有组件级卸载器"""
+        return list(self.offloaders.values())
@@ -0,0 +1,139 @@
+"""
+分辨率分桶
+按输入的长宽比从一组分桶中选择输出分辨率，代替固定的 width x height：
+- 分桶边长为 multiple（默认64）的倍数，像素数不超过基准分辨率的像素数，去噪计算量与默认尺寸相当
+- 控制图按比例缩放到完整落入分桶，不足部分以背景色填充，细长的家电不再被拉伸变形
+- 同一分桶的请求可以打包为一次管道调用，generate_batch 按分桶分组
+"""
+
+import math
+from typing import Hashable, List, Mapping, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# (宽, 高)
+Size = Tuple[int, int]
+
+
+def build_buckets(max_pixels: int, multiple: int = 64, max_aspect_ratio: float = 2.5) -> List[Size]:
+    """
+    构建分桶：每个宽度取像素数不超过上限的最大高度
+
+    Args:
+        max_pixels: 像素数上限
+        multiple: 边长的倍数
+        max_aspect_ratio: 长边与短边之比的上限
+
+    Returns:
+        List[Size]: 按长宽比（宽/高）升序排列的分桶
+    """
+    buckets = set()
+    width = multiple
+    while width * multiple <= max_pixels:
+        height = max_pixels // width // multiple * multiple
+        if max(width, height) / min(width, height) <= max_aspect_ratio:
+            buckets.add((width, height))
+        width += multiple
+    if not buckets:
+        # 像素数上限不足以构成满足长宽比的分桶时退化为最小的方形分桶
+        side = max(int(math.isqrt(max_pixels)) // multiple * multiple, multiple)
+        buckets.add((side, side))
+    return sorted(buckets, key=lambda size: size[0] / size[1])
+
+
+def select_bucket(width: int, height: int, buckets: List[Size]) -> Size:
+    """
+    选择长宽比最接近的分桶（对数差最小，相同时取像素数较大者）
+
+    Args:
+        width: 输入宽度
+        height: 输入高度
+        buckets: 候选分桶
+
+    Returns:
+        Size: 分桶 (宽, 高)
+    """
+    aspect = math.log(width / height)
+    return min(buckets, key=lambda size: (abs(math.log(size[0] / size[1]) - aspect), -size[0] * size[1]))
+
+
+def _background_color(image: np.ndarray) -> Tuple[int, ...]:
+    """图像边框像素的中位数，作为填充色（CAD渲染图的背景通常是纯色）"""
+    border = np.concatenate([image[0], image[-1], image[:, 0], image[:, -1]])
+    color = np.median(border, axis=0)
+    return tuple(int(c) for c in np.atleast_1d(color))
+
+
+def fit_to_size(image: np.ndarray, size: Size) -> np.ndarray:
+    """
+    按比例缩放图像使其完整落入目标尺寸，居中放置，其余部分以背景色填充
+
+    Args:
+        image: 输入图像 (H, W) 或 (H, W, C)
+        size: 目标尺寸 (宽, 高)
+
+    Returns:
+        np.ndarray: 尺寸为 size 的图像
+    """
+    width, height = size
+    source_height, source_width = image.shape[:2]
+    if (source_width, source_height) == (width, height):
+        return image
+
+    scale = min(width / source_width, height / source_height)
+    resized_width = min(max(round(source_width * scale), 1), width)
+    resized_height = min(max(round(source_height * scale), 1), height)
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    resized = cv2.resize(image, (resized_width, resized_height), interpolation=interpolation)
+
+    left = (width - resized_width) // 2
+    top = (height - resized_height) // 2
+    if left == 0 and top == 0 and resized.shape[:2] == (height, width):
+        return resized
+    return cv2.copyMakeBorder(
+        resized, top, height - resized_height - top, left, width - resized_width - left,
+        cv2.BORDER_CONSTANT, value=_background_color(image)
+    )
+
+
+class ResolutionBuckets:
+    """按 generation.buckets 配置选择输出分辨率"""
+
+    def __init__(self, config: Mapping, width: int, height: int):
+        """
+        Args:
+            config: generation.buckets 配置
+            width: 默认输出宽度（generation.width）
+            height: 默认输出高度（generation.height）
+        """
+        self.enabled = config.get('enabled', True)
+        if self.enabled:
+            max_pixels = config.get('max_pixels') or width * height
+            self.sizes = tuple(build_buckets(
+                max_pixels, config.get('multiple', 64), config.get('max_aspect_ratio', 2.5)
+            ))
+        else:
+            # 未启用分桶时只有默认尺寸，控制图仍按比例填充而不是拉伸
+            self.sizes = ((width, height),)
+
+    @property
+    def key(self) -> Hashable:
+        """分桶集合的标识（用于缓存键，配置变化后缓存的控制图不再命中）"""
+        return self.sizes
+
+    def select(self, width: int, height: int, requested: Optional[Size] = None) -> Size:
+        """
+        选择输出分辨率
+
+        Args:
+            width: 输入宽度
+            height: 输入高度
+            requested: 调用方显式指定的 (宽, 高)，提供时直接使用
+
+        Returns:
+            Size: 输出分辨率 (宽, 高)
+        """
+        if requested is not None:
+            return requested
+        return select_bucket(width, height, list(self.sizes))
@@ -0,0 +1,261 @@
+"""
+令牌合并（ToMe）注意力处理器
+512–1024px下UNet高分辨率块的自注意力占据CPU推理的大部分耗时。
+本模块在自注意力（attn1）中按相似度合并键/值令牌：
+
+- 令牌网格按 stride（默认2x2）划分，每格左上角的令牌作为目标，其余为源令牌
+- 每个源令牌找到余弦相似度最高的目标令牌，相似度最高的 N*ratio 个源令牌并入目标（取均值）
+- 查询保持完整分辨率，键/值由合并后的令牌计算，注意力权重按合并数量加权（比例注意力），
+  输出形状不变，无需反合并
+
+注意力计算量约降为原来的 (1 - ratio)。只处理下采样倍数不超过 max_downsample 的块
+（默认只处理令牌最多的最高分辨率块），交叉注意力与其他块仍使用原处理器。
+"""
+
+import inspect
+import logging
+import math
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+
+def merge_tokens(x: torch.Tensor, grid: Tuple[int, int], ratio: float,
+                 stride: Tuple[int, int] = (2, 2),
+                 indices: Optional[Tuple[torch.Tensor, torch.Tensor]] = None
+                 ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """
+    二分图软匹配合并令牌
+
+    Args:
+        x: 令牌 [batch, tokens, channels]
+        grid: 令牌网格 (高, 宽)，高*宽 == tokens
+        ratio: 合并掉的令牌占总数的比例
+        stride: 目标令牌的间隔 (纵向, 横向)
+        indices: 预先计算的 (目标索引, 源索引)
+
+    Returns:
+        (合并后的令牌 [batch, tokens', channels], 每个令牌代表的原令牌数 [batch, tokens'])；
+        无需合并时返回 (x, None)
+    """
+    batch, tokens, channels = x.shape
+    dst_idx, src_idx = indices if indices is not None else grid_indices(grid, stride, x.device)
+    merge_count = min(int(tokens * ratio), src_idx.numel())
+    if merge_count <= 0:
+        return x, None
+
+    src = x[:, src_idx]
+    dst = x[:, dst_idx]
+
+    # 每个源令牌最相似的目标令牌
+    scores = F.normalize(src, dim=-1) @ F.normalize(dst, dim=-1).transpose(-1, -2)
+    best_score, best_dst = scores.max(dim=-1)
+    order = best_score.argsort(dim=-1, descending=True)
+    merged, kept = order[:, :merge_count], order[:, merge_count:]
+
+    # 合并的源令牌累加到目标令牌后取均值
+    target = best_dst.gather(1, merged)
+    merged_tokens = src.gather(1, merged.unsqueeze(-1).expand(-1, -1, channels))
+    dst = dst.scatter_add(1, target.unsqueeze(-1).expand(-1, -1, channels), merged_tokens)
+    dst_sizes = torch.ones(batch, dst.shape[1], device=x.device, dtype=x.dtype).scatter_add(
+        1, target, torch.ones_like(target, dtype=x.dtype)
+    )
+    dst = dst / dst_sizes.unsqueeze(-1)
+
+    kept_tokens = src.gather(1, kept.unsqueeze(-1).expand(-1, -1, channels))
+    sizes = torch.cat([torch.ones(batch, kept.shape[1], device=x.device, dtype=x.dtype), dst_sizes], dim=1)
+    return torch.cat([kept_tokens, dst], dim=1), sizes
+
+
+def grid_indices(grid: Tuple[int, int], stride: Tuple[int, int],
+                 device: torch.device) -> Tuple[torch.Tensor, torch.Tensor]:
+    """令牌网格中目标令牌与源令牌的索引"""
+    height, width = grid
+    index = torch.arange(height * width, device=device).view(height, width)
+    dst_mask = torch.zeros(height, width, dtype=torch.bool, device=device)
+    dst_mask[::stride[0], ::stride[1]] = True
+    return index[dst_mask], index[~dst_mask]
+
+
+class TokenMergingState:
+    """一次生成中所有合并处理器共享的状态（合并比例与当前潜变量尺寸）"""
+
+    def __init__(self, max_downsample: int = 1, stride: Tuple[int, int] = (2, 2)):
+        self.ratio = 0.0
+        self.max_downsample = max_downsample
+        self.stride = stride
+        self.latent_shape: Optional[Tuple[int, int]] = None
+        self._indices: Dict[Tuple, Tuple[torch.Tensor, torch.Tensor]] = {}
+
+    def token_grid(self, tokens: int) -> Optional[Tuple[int, int]]:
+        """由令牌数推算该块的令牌网格；下采样倍数超过 max_downsample 或无法推算时返回None"""
+        if self.latent_shape is None:
+            return None
+        height, width = self.latent_shape
+        downsample = max(round(math.sqrt(height * width / tokens)), 1)
+        if downsample > self.max_downsample:
+            return None
+        grid = (math.ceil(height / downsample), math.ceil(width / downsample))
+        return grid if grid[0] * grid[1] == tokens else None
+
+    def indices(self, grid: Tuple[int, int], device: torch.device) -> Tuple[torch.Tensor, torch.Tensor]:
+        key = (grid, str(device))
+        if key not in self._indices:
+            self._indices[key] = grid_indices(grid, self.stride, device)
+        return self._indices[key]
+
+
+class TokenMergingAttnProcessor:
+    """自注意力处理器：键/值令牌合并后计算比例注意力，不适用时交给原处理器"""
+
+    def __init__(self, state: TokenMergingState, fallback: Any):
+        """
+        Args:
+            state: 共享的合并状态
+            fallback: 安装前的注意力处理器
+        """
+        self.state = state
+        self.fallback = fallback
+        # 原处理器不接受的额外参数（Attention按本处理器的签名转发）不再传递
+        parameters = inspect.signature(fallback.__call__).parameters.values()
+        self._fallback_params = None if any(p.kind is p.VAR_KEYWORD for p in parameters) else {
+            p.name for p in parameters
+        }
+
+    def _fallback(self, attn, hidden_states, encoder_hidden_states, attention_mask, **kwargs):
+        if self._fallback_params is not None:
+            kwargs = {name: value for name, value in kwargs.items() if name in self._fallback_params}
+        if encoder_hidden_states is not None:
+            kwargs['encoder_hidden_states'] = encoder_hidden_states
+        if attention_mask is not None:
+            kwargs['attention_mask'] = attention_mask
+        return self.fallback(attn, hidden_states, **kwargs)
+
+    def __call__(self, attn, hidden_states: torch.Tensor, encoder_hidden_states: Optional[torch.Tensor] = None,
+                 attention_mask: Optional[torch.Tensor] = None, **kwargs) -> torch.Tensor:
+        state = self.state
+        grid = None
+        if (state.ratio > 0 and encoder_hidden_states is None and attention_mask is None
+                and hidden_states.ndim == 3 and getattr(attn, 'spatial_norm', None) is None
+                and getattr(attn, 'group_norm', None) is None):
+            grid = state.token_grid(hidden_states.shape[1])
+        if grid is None:
+            return self._fallback(attn, hidden_states, encoder_hidden_states, attention_mask, **kwargs)
+
+        residual = hidden_states
+        batch = hidden_states.shape[0]
+        merged, sizes = merge_tokens(hidden_states, grid, state.ratio, state.stride,
+                                     state.indices(grid, hidden_states.device))
+
+        query = attn.to_q(hidden_states)
+        key = attn.to_k(merged)
+        value = attn.to_v(merged)
+
+        head_dim = key.shape[-1] // attn.heads
+        query = query.view(batch, -1, attn.heads, head_dim).transpose(1, 2)
+        key = key.view(batch, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch, -1, attn.heads, head_dim).transpose(1, 2)
+        if getattr(attn, 'norm_q', None) is not None:
+            query = attn.norm_q(query)
+        if getattr(attn, 'norm_k', None) is not None:
+            key = attn.norm_k(key)
+
+        # 比例注意力：合并了k个令牌的键在softmax中按k份计入
+        bias = None
+        if sizes is not None:
+            bias = sizes.log().to(query.dtype)[:, None, None, :]
+        hidden_states = F.scaled_dot_product_attention(query, key, value, attn_mask=bias)
+        hidden_states = hidden_states.transpose(1, 2).reshape(batch, -1, attn.heads * head_dim).to(query.dtype)
+
+        hidden_states = attn.to_out[0](hidden_states)
+        hidden_states = attn.to_out[1](hidden_states)
+        if attn.residual_connection:
+            hidden_states = hidden_states + residual
+        return hidden_states / attn.rescale_output_factor
+
+
+class TokenMerging:
+    """在UNet自注意力上安装令牌合并处理器，并按输出分辨率选择合并比例"""
+
+    def __init__(self, config: Dict):
+        """
+        Args:
+            config: performance.token_merging 配置
+        """
+        self.set_ratios(config)
+        stride = config.get('stride', 2)
+        self.state = TokenMergingState(
+            max_downsample=int(config.get('max_downsample', 1)),
+            stride=(stride, stride) if isinstance(stride, int) else tuple(stride)
+        )
+        self._unet = None
+        self._hook = None
+
+    def set_ratios(self, config: Dict):
+        """按配置更新默认合并比例与分辨率项（重新加载配置时调用，下一次生成起生效）"""
+        self.ratio = float(config.get('ratio', 0.5))
+        self.resolution_ratios = {
+            int(size): float(ratio) for size, ratio in (config.get('resolution_ratios') or {}).items()
+        }
+
+    def install(self, unet: torch.nn.Module):
+        """
+        为UNet的所有自注意力模块安装合并处理器
+
+        重复调用是幂等的；attention slicing、xformers等会整体替换处理器，之后需再次调用。
+        """
+        unet = getattr(unet, '_orig_mod', unet)
+        installed = 0
+        for name, module in unet.named_modules():
+            if not name.endswith('attn1') or not hasattr(module, 'set_processor'):
+                continue
+            if not isinstance(module.processor, TokenMergingAttnProcessor):
+                module.set_processor(TokenMergingAttnProcessor(self.state, module.processor))
+            installed += 1
+
+        if self._unet is not unet:
+            if self._hook is not None:
+                self._hook.remove()
+            self._hook = unet.register_forward_pre_hook(self._record_latent_shape, with_kwargs=True)
+            self._unet = unet
+        logger.info(f"令牌合并已安装到 {installed} 个自注意力模块")
+
+    def remove(self):
+        """恢复原注意力处理器"""
+        if self._unet is None:
+            return
+        for module in self._unet.modules():
+            processor = getattr(module, 'processor', None)
+            if isinstance(processor, TokenMergingAttnProcessor):
+                module.set_processor(processor.fallback)
+        self._hook.remove()
+        self._unet = None
+        self._hook = None
+
+    def _record_latent_shape(self, module, args, kwargs):
+        sample = args[0] if args else kwargs.get('sample')
+        self.state.latent_shape = tuple(sample.shape[-2:])
+
+    def ratio_for(self, width: int, height: int) -> float:
+        """输出分辨率对应的合并比例：取不超过长边的最大分辨率项，没有时使用 ratio"""
+        side = max(width, height)
+        sizes = [size for size in self.resolution_ratios if size <= side]
+        return self.resolution_ratios[max(sizes)] if sizes else self.ratio
+
+    def configure(self, width: int, height: int, ratio: Optional[float] = None) -> float:
+        """
+        设置本次生成的合并比例
+
+        Args:
+            width: 输出宽度
+            height: 输出高度
+            ratio: 显式指定的比例（0表示不合并），None时按分辨率选择
+
+        Returns:
+            float: 生效的合并比例
+        """
+        self.state.ratio = self.ratio_for(width, height) if ratio is None else float(ratio)
+        return self.state.ratio
@@ -0,0 +1,354 @@
+"""
+UNet去噪分析器
+在一次生成中为UNet的各个块（time_embedding、conv_in、down_blocks、mid_block、up_blocks、conv_out）
+和所有注意力模块注册钩子，按去噪步记录各块墙钟耗时，并借助torch.profiler统计各块的浮点运算量，
+输出汇总表、火焰图折叠栈（flamegraph.pl / speedscope可直接读取）和JSON报告。
+
+仅用于性能分析：钩子处会同步CUDA以获得准确的块耗时，开启后生成速度会下降。
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# UNet中按顺序执行的顶层块
+_TOP_LEVEL_BLOCKS = ('time_embedding', 'conv_in', 'down_blocks', 'mid_block', 'up_blocks', 'conv_out')
+
+# 注意力模块类名（diffusers新旧版本）
+_ATTENTION_CLASSES = ('Attention', 'CrossAttention')
+
+# torch.profiler中已统计FLOPs的注意力核心算子；注意力模块下没有这些算子（如使用SDPA）时按公式估算
+_ATTENTION_MATMUL_OPS = ('aten::bmm', 'aten::baddbmm', 'aten::matmul')
+
+_LABEL_PREFIX = 'unet::'
+
+
+def _cuda_sync(device: torch.device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+class UNetProfileReport:
+    """一次生成的UNet分析结果"""
+
+    def __init__(self, blocks: List[str], records: List[Tuple[int, str, float]],
+                 step_times: List[float], flops: Dict[str, float]):
+        """
+        Args:
+            blocks: 顶层块名称（按执行顺序）
+            records: (步序号, 标签, 秒) 列表，标签为块名或 attn:模块名
+            step_times: 每步UNet前向耗时（秒）
+            flops: 标签 -> 所有步累计浮点运算数
+        """
+        self.blocks = blocks
+        self.records = records
+        self.step_times = step_times
+        self.flops = flops
+
+    @property
+    def num_steps(self) -> int:
+        return len(self.step_times)
+
+    @property
+    def unet_seconds(self) -> float:
+        return sum(self.step_times)
+
+    def label_seconds(self) -> Dict[str, float]:
+        """各标签所有步累计耗时"""
+        totals: Dict[str, float] = OrderedDict()
+        for _, label, seconds in self.records:
+            totals[label] = totals.get(label, 0.0) + seconds
+        return totals
+
+    @staticmethod
+    def _owner_block(attention_name: str, blocks: List[str]) -> Optional[str]:
+        for block in blocks:
+            if attention_name == block or attention_name.startswith(block + '.'):
+                return block
+        return None
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        汇总各块耗时、占比、其中注意力耗时以及浮点运算量
+
+        Returns:
+            Dict: steps、unet_ms、attention_ms、attention_share、per_step_ms以及blocks明细
+        """
+        seconds = self.label_seconds()
+        unet_seconds = self.unet_seconds or 1e-12
+        steps = max(self.num_steps, 1)
+
+        attention_by_block: Dict[str, float] = {}
+        attention_flops_by_block: Dict[str, float] = {}
+        for label, value in seconds.items():
+            if label.startswith('attn:'):
+                owner = self._owner_block(label[5:], self.blocks)
+                attention_by_block[owner] = attention_by_block.get(owner, 0.0) + value
+                attention_flops_by_block[owner] = attention_flops_by_block.get(owner, 0.0) + self.flops.get(label, 0.0)
+
+        blocks = OrderedDict()
+        for block in self.blocks:
+            block_seconds = seconds.get(block, 0.0)
+            block_flops = self.flops.get(block, 0.0)
+            blocks[block] = {
+                'total_ms': block_seconds * 1000,
+                'ms_per_step': block_seconds * 1000 / steps,
+                'share': block_seconds / unet_seconds,
+                'attention_ms': attention_by_block.get(block, 0.0) * 1000,
+                'gflops': block_flops / 1e9,
+                'attention_gflops': attention_flops_by_block.get(block, 0.0) / 1e9,
+                'gflops_per_s': block_flops / 1e9 / block_seconds if block_seconds else 0.0,
+            }
+
+        attention_seconds = sum(attention_by_block.values())
+        return {
+            'steps': self.num_steps,
+            'unet_ms': self.unet_seconds * 1000,
+            'per_step_ms': [t * 1000 for t in self.step_times],
+            'attention_ms': attention_seconds * 1000,
+            'attention_share': attention_seconds / unet_seconds,
+            'gflops': sum(self.flops.get(block, 0.0) for block in self.blocks) / 1e9,
+            'blocks': blocks,
+        }
+
+    def format_table(self) -> str:
+        """文本汇总表"""
+        summary = self.summary()
+        lines = [
+            f"UNet: {summary['steps']} 步, 共 {summary['unet_ms']:.1f} ms, "
+            f"注意力占 {summary['attention_share']:.1%} ({summary['attention_ms']:.1f} ms), "
+            f"{summary['gflops']:.2f} GFLOPs",
+            f"{'块':<16}{'总耗时ms':>12}{'ms/步':>10}{'占比':>8}{'注意力ms':>12}{'GFLOPs':>10}{'GFLOP/s':>10}",
+        ]
+        for block, info in summary['blocks'].items():
+            lines.append(
+                f"{block:<16}{info['total_ms']:>12.1f}{info['ms_per_step']:>10.2f}{info['share']:>8.1%}"
+                f"{info['attention_ms']:>12.1f}{info['gflops']:>10.2f}{info['gflops_per_s']:>10.1f}"
+            )
+        return '\n'.join(lines)
+
+    def folded_stacks(self) -> List[str]:
+        """
+        火焰图折叠栈（每行 "unet;块;注意力模块 自身耗时微秒"），所有步累加
+
+        Returns:
+            List[str]: 折叠栈行
+        """
+        seconds = self.label_seconds()
+        attention_by_block: Dict[str, float] = {}
+        lines = []
+        for label, value in seconds.items():
+            if label.startswith('attn:'):
+                name = label[5:]
+                owner = self._owner_block(name, self.blocks) or 'other'
+                attention_by_block[owner] = attention_by_block.get(owner, 0.0) + value
+                lines.append(f"unet;{owner};{name} {int(value * 1e6)}")
+
+        blocks_total = 0.0
+        for block in self.blocks:
+            block_seconds = seconds.get(block, 0.0)
+            blocks_total += block_seconds
+            own = max(block_seconds - attention_by_block.get(block, 0.0), 0.0)
+            lines.append(f"unet;{block} {int(own * 1e6)}")
+
+        lines.append(f"unet {int(max(self.unet_seconds - blocks_total, 0.0) * 1e6)}")
+        return lines
+
+    def save(self, output_dir: str, prefix: str = "unet_profile") -> Dict[str, str]:
+        """
+        写出汇总表、折叠栈和JSON报告
+
+        Args:
+            output_dir: 输出目录
+            prefix: 文件名前缀
+
+        Returns:
+            Dict[str, str]: 文件类型 -> 路径
+        """
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+        files = {
+            'table': output_path / f"{prefix}.txt",
+            'folded': output_path / f"{prefix}.folded",
+            'json': output_path / f"{prefix}.json",
+        }
+        files['table'].write_text(self.format_table() + '\n', encoding='utf-8')
+        files['folded'].write_text('\n'.join(self.folded_stacks()) + '\n', encoding='utf-8')
+        files['json'].write_text(json.dumps(self.summary(), indent=2, ensure_ascii=False), encoding='utf-8')
+        return {name: str(path) for name, path in files.items()}
+
+
+class UNetProfiler:
+    """UNet块级分析器"""
+
+    def __init__(self, unet: torch.nn.Module, device: torch.device, record_flops: bool = True):
+        """
+        初始化分析器
+
+        Args:
+            unet: UNet2DConditionModel
+            device: 计算设备（CUDA上在钩子处同步）
+            record_flops: 是否使用torch.profiler统计浮点运算量
+        """
+        self.unet = getattr(unet, '_orig_mod', unet)
+        self.device = device
+        self.record_flops = record_flops
+        self.blocks = self._find_blocks()
+        self.attention_modules = [
+            name for name, module in self.unet.named_modules()
+            if type(module).__name__ in _ATTENTION_CLASSES
+        ]
+
+        self._hooks = []
+        self._open: Dict[str, List[Tuple[float, Any]]] = {}
+        self._records: List[Tuple[int, str, float]] = []
+        self._step_times: List[float] = []
+        self._step = -1
+        self._attention_estimates: Dict[str, float] = {}
+        self.profiler = None
+
+    def _find_blocks(self) -> List[str]:
+        blocks = []
+        for name in _TOP_LEVEL_BLOCKS:
+            module = getattr(self.unet, name, None)
+            if module is None:
+                continue
+            if isinstance(module, torch.nn.ModuleList):
+                blocks.extend(f"{name}.{index}" for index in range(len(module)))
+            else:
+                blocks.append(name)
+        return blocks
+
+    def _begin(self, label: str):
+        _cuda_sync(self.device)
+        record = None
+        if self.profiler is not None:
+            record = torch.autograd.profiler.record_function(f"{_LABEL_PREFIX}{self._step}::{label}")
+            record.__enter__()
+        self._open.setdefault(label, []).append((time.perf_counter(), record))
+
+    def _end(self, label: str) -> float:
+        _cuda_sync(self.device)
+        start, record = self._open[label].pop()
+        if record is not None:
+            record.__exit__(None, None, None)
+        elapsed = time.perf_counter() - start
+        self._records.append((self._step, label, elapsed))
+        return elapsed
+
+    def _register(self, module: torch.nn.Module, label: str, on_begin=None):
+        def pre_hook(module, args, kwargs):
+            if on_begin is not None:
+                on_begin(args, kwargs)
+            self._begin(label)
+
+        def post_hook(module, args, kwargs, output):
+            self._end(label)
+
+        self._hooks.append(module.register_forward_pre_hook(pre_hook, with_kwargs=True))
+        self._hooks.append(module.register_forward_hook(post_hook, with_kwargs=True))
+
+    def _estimate_attention(self, name: str, module: Any):
+        """按输入形状估算注意力核心（QK^T与AV）的浮点运算量"""
+        def estimate(args, kwargs):
+            hidden_states = args[0] if args else kwargs.get('hidden_states')
+            context = kwargs.get('encoder_hidden_states')
+            if context is None and len(args) > 1:
+                context = args[1]
+            if hidden_states is None or hidden_states.dim() != 3:
+                return
+            batch, query_len, _ = hidden_states.shape
+            key_len = context.shape[1] if context is not None else query_len
+            inner_dim = module.to_q.out_features
+            flops = 4 * batch * query_len * key_len * inner_dim
+            self._attention_estimates[name] = self._attention_estimates.get(name, 0.0) + flops
+        return estimate
+
+    def attach(self):
+        """注册钩子"""
+        def unet_pre_hook(module, args, kwargs):
+            self._step += 1
+            self._begin('unet')
+
+        def unet_post_hook(module, args, kwargs, output):
+            self._step_times.append(self._end('unet'))
+
+        self._hooks.append(self.unet.register_forward_pre_hook(unet_pre_hook, with_kwargs=True))
+        self._hooks.append(self.unet.register_forward_hook(unet_post_hook, with_kwargs=True))
+
+        for block in self.blocks:
+            self._register(self.unet.get_submodule(block), block)
+        for name in self.attention_modules:
+            module = self.unet.get_submodule(name)
+            self._register(module, f"attn:{name}", self._estimate_attention(name, module))
+
+    def detach(self):
+        """移除钩子"""
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks.clear()
+
+    @contextmanager
+    def profile(self):
+        """分析上下文：期间的UNet调用被记录，退出时生成报告（见 report）"""
+        self.attach()
+        try:
+            if self.record_flops:
+                activities = [torch.profiler.ProfilerActivity.CPU]
+                if self.device.type == 'cuda':
+                    activities.append(torch.profiler.ProfilerActivity.CUDA)
+                with torch.profiler.profile(activities=activities, with_flops=True) as profiler:
+                    self.profiler = profiler
+                    yield self
+            else:
+                yield self
+        finally:
+            self.detach()
+
+    def _collect_flops(self) -> Dict[str, float]:
+        """按分析标签汇总torch.profiler记录的FLOPs（计入该算子所在的所有标签）"""
+        flops: Dict[str, float] = {}
+        if self.profiler is None:
+            return flops
+
+        attention_has_matmul = set()
+        for event in self.profiler.events():
+            if not getattr(event, 'flops', 0):
+                continue
+            parent = event.cpu_parent
+            while parent is not None:
+                if parent.name.startswith(_LABEL_PREFIX):
+                    label = parent.name.split('::', 2)[2]
+                    flops[label] = flops.get(label, 0.0) + event.flops
+                    if label.startswith('attn:') and event.name in _ATTENTION_MATMUL_OPS:
+                        attention_has_matmul.add(label)
+                parent = parent.cpu_parent
+
+        # SDPA等融合注意力算子没有FLOPs统计，按形状估算并计入所属块
+        for name, estimate in self._attention_estimates.items():
+            label = f"attn:{name}"
+            if label in attention_has_matmul:
+                continue
+            flops[label] = flops.get(label, 0.0) + estimate
+            owner = UNetProfileReport._owner_block(name, self.blocks)
+            if owner is not None:
+                flops[owner] = flops.get(owner, 0.0) + estimate
+        return flops
+
+    def report(self) -> UNetProfileReport:
+        """生成分析报告"""
+        return UNetProfileReport(self.blocks, self._records, self._step_times, self._collect_flops())
+
+    def export_chrome_trace(self, path: str):
+        """导出torch.profiler的算子级Chrome trace（仅在统计FLOPs时可用）"""
+        if self.profiler is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self.profiler.export_chrome_trace(str(path))
@@ -0,0 +1,122 @@
+"""
+VAE分块编解码模块
+根据内存上限和输出分辨率自动选择VAE分块大小，使用diffusers内置的
+分块编解码（相邻分块重叠区域线性混合）生成高分辨率图像
+"""
+
+import logging
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# SD VAE解码器在全分辨率阶段每像素的激活占用估计（float32，字节）：
+# 128通道 x 4字节 x 约6个同时存活的张量（ResNet输入/输出、GroupNorm、上采样）
+DECODER_BYTES_PER_PIXEL_FP32 = 3072
+
+# VAE下采样倍数
+VAE_SCALE_FACTOR = 8
+
+# 分块大小候选步长，需为VAE下采样倍数的整数倍
+TILE_STEP = 64
+
+
+def estimate_vae_decode_bytes(width: int, height: int, dtype_bytes: int = 4) -> int:
+    """
+    估算单张图像VAE解码的峰值激活内存
+
+    包含全分辨率卷积激活，以及中间块在潜空间上的自注意力矩阵（随像素数平方增长，
+    是高分辨率下的主要内存来源）。
+
+    Args:
+        width: 图像宽度
+        height: 图像高度
+        dtype_bytes: VAE精度的字节数
+
+    Returns:
+        int: 估计字节数
+    """
+    pixels = width * height
+    conv_bytes = pixels * DECODER_BYTES_PER_PIXEL_FP32 * dtype_bytes // 4
+    latent_tokens = (width // VAE_SCALE_FACTOR) * (height // VAE_SCALE_FACTOR)
+    attention_bytes = latent_tokens ** 2 * dtype_bytes
+    return conv_bytes + attention_bytes
+
+
+def _tiled_decode_pixels(width: int, height: int, tile_size: int, overlap: float) -> int:
+    """分块解码实际处理的像素数（与diffusers分块遍历方式一致）"""
+    tile_latent = tile_size // VAE_SCALE_FACTOR
+    stride = max(1, int(tile_latent * (1 - overlap)))
+    total = 0
+    for dim_h in range(0, height // VAE_SCALE_FACTOR, stride):
+        for dim_w in range(0, width // VAE_SCALE_FACTOR, stride):
+            tile_h = min(tile_latent, height // VAE_SCALE_FACTOR - dim_h)
+            tile_w = min(tile_latent, width // VAE_SCALE_FACTOR - dim_w)
+            total += tile_h * tile_w
+    return total * VAE_SCALE_FACTOR ** 2
+
+
+def select_vae_tile_size(
+    width: int,
+    height: int,
+    memory_budget: int,
+    dtype_bytes: int = 4,
+    overlap: float = 0.25,
+    min_tile_size: int = 256,
+    max_tile_size: int = 1024
+) -> Optional[int]:
+    """
+    选择满足内存预算的分块大小
+
+    在预算内的候选分块中选择重复解码像素最少的一个（相同时取更大的分块），
+    避免略小于图像尺寸的分块造成大量重叠计算。
+
+    Args:
+        width: 输出图像宽度
+        height: 输出图像高度
+        memory_budget: VAE解码可用的内存（字节）
+        dtype_bytes: VAE精度的字节数
+        overlap: 相邻分块重叠比例
+        min_tile_size: 最小分块大小（像素）
+        max_tile_size: 最大分块大小（像素）
+
+    Returns:
+        Optional[int]: 分块大小（像素）；整图解码即可满足预算时返回None
+    """
+    if estimate_vae_decode_bytes(width, height, dtype_bytes) <= memory_budget:
+        return None
+
+    best_tile = None
+    best_cost = None
+    for tile_size in range(max_tile_size, min_tile_size - 1, -TILE_STEP):
+        if tile_size >= max(width, height):
+            continue
+        if estimate_vae_decode_bytes(tile_size, tile_size, dtype_bytes) > memory_budget:
+            continue
+        cost = _tiled_decode_pixels(width, height, tile_size, overlap)
+        if best_cost is None or cost < best_cost:
+            best_tile, best_cost = tile_size, cost
+
+    if best_tile is None:
+        logger.warning(f"内存预算不足以容纳最小VAE分块 {min_tile_size}px，仍使用最小分块")
+        return min_tile_size
+    return best_tile
+
+
+def configure_vae_tiling(vae: Any, tile_size: Optional[int], overlap: float = 0.25):
+    """
+    为VAE启用或关闭分块编解码
+
+    Args:
+        vae: AutoencoderKL实例
+        tile_size: 图像空间分块大小；为None时关闭分块
+        overlap: 相邻分块重叠比例，重叠区域线性混合以消除接缝
+    """
+    if tile_size is None:
+        vae.disable_tiling()
+        return
+
+    downsample = 2 ** (len(vae.config.block_out_channels) - 1)
+    vae.tile_sample_min_size = tile_size
+    vae.tile_latent_min_size = tile_size // downsample
+    vae.tile_overlap_factor = overlap
+    vae.enable_tiling()
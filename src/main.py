@@ -13,11 +13,11 @@ from typing import Optional
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
-from src.core.image_generator import ImageGenerator
-from src.utils.cad_processor import CADProcessor
-from src.ui.streamlit_app import run_streamlit_app
+# 注意：这里不导入ImageGenerator等重量级模块，
+# 它们在对应运行模式中按需导入，保证 --help 等命令快速启动
 
 # 配置日志
+Path('logs').mkdir(exist_ok=True)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -50,8 +50,8 @@ def setup_directories():
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description='GAT - AI辅助工业设计项目')
-    parser.add_argument('--mode', choices=['ui', 'cli', 'api'], default='ui',
-                       help='运行模式: ui(界面), cli(命令行), api(API服务)')
+    parser.add_argument('--mode', choices=['ui', 'cli', 'batch', 'api', 'snapshot'], default='ui',
+                       help='运行模式: ui(界面), cli(命令行), batch(清单批量运行), api(API服务), snapshot(生成模型快照)')
     parser.add_argument('--config', default='configs/config.yaml',
                        help='配置文件路径')
     parser.add_argument('--input', help='输入CAD文件路径')
@@ -62,6 +62,9 @@ def main():
                        help='使用的LoRA模型')
     parser.add_argument('--num-images', type=int, default=4,
                        help='生成图像数量')
+    parser.add_argument('--trace', help='CLI模式下将完整运行过程导出为Chrome trace JSON文件')
+    parser.add_argument('--manifest', help='batch模式的清单文件（CSV或JSONL）')
+    parser.add_argument('--job-store', help='batch模式的任务状态数据库，默认使用配置 output.batch.job_store')
     
     args = parser.parse_args()
     
@@ -83,10 +86,24 @@ def main():
             logger.info("启动命令行模式")
             run_cli_mode(args)
             
+        elif args.mode == 'batch':
+            # 清单批量运行
+            if not args.manifest:
+                logger.error("batch模式需要指定 --manifest 参数")
+                return
+            
+            logger.info("启动清单批量运行")
+            run_batch_mode(args)
+            
+        elif args.mode == 'snapshot':
+            # 生成模型快照
+            logger.info("生成模型快照")
+            run_snapshot_mode(args)
+            
         elif args.mode == 'api':
             # API服务模式
             logger.info("启动API服务")
-            run_api_mode()
+            run_api_mode(args)
             
     except Exception as e:
         logger.error(f"程序运行失败: {e}")
@@ -96,27 +113,49 @@ def main():
 def run_cli_mode(args):
     """运行命令行模式"""
     try:
-        # 初始化图像生成器
-        generator = ImageGenerator(args.config)
+        import dataclasses
+        from src.core.config import load_config
+        from src.core.image_generator import ImageGenerator
+        from src.utils.cad_processor import CADProcessor
+        from src.utils.tracing import get_tracer
         
-        # 处理CAD输入
-        cad_processor = CADProcessor()
-        cad_input = cad_processor.load_cad_file(args.input)
+        # 初始化图像生成器；--trace 需在加载模型前启用追踪，模型各阶段的追踪钩子才会安装
+        config = args.config
+        if args.trace:
+            config = load_config(args.config)
+            performance = config.performance
+            config = dataclasses.replace(config, performance=dataclasses.replace(
+                performance, tracing=dataclasses.replace(performance.tracing, enabled=True)
+            ))
+        generator = ImageGenerator(config)
+        tracer = get_tracer()
         
-        # 生成图像
-        result = generator.generate_from_cad(
-            cad_input=cad_input,
-            prompt=args.prompt,
-            lora_name=args.lora,
-            num_images=args.num_images
-        )
+        with tracer.trace('cli') as trace:
+            # 处理CAD输入
+            cad_processor = CADProcessor(generator.config.input.tessellation)
+            cad_input = cad_processor.load_cad_file(args.input)
+            
+            # 生成图像
+            result = generator.generate_from_cad(
+                cad_input=cad_input,
+                prompt=args.prompt,
+                lora_name=args.lora,
+                num_images=args.num_images
+            )
+            
+            # 保存图像
+            saved_paths = generator.save_images(
+                result['images'],
+                args.output,
+                prefix=f"generated_{args.lora}",
+                result=result
+            )
         
-        # 保存图像
-        saved_paths = generator.save_images(
-            result['images'],
-            args.output,
-            prefix=f"generated_{args.lora}"
-        )
+        if trace is not None:
+            for stage, seconds in trace.timings().items():
+                print(f"{stage:<24}{seconds:>10.3f}s")
+            if args.trace:
+                trace.export_chrome_trace(args.trace)
         
         logger.info(f"生成完成，图像保存在: {args.output}")
         for path in saved_paths:
@@ -127,13 +166,57 @@ def run_cli_mode(args):
         raise
 
 
-def run_api_mode():
+def run_batch_mode(args):
+    """按清单批量生成：模型只加载一次，中断后重新运行同一清单时跳过已完成的条目"""
+    try:
+        from src.core.batch_runner import BatchRunner
+        from src.core.image_generator import ImageGenerator
+        from src.core.job_store import JobStore
+        
+        generator = ImageGenerator(args.config)
+        output_config = generator.config.output
+        store = JobStore(args.job_store or output_config.batch.job_store)
+        
+        try:
+            runner = BatchRunner(generator, store, args.output, output_config)
+            summary = runner.run(args.manifest, default_lora=args.lora, default_num_images=args.num_images)
+            
+            for status, count in sorted(summary.items()):
+                print(f"{status:<12}{count:>8}")
+            for failure in store.failures(str(Path(args.manifest).resolve())):
+                print(f"失败: 第 {failure['line']} 行（尝试 {failure['attempts']} 次）: {failure['error']}")
+        finally:
+            store.close()
+        
+    except Exception as e:
+        logger.error(f"批量运行失败: {e}")
+        raise
+
+
+def run_snapshot_mode(args):
+    """加载模型并融合LoRA后保存快照，供工作进程快速启动"""
+    try:
+        from src.core.ai_engine import AIEngine
+        
+        engine = AIEngine(args.config)
+        if args.lora and not engine.load_lora(args.lora):
+            raise ValueError(f"LoRA模型 {args.lora} 加载失败")
+        
+        snapshot_path = engine.save_snapshot()
+        print(f"模型快照: {snapshot_path}")
+        
+    except Exception as e:
+        logger.error(f"模型快照生成失败: {e}")
+        raise
+
+
+def run_api_mode(args):
     """运行API服务模式"""
     try:
         from src.api.fastapi_app import create_app
         import uvicorn
         
-        app = create_app()
+        app = create_app(args.config)
         uvicorn.run(app, host="0.0.0.0", port=8000)
         
     except Exception as e:
@@ -10,14 +10,12 @@ import logging
 from pathlib import Path
 import sys
 import os
+import time
 
 # 添加项目根目录到Python路径
 project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from src.core.image_generator import ImageGenerator
-from src.utils.cad_processor import CADProcessor
-
 # 配置页面
 st.set_page_config(
     page_title="GAT - AI辅助工业设计",
@@ -33,29 +31,75 @@ logger = logging.getLogger(__name__)
 
 def initialize_session_state():
     """初始化会话状态"""
-    if 'generator' not in st.session_state:
-        st.session_state.generator = None
-    if 'cad_processor' not in st.session_state:
-        st.session_state.cad_processor = None
+    if 'job_queue' not in st.session_state:
+        st.session_state.job_queue = None
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = None
     if 'generated_images' not in st.session_state:
         st.session_state.generated_images = []
+    if 'generated_thumbnails' not in st.session_state:
+        st.session_state.generated_thumbnails = None
+    if 'generated_paths' not in st.session_state:
+        st.session_state.generated_paths = []
+    if 'download_cache' not in st.session_state:
+        st.session_state.download_cache = {}
     if 'generation_params' not in st.session_state:
         st.session_state.generation_params = {}
 
 
+@st.cache_resource(show_spinner="正在初始化AI引擎...")
+def get_job_queue():
+    """
+    进程级共享的图像生成器与任务队列
+    所有浏览器会话共用一套模型，生成任务由后台线程依次执行
+    """
+    # 延迟导入，页面首次渲染时不加载torch/diffusers
+    from src.core.image_generator import ImageGenerator
+    from src.core.job_queue import JobQueue
+    
+    generator = ImageGenerator()
+    config = generator.config
+    queue_config = config.ui.job_queue
+    return JobQueue(
+        generator,
+        max_pending=queue_config.max_pending,
+        preview_interval=queue_config.preview_interval,
+        abandon_after=queue_config.abandon_after,
+        output_dir=config.output.base_path if queue_config.save_outputs else None
+    )
+
+
+@st.cache_resource
+def get_output_index():
+    """结果索引（只读取配置和SQLite，不加载模型）；未启用时返回None"""
+    from src.core.config import load_config
+    from src.core.output_store import OutputIndex
+    
+    index_config = load_config().output.index
+    if not index_config.enabled:
+        return None
+    return OutputIndex(index_config.path)
+
+
 def load_components():
     """加载组件"""
     try:
-        if st.session_state.generator is None:
-            with st.spinner("正在初始化AI引擎..."):
-                st.session_state.generator = ImageGenerator()
-                st.session_state.cad_processor = CADProcessor()
+        if st.session_state.job_queue is None:
+            st.session_state.job_queue = get_job_queue()
         return True
     except Exception as e:
         st.error(f"组件加载失败: {e}")
         return False
 
 
+def rerun():
+    """重新运行脚本（兼容旧版本Streamlit）"""
+    if hasattr(st, 'rerun'):
+        st.rerun()
+    else:
+        st.experimental_rerun()
+
+
 def main():
     """主界面"""
     initialize_session_state()
@@ -69,8 +113,8 @@ def main():
         st.header("⚙️ 设置")
         
         # LoRA模型选择
-        if st.session_state.generator:
-            available_loras = st.session_state.generator.get_available_loras()
+        if st.session_state.job_queue:
+            available_loras = st.session_state.job_queue.generator.get_available_loras()
             selected_lora = st.selectbox(
                 "选择LoRA模型",
                 available_loras,
@@ -93,6 +137,8 @@ def main():
             guidance_scale = st.slider("引导强度", 1.0, 20.0, 7.5)
             num_inference_steps = st.slider("推理步数", 10, 50, 20)
             seed = st.number_input("随机种子", value=-1, help="-1表示随机")
+        
+        render_metrics_panel()
     
     # 主界面布局
     col1, col2 = st.columns([1, 1])
@@ -156,7 +202,9 @@ def main():
             
             # 准备输入
             if uploaded_file is not None:
+                # 立即读取像素数据，后台线程执行时不再依赖上传缓冲区
                 input_data = Image.open(uploaded_file)
+                input_data.load()
             else:
                 input_data = st.session_state.example_image
             
@@ -170,62 +218,217 @@ def main():
             if seed != -1:
                 generation_params['seed'] = seed
             
-            # 执行生成
-            with st.spinner("正在生成图像..."):
-                try:
-                    result = st.session_state.generator.generate_from_cad(
-                        cad_input=input_data,
-                        prompt=base_prompt,
-                        lora_name=selected_lora,
-                        controlnet_method=controlnet_method,
-                        num_images=num_images,
-                        **generation_params
-                    )
-                    
-                    st.session_state.generated_images = result['images']
-                    st.session_state.generation_params = result
-                    
-                    st.success(f"成功生成 {len(result['images'])} 张图像！")
-                    
-                except Exception as e:
-                    st.error(f"生成失败: {e}")
-                    logger.error(f"生成失败: {e}")
+            # 同一会话重新生成时取消尚未完成的旧任务
+            if st.session_state.job_id:
+                st.session_state.job_queue.cancel(st.session_state.job_id)
+            
+            # 提交到共享任务队列，由后台线程执行
+            try:
+                job = st.session_state.job_queue.submit(
+                    cad_input=input_data,
+                    prompt=base_prompt,
+                    lora_name=selected_lora,
+                    controlnet_method=controlnet_method,
+                    num_images=num_images,
+                    **generation_params
+                )
+                st.session_state.job_id = job.id
+            except Exception as e:
+                st.error(f"提交失败: {e}")
+                logger.error(f"提交失败: {e}")
+        
+        # 显示当前任务进度
+        job_active = render_job_status()
         
         # 显示生成结果
         if st.session_state.generated_images:
             st.subheader("🖼️ 生成结果")
             
-            # 显示图像网格
+            # 显示图像网格（有缩略图时只传输缩略图）
+            thumbnails = st.session_state.generated_thumbnails
             cols = st.columns(2)
             for i, image in enumerate(st.session_state.generated_images):
                 with cols[i % 2]:
-                    st.image(image, caption=f"生成图像 {i+1}", use_column_width=True)
+                    st.image(thumbnails[i] if thumbnails else image, caption=f"生成图像 {i+1}",
+                             use_column_width=True)
             
-            # 下载按钮
+            # 下载按钮：原图在请求下载时才编码，之后的重新运行复用编码结果
             st.subheader("💾 下载")
+            download_cache = st.session_state.download_cache
             for i, image in enumerate(st.session_state.generated_images):
-                st.download_button(
-                    label=f"下载图像 {i+1}",
-                    data=image_to_bytes(image),
-                    file_name=f"generated_{i+1}.png",
-                    mime="image/png"
-                )
+                if i in download_cache:
+                    st.download_button(
+                        label=f"下载图像 {i+1}",
+                        data=download_cache[i],
+                        file_name=f"generated_{i+1}.png",
+                        mime="image/png",
+                        key=f"download_{i}"
+                    )
+                elif st.button(f"准备下载图像 {i+1}", key=f"prepare_download_{i}"):
+                    download_cache[i] = full_resolution_bytes(i)
+                    rerun()
+        
+        render_history()
+        
+        # 任务未结束时定时刷新页面以更新进度和预览
+        if job_active:
+            # 读取生成器当前的配置，重新加载后的轮询间隔立即生效
+            time.sleep(st.session_state.job_queue.generator.config.ui.job_queue.poll_interval)
+            rerun()
+
+
+def render_job_status() -> bool:
+    """
+    显示当前会话任务的进度、预览和取消按钮
+
+    Returns:
+        bool: 任务是否仍在排队或执行中
+    """
+    from src.core.job_queue import JobStatus
     
-    # 底部信息
-    st.markdown("---")
-    st.markdown("### 📊 系统信息")
+    job_queue = st.session_state.job_queue
+    job = job_queue.get(st.session_state.job_id) if st.session_state.job_id else None
+    if job is None:
+        return False
     
-    col1, col2, col3 = st.columns(3)
+    # 页面关闭后不再轮询，任务会在 abandon_after 秒后被取消
+    job.heartbeat()
     
-    with col1:
-        st.metric("可用LoRA模型", len(available_loras) if st.session_state.generator else 0)
+    if job.status == JobStatus.COMPLETED:
+        st.session_state.generated_images = job.result['images']
+        st.session_state.generated_thumbnails = job.result.get('thumbnails')
+        st.session_state.generated_paths = job.saved_paths
+        st.session_state.download_cache = {}
+        st.session_state.generation_params = job.result
+        st.session_state.job_id = None
+        st.success(f"成功生成 {len(job.result['images'])} 张图像！")
+        return False
+    if job.status == JobStatus.FAILED:
+        st.session_state.job_id = None
+        st.error(f"生成失败: {job.error}")
+        return False
+    if job.status == JobStatus.CANCELLED:
+        st.session_state.job_id = None
+        st.info("生成已取消")
+        return False
+    if job.status == JobStatus.TIMEOUT:
+        st.session_state.job_id = None
+        st.warning("生成超时，已中止")
+        return False
+    
+    if job.status == JobStatus.QUEUED:
+        st.progress(0.0, text=f"排队中，前方还有 {job_queue.position(job.id) - 1} 个任务")
+    else:
+        st.progress(job.progress, text=f"正在生成: 第 {job.step}/{job.total_steps} 步")
+    
+    if job.previews:
+        cols = st.columns(min(len(job.previews), 4))
+        for i, preview in enumerate(job.previews):
+            with cols[i % len(cols)]:
+                st.image(preview, caption=f"预览 {i+1}", use_column_width=True)
+    
+    if st.button("⏹️ 取消生成"):
+        job_queue.cancel(job.id)
+    return True
+
+
+def render_history():
+    """历史结果：按提示词/LoRA/种子查询结果索引"""
+    index = get_output_index()
+    if index is None:
+        return
+    
+    with st.expander("🗂️ 历史结果"):
+        prompt_query = st.text_input("提示词包含", key="history_prompt")
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            lora = st.selectbox("LoRA", ["全部"] + index.loras(), key="history_lora")
+        with col2:
+            seed = st.number_input("种子", value=-1, help="-1表示不限", key="history_seed")
+        with col3:
+            limit = st.number_input("数量", min_value=1, max_value=200, value=12, key="history_limit")
+        
+        records = index.query(
+            prompt=prompt_query or None,
+            lora=None if lora == "全部" else lora,
+            seed=None if seed == -1 else int(seed),
+            limit=int(limit)
+        )
+        st.caption(f"共 {index.count()} 条记录，匹配 {len(records)} 条")
+        
+        cols = st.columns(3)
+        for i, record in enumerate(records):
+            with cols[i % 3]:
+                preview = record.get('thumbnail') or record['path']
+                if Path(preview).exists():
+                    st.image(preview, use_column_width=True)
+                st.caption(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(record['created_at']))} · "
+                           f"{record['lora']} · seed {record['seed']}")
+                if record['prompt']:
+                    st.text(record['prompt'][:80])
+
+
+def render_metrics_panel():
+    """侧边栏运行指标面板（数据来自进程内指标注册表）"""
+    from src.core.metrics import get_registry
+    from src.utils.memory_utils import format_memory_size
+    
+    st.subheader("📊 运行指标")
+    snapshot = get_registry().snapshot()
     
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("队列深度", int(snapshot['queue_depth']))
+        st.metric("成功请求", int(snapshot['requests'].get('success', 0)))
     with col2:
-        st.metric("生成图像数量", len(st.session_state.generated_images))
+        st.metric("请求/秒", f"{snapshot['requests_per_second']:.2f}")
+        st.metric("失败请求", int(snapshot['requests'].get('error', 0)))
+    
+    duration = snapshot['request_duration']
+    if duration:
+        st.metric("平均请求耗时", f"{duration['mean']:.2f}s", help=f"p95 ≤ {duration['p95']}s")
+    
+    memory = snapshot['memory_bytes']
+    if memory:
+        used = memory.get('process_rss', memory.get('registered', 0))
+        st.metric("内存用量", format_memory_size(used),
+                  help=f"预算 {format_memory_size(memory.get('budget', 0))}")
+    
+    with st.expander("阶段耗时"):
+        stages = snapshot['stage_duration']
+        if stages:
+            st.table({
+                '阶段': list(stages),
+                '平均(s)': [round(info['mean'], 3) for info in stages.values()],
+                'p95(s)': [info['p95'] for info in stages.values()],
+                '次数': [info['count'] for info in stages.values()],
+            })
+        else:
+            st.caption("暂无数据")
+    
+    with st.expander("缓存命中率"):
+        caches = snapshot['cache_hit_rates']
+        if caches:
+            for cache, info in caches.items():
+                st.text(f"{cache}: {info['hit_rate']:.0%} ({int(info['hits'])}/{int(info['requests'])})")
+        else:
+            st.caption("暂无数据")
     
-    with col3:
-        if st.session_state.generation_params:
-            st.metric("使用模型", st.session_state.generation_params.get('lora_used', 'N/A'))
+    with st.expander("各LoRA生成图像数"):
+        images = snapshot['images_generated']
+        if images:
+            for lora, count in images.items():
+                st.text(f"{lora}: {int(count)}")
+        else:
+            st.caption("暂无数据")
+
+
+def full_resolution_bytes(index: int) -> bytes:
+    """第 index 张生成图像的原图字节（已保存时直接读取文件，不重新编码）"""
+    paths = st.session_state.generated_paths
+    if index < len(paths) and paths[index].endswith('.png') and Path(paths[index]).exists():
+        return Path(paths[index]).read_bytes()
+    return image_to_bytes(st.session_state.generated_images[index])
 
 
 def image_to_bytes(image: Image.Image) -> bytes:
@@ -0,0 +1,3 @@
+"""
+GAT - AI辅助工业设计项目工具模块（CAD处理、B-rep细分、内存管理与性能追踪）
+"""
@@ -10,16 +10,47 @@ from pathlib import Path
 import numpy as np
 from PIL import Image
 
+from .tessellation import (
+    TessellationBackend,
+    TessellationCache,
+    get_tessellation_backend,
+    tolerance_for_resolution,
+)
+from .tracing import span
+from ..core.metrics import get_registry
+
 logger = logging.getLogger(__name__)
 
 
 class CADProcessor:
     """CAD文件处理器"""
     
-    def __init__(self):
-        """初始化CAD处理器"""
+    def __init__(self, tessellation_config: Optional[Dict] = None,
+                 tessellation_backend: Optional[TessellationBackend] = None):
+        """
+        初始化CAD处理器
+        
+        Args:
+            tessellation_config: B-rep细分配置（对应配置文件 input.tessellation）
+            tessellation_backend: 细分后端实例，为None时按配置自动选择
+        """
         self.supported_formats = ['.step', '.stp', '.iges', '.igs', '.obj', '.stl', '.ply']
         
+        config = tessellation_config or {}
+        self.render_resolution = config.get('render_resolution', 512)
+        self.pixel_error = config.get('pixel_error', 0.5)
+        self.angular_deflection = config.get('angular_deflection', 0.5)
+        self.tessellation_cache = TessellationCache(config.get('cache_dir', 'data/cache/tessellation'))
+        self._backend_name = config.get('backend', 'auto')
+        self._tessellation_backend = tessellation_backend
+        
+    @property
+    def tessellation_backend(self) -> Optional[TessellationBackend]:
+        """细分后端（首次使用时创建）"""
+        if self._tessellation_backend is None:
+            self._tessellation_backend = get_tessellation_backend(self._backend_name)
+        return self._tessellation_backend
+        
     def load_cad_file(self, file_path: Union[str, Path]) -> Union[np.ndarray, Image.Image]:
         """
         加载CAD文件
@@ -41,10 +72,11 @@ class CADProcessor:
                 raise ValueError(f"不支持的CAD格式: {file_path.suffix}")
             
             # 根据文件类型处理
-            if file_path.suffix.lower() in ['.obj', '.stl', '.ply']:
-                return self._load_mesh_file(file_path)
-            else:
-                return self._load_cad_file(file_path)
+            with span('cad_load', format=file_path.suffix.lower()):
+                if file_path.suffix.lower() in ['.obj', '.stl', '.ply']:
+                    return self._load_mesh_file(file_path)
+                else:
+                    return self._load_cad_file(file_path)
                 
         except Exception as e:
             logger.error(f"CAD文件加载失败: {e}")
@@ -58,15 +90,7 @@ class CADProcessor:
             # 加载网格
             mesh = trimesh.load(str(file_path))
             
-            # 渲染为图像
-            scene = trimesh.Scene(mesh)
-            image = scene.save_image(resolution=[512, 512])
-            
-            # 转换为numpy数组
-            image_array = np.frombuffer(image, dtype=np.uint8)
-            image_array = image_array.reshape((512, 512, 3))
-            
-            return image_array
+            return self._render_mesh(mesh)
             
         except ImportError:
             logger.warning("trimesh未安装，使用简单处理")
@@ -75,22 +99,83 @@ class CADProcessor:
             logger.error(f"网格文件加载失败: {e}")
             return self._create_placeholder_image()
     
+    def _render_mesh(self, mesh) -> np.ndarray:
+        """将网格渲染为RGB图像"""
+        import io
+        import trimesh
+        
+        resolution = self.render_resolution
+        with span('cad_render', resolution=resolution):
+            scene = trimesh.Scene(mesh)
+            png_bytes = scene.save_image(resolution=[resolution, resolution])
+            
+            # save_image返回PNG编码数据，需要解码
+            image = Image.open(io.BytesIO(png_bytes)).convert('RGB')
+            return np.array(image)
+    
     def _load_cad_file(self, file_path: Path) -> np.ndarray:
         """加载CAD文件（STEP, IGES等）"""
         try:
-            # 这里需要集成专业的CAD库（如FreeCAD, OpenCASCADE等）
-            # 暂时返回占位符图像
-            logger.warning(f"CAD文件 {file_path.suffix} 处理功能待实现")
-            return self._create_placeholder_image()
+            # 先查细分缓存，未安装细分后端时缓存命中的文件仍可渲染
+            mesh = self.tessellate_cad_file(file_path)
+            return self._render_mesh(mesh.to_trimesh())
             
+        except ImportError as e:
+            logger.warning(f"{e}，无法处理 {file_path.suffix} 文件")
+            return self._create_placeholder_image()
         except Exception as e:
             logger.error(f"CAD文件加载失败: {e}")
             return self._create_placeholder_image()
     
+    def tessellate_cad_file(self, file_path: Union[str, Path],
+                            resolution: Optional[int] = None):
+        """
+        细分B-rep CAD文件，优先读取磁盘缓存
+        
+        Args:
+            file_path: STEP/IGES文件路径
+            resolution: 目标渲染分辨率，决定细分精度；默认使用配置值
+            
+        Returns:
+            TessellatedMesh: 细分后的三角网格
+        """
+        file_path = Path(file_path)
+        relative_deflection = tolerance_for_resolution(
+            resolution or self.render_resolution, self.pixel_error
+        )
+        
+        file_hash = self.tessellation_cache.file_hash(file_path)
+        cache_key = self.tessellation_cache.make_key(
+            file_hash, relative_deflection, self.angular_deflection
+        )
+        
+        mesh = self.tessellation_cache.get(cache_key)
+        get_registry().record_cache('tessellation', mesh is not None)
+        if mesh is not None:
+            logger.info(f"细分缓存命中: {file_path.name}")
+            return mesh
+        
+        backend = self.tessellation_backend
+        if backend is None:
+            raise ImportError("未安装B-rep细分后端（pythonocc-core/FreeCAD）")
+        
+        logger.info(f"细分CAD文件: {file_path.name} (后端: {backend.name}, 相对误差: {relative_deflection})")
+        with span('cad_tessellate', backend=backend.name):
+            mesh = backend.tessellate(file_path, relative_deflection, self.angular_deflection)
+        
+        try:
+            self.tessellation_cache.put(cache_key, mesh)
+        except Exception as e:
+            logger.warning(f"细分缓存写入失败: {e}")
+        
+        logger.info(f"细分完成，共 {mesh.num_faces} 个三角面")
+        return mesh
+    
     def _create_placeholder_image(self) -> np.ndarray:
         """创建占位符图像"""
         # 创建一个简单的占位符图像
-        image = np.ones((512, 512, 3), dtype=np.uint8) * 255
+        resolution = self.render_resolution
+        image = np.ones((resolution, resolution, 3), dtype=np.uint8) * 255
         return image
     
     def extract_six_views(self, cad_file: Union[str, Path]) -> Dict[str, np.ndarray]:
@@ -119,24 +204,24 @@ class CADProcessor:
             logger.error(f"六视图提取失败: {e}")
             raise
     
-    def preprocess_image(self, image: np.ndarray, target_size: tuple = (512, 512)) -> np.ndarray:
+    def preprocess_image(self, image: np.ndarray, target_size: Optional[tuple] = None) -> np.ndarray:
         """
         预处理图像
         
+        输出分辨率由生成器按长宽比选择分桶后统一缩放，这里默认保持原尺寸，避免重复缩放。
+        
         Args:
             image: 输入图像
-            target_size: 目标尺寸
+            target_size: 目标尺寸 (宽, 高)；提供时按比例缩放并以背景色填充，不拉伸
             
         Returns:
             np.ndarray: 预处理后的图像
         """
         try:
             # 调整尺寸
-            if image.shape[:2] != target_size:
-                from PIL import Image
-                pil_image = Image.fromarray(image)
-                pil_image = pil_image.resize(target_size, Image.Resampling.LANCZOS)
-                image = np.array(pil_image)
+            if target_size is not None and image.shape[1::-1] != tuple(target_size):
+                from ..core.resolution_buckets import fit_to_size
+                image = fit_to_size(image, tuple(target_size))
             
             # 归一化
             if image.dtype != np.uint8:
@@ -0,0 +1,69 @@
+"""
+内存工具函数
+负责解析配置中的内存大小字符串等通用内存相关计算
+"""
+
+import os
+import re
+from typing import Optional, Union
+
+_SIZE_UNITS = {
+    '': 1,
+    'B': 1,
+    'KB': 1024,
+    'MB': 1024 ** 2,
+    'GB': 1024 ** 3,
+    'TB': 1024 ** 4,
+}
+
+_SIZE_PATTERN = re.compile(r'^\s*([\d.]+)\s*([KMGT]?B?)\s*$', re.IGNORECASE)
+
+
+def parse_memory_size(size: Union[str, int, float]) -> int:
+    """
+    解析内存大小配置
+
+    Args:
+        size: 大小，如 "8GB"、"512MB"、"1.5G" 或字节数
+
+    Returns:
+        int: 字节数
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    match = _SIZE_PATTERN.match(size)
+    if not match:
+        raise ValueError(f"无法解析的内存大小: {size}")
+
+    value, unit = match.groups()
+    unit = unit.upper()
+    if unit and not unit.endswith('B'):
+        unit += 'B'
+    return int(float(value) * _SIZE_UNITS[unit])
+
+
+def format_memory_size(num_bytes: Union[int, float]) -> str:
+    """将字节数格式化为可读字符串"""
+    value = float(num_bytes)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024:
+            return f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TB"
+
+
+def process_rss_bytes() -> Optional[int]:
+    """当前进程的常驻内存（RSS），无法获取时返回None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,340 @@
+"""
+B-rep曲面细分模块
+负责将STEP/IGES等B-rep模型细分为三角网格，并缓存细分结果
+
+细分后端是可插拔的：安装了pythonocc-core或FreeCAD时使用对应适配器，
+测试环境可使用StubTessellationBackend。细分精度由目标渲染分辨率推导，
+结果以压缩的npz格式按 文件哈希 + 精度 缓存到磁盘。
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Type, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 缓存格式版本，网格编码方式变化时递增以使旧缓存失效
+CACHE_FORMAT_VERSION = 1
+
+
+class TessellatedMesh:
+    """细分得到的三角网格"""
+
+    def __init__(self, vertices: np.ndarray, faces: np.ndarray):
+        """
+        初始化三角网格
+
+        Args:
+            vertices: 顶点坐标 (N, 3)
+            faces: 三角面顶点索引 (M, 3)
+        """
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+        self.faces = np.ascontiguousarray(faces, dtype=np.uint32).reshape(-1, 3)
+
+    @property
+    def num_faces(self) -> int:
+        """三角面数量"""
+        return len(self.faces)
+
+    def to_trimesh(self):
+        """转换为trimesh网格对象"""
+        import trimesh
+
+        return trimesh.Trimesh(vertices=self.vertices, faces=self.faces, process=False)
+
+
+def tolerance_for_resolution(resolution: int, pixel_error: float = 0.5) -> float:
+    """
+    根据目标渲染分辨率计算相对弦高误差
+
+    模型包围盒对角线大致铺满画面，因此允许的弦高误差为对角线的
+    pixel_error / resolution。结果保留两位有效数字，避免相近的分辨率
+    产生大量不同的缓存条目。
+
+    Args:
+        resolution: 目标渲染分辨率（像素）
+        pixel_error: 允许的屏幕空间误差（像素）
+
+    Returns:
+        float: 相对包围盒对角线的弦高误差
+    """
+    if resolution <= 0:
+        raise ValueError(f"无效的渲染分辨率: {resolution}")
+    tolerance = pixel_error / float(resolution)
+    return float(f"{tolerance:.2g}")
+
+
+class TessellationBackend:
+    """B-rep细分后端基类"""
+
+    name = "base"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """检查后端依赖是否已安装"""
+        return False
+
+    def tessellate(self, file_path: Path, relative_deflection: float,
+                   angular_deflection: float = 0.5) -> TessellatedMesh:
+        """
+        细分CAD文件
+
+        Args:
+            file_path: STEP/IGES文件路径
+            relative_deflection: 相对包围盒对角线的弦高误差
+            angular_deflection: 角度误差（弧度）
+
+        Returns:
+            TessellatedMesh: 细分后的三角网格
+        """
+        raise NotImplementedError
+
+
+class OCCTessellationBackend(TessellationBackend):
+    """基于pythonocc-core (OpenCASCADE) 的细分后端"""
+
+    name = "occ"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            import OCC.Core.BRepMesh  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def _read_shape(self, file_path: Path):
+        """读取STEP/IGES形状"""
+        from OCC.Core.IFSelect import IFSelect_RetDone
+
+        if file_path.suffix.lower() in ['.step', '.stp']:
+            from OCC.Core.STEPControl import STEPControl_Reader
+            reader = STEPControl_Reader()
+        else:
+            from OCC.Core.IGESControl import IGESControl_Reader
+            reader = IGESControl_Reader()
+
+        status = reader.ReadFile(str(file_path))
+        if status != IFSelect_RetDone:
+            raise ValueError(f"无法读取CAD文件: {file_path}")
+
+        reader.TransferRoots()
+        return reader.OneShape()
+
+    def tessellate(self, file_path: Path, relative_deflection: float,
+                   angular_deflection: float = 0.5) -> TessellatedMesh:
+        from OCC.Core.Bnd import Bnd_Box
+        from OCC.Core.BRep import BRep_Tool
+        from OCC.Core.BRepBndLib import brepbndlib
+        from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+        from OCC.Core.TopAbs import TopAbs_FACE, TopAbs_REVERSED
+        from OCC.Core.TopExp import TopExp_Explorer
+        from OCC.Core.TopLoc import TopLoc_Location
+        from OCC.Core.TopoDS import topods
+
+        shape = self._read_shape(file_path)
+
+        # 由包围盒对角线换算绝对弦高误差
+        box = Bnd_Box()
+        brepbndlib.Add(shape, box)
+        xmin, ymin, zmin, xmax, ymax, zmax = box.Get()
+        diagonal = float(np.linalg.norm([xmax - xmin, ymax - ymin, zmax - zmin])) or 1.0
+        linear_deflection = diagonal * relative_deflection
+
+        mesher = BRepMesh_IncrementalMesh(shape, linear_deflection, False, angular_deflection, True)
+        mesher.Perform()
+
+        vertices = []
+        faces = []
+        offset = 0
+        explorer = TopExp_Explorer(shape, TopAbs_FACE)
+        while explorer.More():
+            face = topods.Face(explorer.Current())
+            location = TopLoc_Location()
+            triangulation = BRep_Tool.Triangulation(face, location)
+            explorer.Next()
+            if triangulation is None:
+                continue
+
+            transform = location.Transformation()
+            for i in range(1, triangulation.NbNodes() + 1):
+                point = triangulation.Node(i).Transformed(transform)
+                vertices.append((point.X(), point.Y(), point.Z()))
+
+            reversed_face = face.Orientation() == TopAbs_REVERSED
+            for i in range(1, triangulation.NbTriangles() + 1):
+                n1, n2, n3 = triangulation.Triangle(i).Get()
+                if reversed_face:
+                    n2, n3 = n3, n2
+                faces.append((n1 - 1 + offset, n2 - 1 + offset, n3 - 1 + offset))
+
+            offset += triangulation.NbNodes()
+
+        if not faces:
+            raise ValueError(f"CAD文件细分结果为空: {file_path}")
+
+        return TessellatedMesh(np.array(vertices), np.array(faces))
+
+
+class FreeCADTessellationBackend(TessellationBackend):
+    """基于FreeCAD Part模块的细分后端"""
+
+    name = "freecad"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            import FreeCAD  # noqa: F401
+            import MeshPart  # noqa: F401
+            import Part  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def tessellate(self, file_path: Path, relative_deflection: float,
+                   angular_deflection: float = 0.5) -> TessellatedMesh:
+        import MeshPart
+        import Part
+
+        shape = Part.Shape()
+        shape.read(str(file_path))
+
+        # Shape.tessellate 只接受线性误差，角度误差需经 MeshPart 传入
+        diagonal = shape.BoundBox.DiagonalLength or 1.0
+        mesh = MeshPart.meshFromShape(
+            Shape=shape,
+            LinearDeflection=diagonal * relative_deflection,
+            AngularDeflection=angular_deflection,
+        )
+        points, triangles = mesh.Topology
+        if not triangles:
+            raise ValueError(f"CAD文件细分结果为空: {file_path}")
+
+        vertices = np.array([(p.x, p.y, p.z) for p in points])
+        return TessellatedMesh(vertices, np.array(triangles))
+
+
+class StubTessellationBackend(TessellationBackend):
+    """测试用细分后端，返回单位立方体并记录调用次数"""
+
+    name = "stub"
+
+    def __init__(self):
+        self.calls = 0
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    def tessellate(self, file_path: Path, relative_deflection: float,
+                   angular_deflection: float = 0.5) -> TessellatedMesh:
+        self.calls += 1
+        vertices = np.array([
+            [0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+            [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]
+        ])
+        faces = np.array([
+            [0, 2, 1], [0, 3, 2], [4, 5, 6], [4, 6, 7],
+            [0, 1, 5], [0, 5, 4], [2, 3, 7], [2, 7, 6],
+            [1, 2, 6], [1, 6, 5], [0, 4, 7], [0, 7, 3]
+        ])
+        return TessellatedMesh(vertices, faces)
+
+
+# 已注册的细分后端，auto模式按顺序选择第一个可用后端
+TESSELLATION_BACKENDS: Dict[str, Type[TessellationBackend]] = {
+    'occ': OCCTessellationBackend,
+    'freecad': FreeCADTessellationBackend,
+    'stub': StubTessellationBackend,
+}
+
+
+def get_tessellation_backend(name: str = "auto") -> Optional[TessellationBackend]:
+    """
+    获取细分后端实例
+
+    Args:
+        name: 后端名称 (auto, occ, freecad, stub)
+
+    Returns:
+        Optional[TessellationBackend]: 后端实例，auto模式下无可用后端时返回None
+    """
+    if name == "auto":
+        for backend_name in ('occ', 'freecad'):
+            backend_cls = TESSELLATION_BACKENDS[backend_name]
+            if backend_cls.is_available():
+                logger.info(f"使用细分后端: {backend_name}")
+                return backend_cls()
+        return None
+
+    if name not in TESSELLATION_BACKENDS:
+        raise ValueError(f"不支持的细分后端: {name}")
+
+    backend_cls = TESSELLATION_BACKENDS[name]
+    if not backend_cls.is_available():
+        raise ImportError(f"细分后端 {name} 的依赖未安装")
+    return backend_cls()
+
+
+class TessellationCache:
+    """细分结果磁盘缓存，按 文件哈希 + 精度 索引"""
+
+    def __init__(self, cache_dir: Union[str, Path] = "data/cache/tessellation"):
+        """
+        初始化细分缓存
+
+        Args:
+            cache_dir: 缓存目录
+        """
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def file_hash(file_path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+        """计算文件内容的SHA-256哈希"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def make_key(self, file_hash: str, relative_deflection: float,
+                 angular_deflection: float) -> str:
+        """生成缓存键"""
+        return f"{file_hash}_{relative_deflection:.2g}_{angular_deflection:.2g}_v{CACHE_FORMAT_VERSION}"
+
+    def _entry_path(self, key: str) -> Path:
+        # 按哈希前两位分目录，避免单目录文件过多
+        return self.cache_dir / key[:2] / f"{key}.npz"
+
+    def get(self, key: str) -> Optional[TessellatedMesh]:
+        """读取缓存的网格，未命中返回None"""
+        entry_path = self._entry_path(key)
+        if not entry_path.exists():
+            return None
+
+        try:
+            with np.load(entry_path) as data:
+                return TessellatedMesh(data['vertices'], data['faces'])
+        except Exception as e:
+            logger.warning(f"细分缓存读取失败，将重新细分: {e}")
+            return None
+
+    def put(self, key: str, mesh: TessellatedMesh):
+        """写入网格缓存（先写临时文件再原子替换）"""
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=entry_path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, vertices=mesh.vertices, faces=mesh.faces)
+            os.replace(tmp_path, entry_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,330 @@
+"""
+轻量级追踪工具
+以上下文管理器形式记录各处理阶段（LoRA加载、CAD预处理、文本编码、去噪、VAE解码、
+后处理、保存等）的耗时和内存，汇总到生成结果中，并可导出为Chrome trace JSON
+（在 chrome://tracing 或 Perfetto 中查看）。
+
+未启用或当前线程没有活动的追踪时，span() 返回共享的空上下文，开销接近于零。
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from .memory_utils import process_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class _NullSpan:
+    """禁用追踪时返回的空上下文"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _cuda_ready() -> bool:
+    """torch已导入且CUDA可用（不主动导入torch）"""
+    torch = sys.modules.get('torch')
+    return torch is not None and torch.cuda.is_available()
+
+
+class Span:
+    """一个已完成或进行中的阶段记录"""
+
+    __slots__ = ('name', 'category', 'start_ns', 'end_ns', 'thread_id', 'args', 'rss_bytes')
+
+    def __init__(self, name: str, category: str, args: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.category = category
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.thread_id = threading.get_ident()
+        self.args = args or {}
+        self.rss_bytes = None
+
+    @property
+    def duration(self) -> float:
+        """耗时（秒），未结束时为0"""
+        if self.end_ns is None:
+            return 0.0
+        return (self.end_ns - self.start_ns) / 1e9
+
+
+class Trace:
+    """一次请求内记录的全部阶段"""
+
+    def __init__(self, name: str, parent: Optional["Trace"] = None):
+        self.name = name
+        self.parent = parent
+        self.spans: List[Span] = []
+        self.root = Span(name, 'request')
+        self.peak_rss_bytes = process_rss_bytes()
+        self.peak_cuda_bytes = None
+        self._lock = threading.Lock()
+
+        if parent is None and _cuda_ready():
+            import torch
+            torch.cuda.reset_peak_memory_stats()
+
+    def add(self, span: Span):
+        """记录已结束的阶段并更新峰值内存"""
+        span.rss_bytes = process_rss_bytes()
+        with self._lock:
+            self.spans.append(span)
+            if span.rss_bytes is not None and (self.peak_rss_bytes is None or span.rss_bytes > self.peak_rss_bytes):
+                self.peak_rss_bytes = span.rss_bytes
+
+    def merge(self, child: "Trace"):
+        """并入已结束的嵌套追踪"""
+        with self._lock:
+            self.spans.append(child.root)
+            self.spans.extend(child.spans)
+            if child.peak_rss_bytes is not None and (self.peak_rss_bytes is None
+                                                     or child.peak_rss_bytes > self.peak_rss_bytes):
+                self.peak_rss_bytes = child.peak_rss_bytes
+
+    def finish(self):
+        """结束追踪，嵌套追踪的阶段并入上层追踪"""
+        self.root.end_ns = time.perf_counter_ns()
+        if _cuda_ready():
+            import torch
+            self.peak_cuda_bytes = torch.cuda.max_memory_allocated()
+
+        if self.parent is not None:
+            self.parent.merge(self)
+
+    @property
+    def duration(self) -> float:
+        """总耗时（秒）"""
+        return self.root.duration
+
+    def timings(self) -> Dict[str, float]:
+        """
+        各阶段耗时汇总
+
+        Returns:
+            Dict[str, float]: 阶段名称 -> 累计耗时（秒），按首次出现顺序排列；
+                多次出现的阶段（如逐步去噪）累加，total为整个请求耗时
+        """
+        totals: "OrderedDict[str, float]" = OrderedDict()
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        result = {name: round(seconds, 4) for name, seconds in totals.items()}
+        result['total'] = round(self.duration, 4)
+        return result
+
+    def counts(self) -> Dict[str, int]:
+        """各阶段出现次数"""
+        counts: Dict[str, int] = {}
+        for span in self.spans:
+            counts[span.name] = counts.get(span.name, 0) + 1
+        return counts
+
+    def peak_memory(self) -> Dict[str, Optional[int]]:
+        """
+        请求期间的峰值内存
+
+        Returns:
+            Dict: rss_bytes为阶段边界采样到的进程RSS峰值，cuda_bytes为CUDA显存分配峰值
+        """
+        return {'rss_bytes': self.peak_rss_bytes, 'cuda_bytes': self.peak_cuda_bytes}
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """转换为Chrome trace事件格式（完整事件 ph=X，时间单位微秒）"""
+        pid = os.getpid()
+        origin = self.root.start_ns
+        events = []
+        for span in [self.root] + self.spans:
+            if span.end_ns is None:
+                continue
+            args = dict(span.args)
+            if span.rss_bytes is not None:
+                args['rss_bytes'] = span.rss_bytes
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': (span.start_ns - origin) / 1000,
+                'dur': (span.end_ns - span.start_ns) / 1000,
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path: Union[str, Path]) -> Path:
+        """
+        导出Chrome trace JSON文件
+
+        Args:
+            path: 输出文件路径
+
+        Returns:
+            Path: 输出文件路径
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_chrome_trace()), encoding='utf-8')
+        logger.info(f"Chrome trace已导出: {path}")
+        return path
+
+
+class Tracer:
+    """追踪器，按线程维护当前活动的追踪"""
+
+    def __init__(self, enabled: bool = False, sync_cuda: bool = False):
+        """
+        初始化追踪器
+
+        Args:
+            enabled: 是否启用
+            sync_cuda: 阶段边界是否同步CUDA（计时准确但会阻塞异步执行）
+        """
+        self.enabled = enabled
+        self.sync_cuda = sync_cuda
+        self._local = threading.local()
+
+    def configure(self, tracing_config: Dict):
+        """
+        按配置更新追踪器（对应配置文件 performance.tracing）
+
+        Args:
+            tracing_config: 追踪配置
+        """
+        self.enabled = tracing_config.get('enabled', False)
+        self.sync_cuda = tracing_config.get('sync_cuda', False)
+
+    def current(self) -> Optional[Trace]:
+        """当前线程活动的追踪"""
+        return getattr(self._local, 'trace', None)
+
+    @contextmanager
+    def trace(self, name: str) -> Iterator[Optional[Trace]]:
+        """
+        开始一次追踪（通常对应一次生成请求），嵌套使用时内层阶段同时计入外层
+
+        Args:
+            name: 追踪名称
+
+        Yields:
+            Trace: 追踪对象；未启用时为None
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        parent = self.current()
+        trace = Trace(name, parent)
+        self._local.trace = trace
+        try:
+            yield trace
+        finally:
+            trace.finish()
+            self._local.trace = parent
+
+    @contextmanager
+    def suspend(self):
+        """暂停当前线程的追踪（如预热推理不计入请求耗时）"""
+        trace = self.current()
+        self._local.trace = None
+        try:
+            yield
+        finally:
+            self._local.trace = trace
+
+    def span(self, name: str, category: str = 'stage', **args):
+        """
+        记录一个阶段
+
+        Args:
+            name: 阶段名称
+            category: 阶段类别（Chrome trace中的cat字段）
+            **args: 附加到trace事件的参数
+
+        Returns:
+            上下文管理器；未启用或没有活动追踪时为共享的空上下文
+        """
+        if not self.enabled or self.current() is None:
+            return _NULL_SPAN
+        return self._span(name, category, args)
+
+    @contextmanager
+    def _span(self, name: str, category: str, args: Dict[str, Any]):
+        span = self.begin(name, category, **args)
+        try:
+            yield span
+        finally:
+            self.end(span)
+
+    def begin(self, name: str, category: str = 'stage', **args) -> Optional[Span]:
+        """开始一个阶段（用于无法使用with语句的场景，如模块前向钩子）"""
+        if not self.enabled or self.current() is None:
+            return None
+        if self.sync_cuda and _cuda_ready():
+            import torch
+            torch.cuda.synchronize()
+        return Span(name, category, args)
+
+    def end(self, span: Optional[Span]):
+        """结束由begin开始的阶段"""
+        if span is None:
+            return
+        if self.sync_cuda and _cuda_ready():
+            import torch
+            torch.cuda.synchronize()
+        span.end_ns = time.perf_counter_ns()
+        trace = self.current()
+        if trace is not None:
+            trace.add(span)
+
+    def instrument_module(self, module: Any, name: str, category: str = 'model') -> List[Any]:
+        """
+        通过前向钩子记录torch模块每次前向计算的耗时
+
+        Args:
+            module: torch模块
+            name: 阶段名称
+            category: 阶段类别
+
+        Returns:
+            List: 钩子句柄，调用remove()移除
+        """
+        open_spans: List[Optional[Span]] = []
+
+        def pre_hook(*_):
+            open_spans.append(self.begin(name, category))
+
+        def post_hook(*_):
+            if open_spans:
+                self.end(open_spans.pop())
+
+        return [module.register_forward_pre_hook(pre_hook), module.register_forward_hook(post_hook)]
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """进程级共享追踪器"""
+    return _tracer
+
+
+def span(name: str, category: str = 'stage', **args):
+    """在共享追踪器上记录一个阶段，见 Tracer.span"""
+    return _tracer.span(name, category, **args)
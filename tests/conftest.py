@@ -0,0 +1,64 @@
+"""
+测试公共夹具
+在临时目录生成 benchmarks/tiny_models.py 的微型模型，整个测试会话共用一个图像生成器。
+未安装 torch/diffusers/opencv 时跳过依赖模型的测试。
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+
+def wait_for(predicate, timeout: float, interval: float = 0.01) -> bool:
+    """轮询直到条件成立或超时，返回条件是否成立"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+@pytest.fixture(scope='session')
+def tiny_config(tmp_path_factory) -> Path:
+    """微型模型的配置文件路径"""
+    pytest.importorskip('torch')
+    pytest.importorskip('diffusers')
+    pytest.importorskip('cv2')
+    from benchmarks.tiny_models import build_all
+
+    return build_all(tmp_path_factory.mktemp('tiny'))
+
+
+@pytest.fixture(scope='session')
+def generator(tiny_config):
+    """加载微型模型的图像生成器"""
+    from src.core.image_generator import ImageGenerator
+
+    generator = ImageGenerator(str(tiny_config))
+    yield generator
+    generator.cleanup()
+
+
+@pytest.fixture(scope='session')
+def request_params():
+    """generate_from_cad 的公共参数（合成线稿 + 微型LoRA）"""
+    from benchmarks.suite import PROMPT, control_image
+    from benchmarks.tiny_models import TINY_LORAS
+
+    return {
+        'cad_input': control_image(),
+        'prompt': PROMPT,
+        'lora_name': next(iter(TINY_LORAS)),
+        'num_images': 1,
+        'seed': 42,
+    }
@@ -0,0 +1,98 @@
+"""
+取消与截止时间测试
+在微型模型上验证排队中取消、执行中取消和截止时间：任务状态正确，
+工作线程随即释放，排在其后的任务照常执行。
+"""
+
+import time
+
+import pytest
+
+from conftest import wait_for
+
+# 被取消任务的推理步数（足够在执行中途取消）与排在其后的任务的推理步数
+LONG_STEPS = 200
+SHORT_STEPS = 2
+
+# 等待任务结束的上限（秒），只用于防止测试挂起
+WAIT_TIMEOUT = 120
+
+
+@pytest.fixture
+def job_queue(generator):
+    from src.core.job_queue import JobQueue
+
+    queue = JobQueue(generator, preview_interval=0)
+    yield queue
+    queue.stop()
+
+
+def test_cancel_while_queued(job_queue, request_params):
+    from src.core.job_queue import JobStatus
+
+    running = job_queue.submit(**request_params, num_inference_steps=SHORT_STEPS)
+    cancelled = job_queue.submit(**request_params, num_inference_steps=SHORT_STEPS)
+    assert job_queue.cancel(cancelled.id)
+    following = job_queue.submit(**request_params, num_inference_steps=SHORT_STEPS)
+
+    assert wait_for(lambda: following.finished, WAIT_TIMEOUT)
+    assert running.status == JobStatus.COMPLETED
+    assert cancelled.status == JobStatus.CANCELLED
+    assert cancelled.started_at is None and cancelled.step == 0
+    assert following.status == JobStatus.COMPLETED
+    assert len(following.result['images']) == 1
+
+
+def test_cancel_mid_run(job_queue, request_params):
+    from src.core.job_queue import JobStatus
+
+    long_job = job_queue.submit(**request_params, num_inference_steps=LONG_STEPS)
+    short_job = job_queue.submit(**request_params, num_inference_steps=SHORT_STEPS)
+    assert wait_for(lambda: long_job.step >= 2, WAIT_TIMEOUT)
+
+    assert job_queue.cancel(long_job.id)
+    assert wait_for(lambda: long_job.finished, WAIT_TIMEOUT)
+    assert long_job.status == JobStatus.CANCELLED
+    assert long_job.step < LONG_STEPS
+    assert long_job.result is None and long_job.previews == []
+    assert not job_queue.cancel(long_job.id)
+
+    # 工作线程已释放：短任务在长任务结束后开始并正常完成
+    assert wait_for(lambda: short_job.finished, WAIT_TIMEOUT)
+    assert short_job.status == JobStatus.COMPLETED
+    assert short_job.started_at >= long_job.finished_at
+
+
+def test_deadline_while_queued(job_queue, request_params):
+    from src.core.job_queue import JobStatus
+
+    running = job_queue.submit(**request_params, num_inference_steps=SHORT_STEPS)
+    expired = job_queue.submit(**request_params, num_inference_steps=SHORT_STEPS, timeout=1e-3)
+    following = job_queue.submit(**request_params, num_inference_steps=SHORT_STEPS)
+
+    assert wait_for(lambda: following.finished, WAIT_TIMEOUT)
+    assert running.status == JobStatus.COMPLETED
+    assert expired.status == JobStatus.TIMEOUT
+    assert expired.started_at is None
+    assert following.status == JobStatus.COMPLETED
+
+
+def test_deadline_mid_run(generator, job_queue, request_params):
+    from src.core.cancellation import DeadlineExceeded
+    from src.core.job_queue import JobStatus
+
+    # 以完整耗时的一半作为截止时间，生成必然在中途中止
+    generator.generate_from_cad(**request_params, num_inference_steps=SHORT_STEPS)
+    start = time.perf_counter()
+    generator.generate_from_cad(**request_params, num_inference_steps=LONG_STEPS)
+    timeout = (time.perf_counter() - start) / 2
+
+    with pytest.raises(DeadlineExceeded):
+        generator.generate_from_cad(**request_params, num_inference_steps=LONG_STEPS, timeout=timeout)
+
+    expired = job_queue.submit(**request_params, num_inference_steps=LONG_STEPS, timeout=timeout)
+    following = job_queue.submit(**request_params, num_inference_steps=SHORT_STEPS)
+    assert wait_for(lambda: following.finished, WAIT_TIMEOUT)
+    assert expired.status == JobStatus.TIMEOUT
+    assert 0 < expired.step < LONG_STEPS
+    assert following.status == JobStatus.COMPLETED
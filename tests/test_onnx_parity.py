@@ -0,0 +1,180 @@
+"""
+ONNX Runtime后端一致性测试
+在微型模型上比较ONNX Runtime模块与PyTorch模块的输出，最大绝对误差不超过 ATOL：
+
+- 组件：文本编码器、UNet（带与不带ControlNet残差）、VAE解码器
+- 端到端：基础管道、ControlNet管道以及融合LoRA后重新导出，相同种子生成的潜变量
+
+未安装 onnxruntime/onnx 时跳过。
+"""
+
+import pytest
+import yaml
+
+pytest.importorskip('onnxruntime')
+pytest.importorskip('onnx')
+
+# 允许的最大绝对误差
+ATOL = 1e-3
+
+# 场景名称 -> (是否使用ControlNet, 是否融合LoRA)；按顺序执行，LoRA融合后不再卸载
+SCENARIOS = {
+    'base': (False, False),
+    'controlnet': (True, False),
+    'controlnet_lora': (True, True),
+}
+
+
+def max_abs_error(expected, actual) -> float:
+    return float((expected.float() - actual.float()).abs().max())
+
+
+@pytest.fixture(scope='module')
+def components(tiny_config, tmp_path_factory):
+    """微型管道、ControlNet，以及导出后对应的ONNX Runtime模块"""
+    import torch
+    from diffusers import ControlNetModel, StableDiffusionPipeline
+
+    from src.core.onnx_backend import OnnxBackend, path_fingerprint
+
+    models_dir = tiny_config.parent
+    pipeline = StableDiffusionPipeline.from_pretrained(str(models_dir / 'sd'), torch_dtype=torch.float32)
+    controlnet = ControlNetModel.from_pretrained(str(models_dir / 'controlnet'), torch_dtype=torch.float32)
+    backend = OnnxBackend(
+        {'cache_dir': str(tmp_path_factory.mktemp('onnx_cache'))},
+        path_fingerprint(str(models_dir / 'sd')),
+        num_threads=2
+    )
+    backend.prepare(pipeline, [])
+    return pipeline, controlnet, backend.wrap(pipeline)
+
+
+@pytest.fixture(scope='module')
+def unet_inputs(components):
+    """UNet输入：CFG两个分支的潜变量、时间步与文本嵌入"""
+    import torch
+    from benchmarks.suite import PROMPT
+
+    pipeline, _, _ = components
+    tokenizer = pipeline.tokenizer
+    input_ids = tokenizer(
+        [PROMPT, ''], padding='max_length', max_length=tokenizer.model_max_length,
+        truncation=True, return_tensors='pt'
+    ).input_ids
+    generator = torch.Generator().manual_seed(0)
+    sample_size = pipeline.unet.config.sample_size
+    with torch.no_grad():
+        hidden_states = pipeline.text_encoder(input_ids)[0]
+    return {
+        'input_ids': input_ids,
+        'sample': torch.randn(2, pipeline.unet.config.in_channels, sample_size, sample_size, generator=generator),
+        'timestep': torch.tensor(500),
+        'encoder_hidden_states': hidden_states,
+    }
+
+
+def test_text_encoder(components, unet_inputs):
+    import torch
+
+    pipeline, _, modules = components
+    with torch.no_grad():
+        expected = pipeline.text_encoder(unet_inputs['input_ids'])[0]
+        actual = modules['text_encoder'](unet_inputs['input_ids'])[0]
+    assert actual.shape == expected.shape
+    assert max_abs_error(expected, actual) <= ATOL
+
+
+@pytest.mark.parametrize('controlled', [False, True], ids=['plain', 'controlnet'])
+def test_unet(components, unet_inputs, controlled):
+    import torch
+    from benchmarks.suite import control_image
+
+    pipeline, controlnet, modules = components
+    sample, timestep, hidden_states = (unet_inputs[name] for name in ('sample', 'timestep', 'encoder_hidden_states'))
+    residuals = {}
+    with torch.no_grad():
+        if controlled:
+            image = torch.from_numpy(control_image()).permute(2, 0, 1).float().div(255)
+            image = image.unsqueeze(0).expand(sample.shape[0], -1, -1, -1)
+            down, mid = controlnet(sample, timestep, hidden_states, controlnet_cond=image, return_dict=False)
+            residuals = {'down_block_additional_residuals': down, 'mid_block_additional_residual': mid}
+        expected = pipeline.unet(sample, timestep, hidden_states, **residuals).sample
+        actual = modules['unet'](sample, timestep, hidden_states, **residuals).sample
+    assert actual.shape == expected.shape
+    assert max_abs_error(expected, actual) <= ATOL
+
+
+def test_vae_decoder(components, unet_inputs):
+    import torch
+
+    pipeline, _, modules = components
+    latent = unet_inputs['sample'][:1]
+    with torch.no_grad():
+        expected = pipeline.vae.decoder(latent)
+        actual = modules['vae_decoder'](latent)
+    assert actual.shape == expected.shape
+    assert max_abs_error(expected, actual) <= ATOL
+
+
+def write_backend_config(config_path, output_dir, backend: str) -> str:
+    """写出指定推理后端的配置副本（关闭会改变数值的优化，使两个后端可以逐元素比较）"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    hardware = config['hardware']
+    hardware['backend'] = backend
+    hardware.setdefault('onnx', {})['cache_dir'] = str(output_dir / 'onnx_cache')
+    hardware.setdefault('compile', {})['enabled'] = False
+    hardware.setdefault('cpu_optimization', {})['enabled'] = False
+    config['performance'].setdefault('token_merging', {})['enabled'] = False
+    config['generation']['cfg_truncation'] = 1.0
+
+    path = output_dir / f'config_{backend}.yaml'
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+    return str(path)
+
+
+def generate_latents(config_path: str):
+    """依次执行各场景，返回 场景 -> 潜变量"""
+    import torch
+    from PIL import Image
+    from benchmarks.suite import PROMPT, control_image
+    from benchmarks.tiny_models import TINY_LORAS
+
+    from src.core.ai_engine import AIEngine
+    from src.core.config import read_config
+
+    engine = AIEngine(read_config(config_path))
+    control = Image.fromarray(control_image(engine.config.generation.width))
+    latents = {}
+    try:
+        for scenario, (use_controlnet, use_lora) in SCENARIOS.items():
+            if use_controlnet:
+                assert engine.prepare_controlnet('canny')
+            if use_lora:
+                assert engine.load_lora(next(iter(TINY_LORAS)))
+            latents[scenario] = torch.stack(list(engine.generate_images(
+                PROMPT, controlnet_input=control if use_controlnet else None,
+                num_images=2, seed=42, output_type='latent'
+            ))).float()
+    finally:
+        engine.cleanup()
+    return latents
+
+
+@pytest.fixture(scope='module')
+def pipeline_latents(tiny_config, tmp_path_factory):
+    """PyTorch后端与ONNX Runtime后端各场景生成的潜变量"""
+    output_dir = tmp_path_factory.mktemp('onnx_parity')
+    return {
+        backend: generate_latents(write_backend_config(tiny_config, output_dir, backend))
+        for backend in ('torch', 'onnxruntime')
+    }
+
+
+@pytest.mark.parametrize('scenario', list(SCENARIOS))
+def test_pipeline(pipeline_latents, scenario):
+    expected = pipeline_latents['torch'][scenario]
+    actual = pipeline_latents['onnxruntime'][scenario]
+    assert actual.shape == expected.shape
+    assert max_abs_error(expected, actual) <= ATOL